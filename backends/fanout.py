@@ -0,0 +1,202 @@
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+from zlib import crc32
+
+from logger import log
+from models.constants import MANY_CARD
+from models.subscription_index import SubscriptionIndex, log_missing
+from packet.publish import PreparedPublish
+from protocols.create_messages_for_subscriptions import create_messages_for_subscriptions
+
+# how long a worker gets to exit before it is killed
+JOIN_TIMEOUT = 5
+
+
+def run_fanout_worker(connection: Connection):
+    """
+    Runs inside its own process, holds one shard of the subscriptions.
+    Receives (changes, rows), applies the changes, matches the rows and
+    sends back (missing, [(clients, topic, data, heads), ...]), where the
+    heads are the encoded PUBLISH for every qos the clients subscribed with
+    """
+    index = SubscriptionIndex()
+    try:
+        while True:
+            request = connection.recv()
+            if request is None:
+                break
+            changes, rows = request
+            missing = index.apply(changes)
+            results = []
+            if rows:
+                for clients, topic, data in create_messages_for_subscriptions(index, rows):
+                    publish = PreparedPublish(topic, data)
+                    heads = {qos: publish.get_head(qos) for qos in set(clients.values())}
+                    results.append((clients, topic, data, heads))
+            connection.send((missing, results))
+    except (KeyboardInterrupt, InterruptedError, EOFError):
+        pass
+
+
+class FanoutWorkerGone(ConnectionError):
+    """
+    A fan-out worker died and could not be brought back
+    """
+
+
+class FanoutPool:
+    """
+    Spreads the subscriptions across worker processes by the hash of their first
+    level, so matching and building messages for different top level namespaces
+    runs on different cores. A "+" in the first level can match any row, those
+    subscriptions live on the first worker, which then gets every row; with
+    many of them, that worker is what the whole pool waits on.
+    The pool keeps every shard's subscriptions, a worker that dies is
+    started again with them and given its share of the pass once more
+    """
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.connections: list[Connection] = []
+        self.processes: list[Process] = []
+        # {(nodes, client_id): qos} of every shard, to start a worker again with
+        self.shard_subscriptions: list[dict[tuple, int]] = [{} for _ in range(workers)]
+        # the subscriptions that start with "+", as long as there are any shard 0 sees every row
+        self.wildcard_roots: set[tuple] = set()
+
+    def __enter__(self):
+        if not self.workers:
+            return
+        log.info(f"Starting {self.workers} fan-out workers...", end="")
+        for i in range(self.workers):
+            connection, process = self.start_worker(i)
+            self.connections.append(connection)
+            self.processes.append(process)
+        log.info("Done")
+
+    @staticmethod
+    def start_worker(i: int) -> tuple[Connection, Process]:
+        connection, child_connection = Pipe()
+        process = Process(
+            target=run_fanout_worker,
+            args=(child_connection,),
+            name=f"FanoutWorker-{i}",
+            daemon=True,
+        )
+        process.start()
+        child_connection.close()
+        return connection, process
+
+    def restart_worker(self, i: int):
+        """
+        Replace a dead worker with a new one holding the shard's subscriptions
+        """
+        log.error(f"Fan-out worker {i} is gone, starting it again")
+        self.connections[i].close()
+        if self.processes[i].is_alive():
+            self.processes[i].kill()
+        self.connections[i], self.processes[i] = self.start_worker(i)
+        subscriptions = [
+            (list(nodes), client_id, qos)
+            for (nodes, client_id), qos in self.shard_subscriptions[i].items()
+        ]
+        self.request(i, subscriptions, None)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self.processes:
+            return
+        log.info("Stopping fan-out workers...", end="")
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(JOIN_TIMEOUT)
+            if process.is_alive():
+                process.kill()
+        for connection in self.connections:
+            connection.close()
+        self.connections.clear()
+        self.processes.clear()
+        log.info("Done")
+
+    def shard(self, level: str) -> int:
+        if level == MANY_CARD:
+            return 0
+        return crc32(level.encode()) % self.workers
+
+    def commit(self, changes: list[tuple]):
+        """
+        Send the changes to the shards they belong to, in order
+        """
+        shards = [[] for _ in range(self.workers)]
+        for change in changes:
+            nodes, client_id, qos = change
+            shard = self.shard(nodes[0])
+            key = (tuple(nodes), client_id)
+            if qos is None:
+                self.shard_subscriptions[shard].pop(key, None)
+            else:
+                self.shard_subscriptions[shard][key] = qos
+            if nodes[0] == MANY_CARD:
+                if qos is None:
+                    self.wildcard_roots.discard(key)
+                else:
+                    if not self.wildcard_roots and self.workers > 1:
+                        log.warn("A subscription starts with +, every row goes to the first fan-out worker")
+                    self.wildcard_roots.add(key)
+            shards[shard].append(change)
+        for missing, _ in self.exchange(shards, [None] * self.workers):
+            log_missing(missing)
+
+    def create_messages(self, rows: list) -> list:
+        """
+        Return a list of tuples of ({client_id: qos, ...}, topic, data, heads)
+        """
+        shards = [[] for _ in range(self.workers)]
+        for row in rows:
+            shards[self.shard(row[0][0])].append(row)
+        if self.wildcard_roots:
+            shards[0] = rows
+        messages = []
+        for _, results in self.exchange([None] * self.workers, shards):
+            messages.extend(results)
+        return messages
+
+    def request(self, i: int, changes: list, rows: list) -> tuple:
+        """
+        Send one worker its changes and rows and wait for its answer
+        """
+        connection = self.connections[i]
+        try:
+            connection.send((changes, rows))
+            return connection.recv()
+        except (EOFError, OSError):
+            raise FanoutWorkerGone(f"Fan-out worker {i} is gone")
+
+    def exchange(self, changes: list, rows: list) -> list[tuple]:
+        """
+        Send every shard that has something to do its changes and rows,
+        then wait for all of them to answer. A worker that died is started
+        again (which applies its changes) and sent its rows once more
+        """
+        waiting = []
+        for i, (shard_changes, shard_rows) in enumerate(zip(changes, rows)):
+            if shard_changes or shard_rows:
+                try:
+                    self.connections[i].send((shard_changes or [], shard_rows))
+                    sent = True
+                except OSError:
+                    sent = False
+                waiting.append((i, shard_rows, sent))
+        answers = []
+        for i, shard_rows, sent in waiting:
+            if sent:
+                try:
+                    answers.append(self.connections[i].recv())
+                    continue
+                except (EOFError, OSError):
+                    pass
+            self.restart_worker(i)
+            answers.append(self.request(i, [], shard_rows) if shard_rows else ([], []))
+        return answers
@@ -0,0 +1,60 @@
+from json import loads
+
+import pytest
+
+from backends.fanout import FanoutPool
+
+
+def row(topic: str, data: bytes):
+    return tuple(topic.split("/")), data, 0
+
+
+def by_topic(messages: list) -> dict:
+    return {topic: (clients, data) for clients, topic, data, _ in messages}
+
+
+@pytest.fixture
+def pool():
+    pool = FanoutPool(workers=2)
+    with pool:
+        yield pool
+
+
+ROWS = [row("light/bedroom/is_on", b"1"), row("sensor/attic/temp", b"12")]
+
+
+class TestFanoutPool:
+    def test_rows_reach_both_shards(self, pool):
+        """
+        light and sensor hash to different workers, the "+" filter lives on
+        the first one and still sees the rows of both
+        """
+        assert pool.shard("light") != pool.shard("sensor")
+        pool.commit([
+            (["light", "bedroom", "is_on"], "a", 1),
+            (["sensor", "attic", "temp"], "b", 0),
+            (["+", "+", "+"], "c", 0),
+        ])
+        messages = by_topic(pool.create_messages(ROWS))
+        assert messages["light/bedroom/is_on"] == ({"a": 1}, b"1")
+        assert messages["sensor/attic/temp"] == ({"b": 0}, b"12")
+        clients, data = messages["+/+/+"]
+        assert clients == {"c": 0}
+        assert loads(data) == {"light": {"bedroom": {"is_on": "1"}}, "sensor": {"attic": {"temp": "12"}}}
+
+    def test_dead_worker_is_started_again(self, pool):
+        pool.commit([
+            (["light", "bedroom", "is_on"], "a", 0),
+            (["sensor", "attic", "temp"], "b", 0),
+            (["sensor", "attic", "temp"], "c", 0),
+        ])
+        pool.commit([(["sensor", "attic", "temp"], "c", None)])
+        dead = pool.processes[pool.shard("sensor")]
+        dead.kill()
+        dead.join()
+        messages = by_topic(pool.create_messages(ROWS))
+        assert pool.processes[pool.shard("sensor")] is not dead
+        assert messages == {
+            "light/bedroom/is_on": ({"a": 0}, b"1"),
+            "sensor/attic/temp": ({"b": 0}, b"12"),
+        }
@@ -0,0 +1,98 @@
+"""
+Times matching rows against the subscription index with rows walked one by one,
+with rows grouped at every level, and with the default (adaptive) choice.
+Only the matching is timed, building the messages costs the same either way.
+
+    python -m benchmarks.match_subscriptions
+
+The sweep shows where grouping starts to pay off, which is what GROUP_ROWS
+in models/subscription_index.py is set from
+"""
+import sys
+from timeit import timeit
+
+from models.subscription_index import SubscriptionIndex
+
+
+def walk(count: int, children) -> bool:
+    return False
+
+
+def group(count: int, children) -> bool:
+    return True
+
+
+def row(topic: str, data: bytes = b"1"):
+    return tuple(topic.split("/")), data, 0
+
+
+def flat_fan_out(subscriptions: int) -> SubscriptionIndex:
+    """
+    One client per device, the way dashboards subscribe to single devices
+    """
+    index = SubscriptionIndex()
+    for i in range(subscriptions):
+        index.insert(["device", str(i), "state"], f"client{i}", 0)
+    index.insert(["device", "+", "state"], "dashboard", 0)
+    return index
+
+
+def deep_hierarchy() -> SubscriptionIndex:
+    """
+    A few wide wildcard subscriptions over site/+/device/+/sensor/+
+    """
+    index = SubscriptionIndex()
+    index.insert(["site", "+", "device", "+", "sensor", "+"], "collector", 0)
+    index.insert(["site", "1", "device", "+", "sensor", "temp"], "site1", 0)
+    index.insert(["site", "+", "device", "7", "sensor", "+"], "device7", 0)
+    return index
+
+
+def graft_rows(count: int) -> list:
+    return [row(f"site/{i % 10}/device/{i % 100}/sensor/{i}") for i in range(count)]
+
+
+def device_rows(count: int, devices: int) -> list:
+    return [row(f"device/{i % devices}/state", str(i).encode()) for i in range(count)]
+
+
+def run(index: SubscriptionIndex, rows: list, number: int, choose=None) -> float:
+    """
+    Microseconds per match, choose replaces SubscriptionIndex.group to force one loop
+    """
+    if choose is not None:
+        index.group = choose
+    try:
+        seconds = timeit(lambda: index.match(rows), number=number)
+    finally:
+        if choose is not None:
+            del index.group
+    return seconds / number * 1e6
+
+
+def compare(name: str, index: SubscriptionIndex, rows: list, number: int):
+    walked = run(index, rows, number, walk)
+    grouped = run(index, rows, number, group)
+    adaptive = run(index, rows, number)
+    print(f"{name:<42} {len(rows):>7} {walked:>12.1f} {grouped:>12.1f} {adaptive:>12.1f}")
+
+
+def main():
+    print(f"{'us per pass':<42} {'rows':>7} {'walk':>12} {'group':>12} {'adaptive':>12}")
+    flat = flat_fan_out(200000)
+    compare("1 row, 200k flat subscriptions", flat, device_rows(1, 200000), 2000)
+    compare("1000 rows, 200k flat subscriptions", flat, device_rows(1000, 200000), 20)
+    deep = deep_hierarchy()
+    compare("100k row graft, 3 deep subscriptions", deep, graft_rows(100000), 3)
+    print()
+    print("sweep: rows for one device namespace against 200k flat subscriptions")
+    for count in (1, 2, 4, 8, 16, 32, 64, 256, 1024):
+        compare(f"  {count} rows over 4 devices", flat, device_rows(count, 4), max(20, 20000 // count))
+    print()
+    print("sweep: rows for the deep hierarchy")
+    for count in (1, 2, 4, 8, 16, 32, 64, 256, 1024):
+        compare(f"  {count} rows", deep, graft_rows(count), max(20, 20000 // count))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,49 @@
 import dataclasses
 import ssl
-from queue import Queue
+from queue import Empty, Queue
 from functools import cached_property
-from threading import Lock
+from time import monotonic
 
+from backends.fanout import FanoutPool, FanoutWorkerGone
 from logger import log
 from tables.manager import TableManager
 from tree.manager import TreeManager
 from protocols.create_messages_for_subscriptions import create_messages_for_subscriptions
 from broker.context import BrokerContext
 from models.client import Client
+from models.message_queue import ActionCounter, ConflatingQueue, FifoQueue, MessageQueue, POLICIES
 from models.messages import IncomingMessage, OutgoingMessage
 from models.topic import Topic
-from servers.socket import SocketServer
+from packet.publish import PreparedPublish
+from servers.aio.handler import AsyncHandler
+from servers.aio.server import AsyncServer
+from servers.aio.websocket import AsyncWebsocketHandler
+from servers.dispatcher import Dispatcher
+from servers.selector.handler import SelectorHandler
+from servers.selector.server import SelectorServer
+from servers.selector.websocket import SelectorWebsocketHandler
+from servers.socket import SocketServer, SocketHandler
 from servers.websocket.handler import WebsocketHandler
 from utils.field import default_factory
 
+# engine: (server class, tcp handler class, websocket handler class)
+ENGINES = {
+    "threads": (SocketServer, SocketHandler, WebsocketHandler),
+    "asyncio": (AsyncServer, AsyncHandler, AsyncWebsocketHandler),
+    "selectors": (SelectorServer, SelectorHandler, SelectorWebsocketHandler),
+}
+
+# subscription changes that wake up an idle message loop to commit them
+MAX_WAITING_SUBSCRIPTIONS = 1000
+# how long the message loop waits for rows before it commits the waiting subscription changes anyway
+IDLE_COMMIT = 1
+
+# queue mode: the class of every client's outgoing message queue
+QUEUE_MODES = {
+    "fifo": FifoQueue,
+    "conflate": ConflatingQueue,
+}
+
 
 @dataclasses.dataclass
 class Broker(BrokerContext):
@@ -26,28 +54,98 @@ class Broker(BrokerContext):
     ws_port: int = 53535
     ssl_cert: str = None
     ssl_key: str = None
+    log_level: str = "info"
+    dispatch_workers: int = 16
+    engine: str = "threads"
+    io_threads: int = 2
+    max_inflight: int = 32
+    retry_interval: float = 20
+    max_received_qos_2: int = 64
+    queue_mode: str = "fifo"
+    max_queued_messages: int = 0
+    max_queued_bytes: int = 0
+    slow_consumer: str = "drop"
+    batch_rows: int = 1000
+    batch_latency: float = 0
+    fanout_workers: int = 0
 
     tree_manager: TreeManager = default_factory(TreeManager.setup)
     table_manager: TableManager = default_factory(TableManager.setup)
-    subscription_lock: Lock = default_factory(Lock)
     broadcast_queue: Queue = default_factory(Queue)
+    # what was done to slow consumers, by policy action
+    queue_actions: ActionCounter = default_factory(ActionCounter)
+
+    def __post_init__(self):
+        log.set_level(self.log_level)
+        if self.slow_consumer not in POLICIES:
+            raise ValueError(f"Unknown slow consumer policy {self.slow_consumer}, expected one of {list(POLICIES)}")
+
+    @cached_property
+    def dispatcher(self):
+        return Dispatcher(
+            name="Packet Dispatcher",
+            workers=int(self.dispatch_workers),
+        )
+
+    @cached_property
+    def fanout_pool(self) -> FanoutPool:
+        return FanoutPool(workers=int(self.fanout_workers))
+
+    @cached_property
+    def engine_classes(self):
+        try:
+            return ENGINES[self.engine]
+        except KeyError:
+            raise ValueError(f"Unknown engine {self.engine}, expected one of {list(ENGINES)}")
+
+    @cached_property
+    def queue_class(self):
+        try:
+            return QUEUE_MODES[self.queue_mode]
+        except KeyError:
+            raise ValueError(f"Unknown queue mode {self.queue_mode}, expected one of {list(QUEUE_MODES)}")
+
+    def create_message_queue(self, client) -> MessageQueue:
+        return self.queue_class(
+            max_messages=int(self.max_queued_messages),
+            max_bytes=int(self.max_queued_bytes),
+            policy=self.slow_consumer,
+            name=client,
+            on_overflow=client.close,
+            actions=self.queue_actions,
+        )
+
+    @property
+    def queue_stats(self) -> dict:
+        """
+        The actions taken so far, and the queues of the clients that are being throttled
+        """
+        throttled = {}
+        for client_id, client in list(self.clients.items()):
+            stats = client.message_queue.stats
+            if stats["dropped"] or stats["blocked"] or stats["disconnected"]:
+                throttled[client_id] = stats
+        return {"actions": self.queue_actions.snapshot(), "clients": throttled}
 
     @cached_property
     def websocket_server(self):
-        return SocketServer(
+        server_class, _, handler_class = self.engine_classes
+        return server_class(
             name="WebSocket Server",
             host=self.ws_host or self.host,
             port=self.ws_port,
-            handler_class=WebsocketHandler,
+            handler_class=handler_class,
             # ssl_context=self.ssl_context,
         )
 
     @cached_property
     def tcp_server(self):
-        return SocketServer(
+        server_class, handler_class, _ = self.engine_classes
+        return server_class(
             name="TCP Server",
             host=self.tcp_host or self.host,
             port=self.tcp_port,
+            handler_class=handler_class,
         )
 
     @cached_property
@@ -69,15 +167,52 @@ class Broker(BrokerContext):
             log.info("Interrupted!")
 
     def main_loop(self):
-        with self.tree_manager, self.tcp_server, self.websocket_server: #table_manager
+        with self.fanout_pool, self.tree_manager, self.dispatcher, self.tcp_server, self.websocket_server: #table_manager
             while self.running:
-                rows = self.broadcast_queue.get(block=True)
-                if rows:
-                    with self.subscription_lock:
-                        try:
-                            self.process_outgoing_rows(rows)
-                        except:
-                            log.traceback("Broker.main_loop")
+                rows = self.next_rows()
+                try:
+                    self.commit_subscriptions()
+                    if rows:
+                        self.process_outgoing_rows(rows)
+                except FanoutWorkerGone:
+                    # the subscriptions of its shard are gone with it, matching would miss them
+                    log.traceback("Broker.main_loop")
+                    log.error("Stopping, a fan-out worker could not be started again")
+                    self.running = False
+                except:
+                    log.traceback("Broker.main_loop")
+            actions = self.queue_actions.snapshot()
+            if actions:
+                log.info("Slow consumers", **actions)
+
+    def next_rows(self) -> list:
+        """
+        Wait for the next list of rows, then drain whatever else is waiting into it (up to
+        batch_rows rows, waiting at most batch_latency seconds for more), so a burst of
+        publishes is matched in one pass and a subscriber gets one message for all of it.
+        The rows of one publish are never split up, so the last one can take a pass past batch_rows.
+        Returns no rows if nothing came in for IDLE_COMMIT seconds
+        """
+        try:
+            rows = self.broadcast_queue.get(timeout=IDLE_COMMIT)
+        except Empty:
+            return []
+        max_rows = int(self.batch_rows)
+        if len(rows) >= max_rows:
+            return rows
+        rows = list(rows)
+        deadline = monotonic() + float(self.batch_latency)
+        while len(rows) < max_rows:
+            remaining = deadline - monotonic()
+            try:
+                if remaining > 0:
+                    more = self.broadcast_queue.get(timeout=remaining)
+                else:
+                    more = self.broadcast_queue.get_nowait()
+            except Empty:
+                break
+            rows.extend(more)
+        return rows
 
     def add_client(self, client: Client):
         prev_client = self.clients.get(client.id)
@@ -92,13 +227,31 @@ class Broker(BrokerContext):
             except KeyError:
                 log.warn(f"Client {client} is not in client list")
 
-    def process_outgoing_rows(self, rows: list):
+    def commit_subscriptions(self):
+        if not self.fanout_pool.workers:
+            self.subscriptions.commit()
+            return
+        changes = self.subscriptions.take_changes()
+        if changes:
+            self.fanout_pool.commit(changes)
+
+    def create_messages(self, rows: list) -> list:
+        """
+        Return a list of tuples of ({client_id: qos, ...}, topic, data, heads),
+        heads are None unless a fan-out worker encoded them
+        """
+        if self.fanout_pool.workers:
+            return self.fanout_pool.create_messages(rows)
         messages = create_messages_for_subscriptions(
             self.subscriptions,
             rows,
         )
-        for client_list, topic_nodes, data in messages:
-            topic = str(Topic.from_nodes(topic_nodes))
+        return [(client_list, topic, data, None) for client_list, topic, data in messages]
+
+    def process_outgoing_rows(self, rows: list):
+        for client_list, topic, data, heads in self.create_messages(rows):
+            # serialized once, no matter how many clients subscribe
+            publish = PreparedPublish(topic, data, heads)
             for client_id, qos in client_list.items():
                 client = self.clients.get(client_id)
                 if client is None:
@@ -107,6 +260,7 @@ class Broker(BrokerContext):
                     topic=topic,
                     qos=qos,
                     data=data,
+                    publish=publish,
                 )
                 client.queue_message(message)
 
@@ -128,19 +282,19 @@ class Broker(BrokerContext):
         elif topic.for_table:
             message = self.table_manager.get_message(topic, qos=qos)
             client.queue_message(message)
-        with self.subscription_lock:
-            client_set = self.subscriptions << topic.node_list
-            client_set[client.id] = qos
+        self.subscriptions_changed(self.subscriptions.subscribe(topic.node_list, client.id, qos))
         return True
 
     def unsubscribe(self, client: Client, *topics: str):
-        with self.subscription_lock:
-            for topic_str in topics:
-                topic = Topic.from_str(topic_str)
-                client_set = self.subscriptions << topic.node_list
-                got_id = client_set.pop(client.id, False)
-                if not got_id:
-                    log.warn(f"Subscription {topic_str} not found for {client}")
-                if not client_set:
-                    self.subscriptions.cascade_delete(topic.node_list)
+        for topic_str in topics:
+            topic = Topic.from_str(topic_str)
+            self.subscriptions_changed(self.subscriptions.unsubscribe(topic.node_list, client.id))
         return True
+
+    def subscriptions_changed(self, waiting: int):
+        """
+        The changes are committed by the message loop before its next pass, or
+        after it has been idle for a while; wake it up before too many pile up
+        """
+        if waiting >= MAX_WAITING_SUBSCRIPTIONS:
+            self.broadcast_queue.put([])
@@ -3,7 +3,7 @@ from functools import cached_property
 from typing import Any
 
 from models.client import Client
-from utils.recursive_default_dict import RecursiveDefaultDict
+from models.subscription_index import SubscriptionIndex
 
 
 class BrokerContext:
@@ -14,7 +14,7 @@ class BrokerContext:
     def __new__(cls, *args, **kwargs):
         self = BrokerContext.instance = super().__new__(cls)
         self.main_task = None
-        self.subscriptions = RecursiveDefaultDict(default_type=dict)
+        self.subscriptions = SubscriptionIndex()
         return self
 
     @cached_property
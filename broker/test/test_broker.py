@@ -1,3 +1,6 @@
+from threading import Timer
+from time import monotonic
+
 import pytest
 
 
@@ -64,4 +67,58 @@ class TestAddRemoveClient:
 
 class TestProcessRows:
     def test_process_rows(self, patched_create_messages):
-        pass
\ No newline at end of file
+        pass
+
+
+def row(topic: str) -> tuple:
+    return tuple(topic.split("/")), b"1", 0
+
+
+class TestNextRows:
+    def test_merge_within_latency(self, broker):
+        """
+        Rows published while the first ones wait out batch_latency are matched in the same pass
+        """
+        broker.batch_latency = 0.5
+        broker.broadcast_queue.put([row("light/bedroom/is_on")])
+        broker.broadcast_queue.put([row("light/kitchen/is_on"), row("light/attic/is_on")])
+        timer = Timer(0.05, broker.broadcast_queue.put, ([row("door/front/is_open")],))
+        timer.start()
+        rows = broker.next_rows()
+        timer.join()
+        assert rows == [
+            row("light/bedroom/is_on"),
+            row("light/kitchen/is_on"),
+            row("light/attic/is_on"),
+            row("door/front/is_open"),
+        ]
+        assert broker.broadcast_queue.empty()
+
+    def test_row_cap(self, broker):
+        """
+        Gathering stops at batch_rows, the rest waits for the next pass
+        """
+        broker.batch_rows = 3
+        broker.batch_latency = 0.5
+        for i in range(5):
+            broker.broadcast_queue.put([row(f"light/{i}/is_on")])
+        start = monotonic()
+        assert broker.next_rows() == [row(f"light/{i}/is_on") for i in range(3)]
+        assert monotonic() - start < 0.5
+        assert broker.next_rows() == [row(f"light/{i}/is_on") for i in range(3, 5)]
+
+    def test_lone_row(self, broker):
+        """
+        A row nothing else comes in with is held for batch_latency, no longer
+        """
+        broker.batch_latency = 0.1
+        broker.broadcast_queue.put([row("light/bedroom/is_on")])
+        start = monotonic()
+        assert broker.next_rows() == [row("light/bedroom/is_on")]
+        assert 0.1 <= monotonic() - start < 0.3
+
+    def test_no_latency(self, broker):
+        broker.broadcast_queue.put([row("light/bedroom/is_on")])
+        start = monotonic()
+        assert broker.next_rows() == [row("light/bedroom/is_on")]
+        assert monotonic() - start < 0.1
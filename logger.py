@@ -2,19 +2,51 @@ import dataclasses
 import traceback
 from contextlib import contextmanager
 from functools import partial
+from typing import Union
 
 from utils.stdout_log import print_in_yellow, print_in_green, print_in_red, print_in_magenta
 
+DEBUG = 10
+INFO = 20
+WARN = 30
+ERROR = 40
+
+LEVELS = {
+    "debug": DEBUG,
+    "info": INFO,
+    "warn": WARN,
+    "error": ERROR,
+}
+
 
 @dataclasses.dataclass
 class Logger:
+    """
+    Lines below the logger's level are dropped before anything is formatted,
+    the rest are formatted and written by a background thread
+    """
     log_info: callable = print_in_green
     log_debug: callable = partial(print_in_magenta, "[DEBUG]")
     log_warn: callable = partial(print_in_yellow, "[WARN]")
     log_error: callable = partial(print_in_red, "[ERROR]")
+    level: int = INFO
 
     _contexts: list[dict] = dataclasses.field(default_factory=lambda: [{}])
 
+    def set_level(self, level: Union[int, str]):
+        if isinstance(level, str):
+            try:
+                level = LEVELS[level.lower()]
+            except KeyError:
+                raise ValueError(f"Unknown log level {level}, expected one of {list(LEVELS)}")
+        self.level = level
+
+    def is_enabled_for(self, level: int) -> bool:
+        """
+        Check this before building anything expensive to log
+        """
+        return level >= self.level
+
     @contextmanager
     def context(self, **context):
         try:
@@ -24,20 +56,25 @@ class Logger:
             self._contexts.pop()
 
     def info(self, *args, **kwargs):
-        self.log_info(*args, **self._contexts[-1], **kwargs)
+        if self.level <= INFO:
+            self.log_info(*args, **self._contexts[-1], **kwargs)
 
     def warn(self, *args, **kwargs):
-        self.log_warn(*args, **self._contexts[-1], **kwargs)
+        if self.level <= WARN:
+            self.log_warn(*args, **self._contexts[-1], **kwargs)
 
     def debug(self, *args, **kwargs):
-        self.log_debug(*args, **self._contexts[-1], **kwargs)
+        if self.level <= DEBUG:
+            self.log_debug(*args, **self._contexts[-1], **kwargs)
 
     def error(self, *args, **kwargs):
-        self.log_error(*args, **self._contexts[-1], **kwargs)
+        if self.level <= ERROR:
+            self.log_error(*args, **self._contexts[-1], **kwargs)
 
     def traceback(self, *args, **kwargs):
-        message = traceback.format_exc()
-        self.log_error(message, *args, **kwargs)
+        if self.level <= ERROR:
+            message = traceback.format_exc()
+            self.log_error(message, *args, **kwargs)
 
 
 log = Logger()
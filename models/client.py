@@ -23,6 +23,9 @@ class Client:
         return Queue()
 
     def __str__(self):
+        if self.id is None:
+            # not connected yet, don't hold on to a name without the id
+            return f"Client {self.id}"
         return self._str
 
     def queue_message(self, message: OutgoingMessage):
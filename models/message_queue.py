@@ -0,0 +1,367 @@
+from abc import abstractmethod
+from collections import Counter, deque
+from itertools import count
+from json import loads as treeify, JSONDecodeError
+from queue import Empty
+from threading import Condition, Lock
+from time import monotonic
+from typing import Callable, Optional
+
+from logger import log
+from models.constants import EVERYTHING_CARD, MANY_CARD
+from models.messages import OutgoingMessage
+from protocols.stringify import stringify
+
+# what to do when a client's queue is over its limits
+DROP = "drop"
+BLOCK = "block"
+DISCONNECT = "disconnect"
+POLICIES = (DROP, BLOCK, DISCONNECT)
+
+# how often a blocked put checks if the queue was closed in the meantime
+BLOCK_CHECK = 1
+
+
+def has_wildcards(topic: str) -> bool:
+    return MANY_CARD in topic or EVERYTHING_CARD in topic
+
+
+def merge_trees(tree: dict, update: dict):
+    """
+    Merge update into tree, the leaves in update win
+    """
+    for key, value in update.items():
+        current = tree.get(key)
+        if isinstance(current, dict) and isinstance(value, dict):
+            merge_trees(current, value)
+        else:
+            tree[key] = value
+
+
+def parse_tree(data: bytes) -> Optional[dict]:
+    try:
+        tree = treeify(data)
+    except (JSONDecodeError, TypeError, UnicodeDecodeError):
+        return None
+    return tree if isinstance(tree, dict) else None
+
+
+def message_size(message: OutgoingMessage) -> int:
+    return len(message.data) if message.data else 0
+
+
+class ActionCounter(Counter):
+    """
+    What was done to slow consumers, shared by every queue; each queue
+    counts under its own lock, so the counter needs one of its own
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = Lock()
+
+    def add(self, action: str):
+        with self.lock:
+            self[action] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self)
+
+
+class MessageQueue:
+    """
+    A client's outgoing messages, optionally limited to max_messages and max_bytes
+    (0 is no limit). When the queue is over its limits the policy decides:
+     - drop: the oldest qos 0 messages are dropped, a client with nothing but qos > 0
+             messages waiting is disconnected
+     - block: put waits for the client to catch up, which holds up the broker
+     - disconnect: the client is disconnected
+    Only the interface of queue.Queue the handlers use is implemented
+    """
+    def __init__(
+        self,
+        max_messages: int = 0,
+        max_bytes: int = 0,
+        policy: str = DROP,
+        name: object = "",
+        on_overflow: Callable[[], None] = None,
+        actions: ActionCounter = None,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow consumer policy {policy}, expected one of {list(POLICIES)}")
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.policy = policy
+        # only turned into a string when a warning is logged, a client's name changes once it connects
+        self.name = name
+        self.on_overflow = on_overflow
+        # shared by every queue, counts what was done to slow consumers
+        self.actions = ActionCounter() if actions is None else actions
+        self.lock = Lock()
+        self.not_empty = Condition(self.lock)
+        self.not_full = Condition(self.lock)
+        self.bytes = 0
+        self.closed = False
+        self.queued = 0
+        self.max_depth = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.disconnected = False
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "depth": self.qsize(),
+            "bytes": self.bytes,
+            "max_depth": self.max_depth,
+            "queued": self.queued,
+            "dropped": self.dropped,
+            "blocked": self.blocked,
+            "disconnected": self.disconnected,
+        }
+
+    @abstractmethod
+    def qsize(self) -> int:
+        pass
+
+    @abstractmethod
+    def push(self, message: OutgoingMessage):
+        """
+        Add message, with the lock held
+        """
+
+    @abstractmethod
+    def pop(self) -> OutgoingMessage:
+        """
+        Take the oldest message, with the lock held
+        """
+
+    @abstractmethod
+    def drop_oldest(self, qos: int) -> bool:
+        """
+        Drop the oldest message with the given qos, with the lock held
+        """
+
+    def empty(self) -> bool:
+        return not self.qsize()
+
+    def over_limits(self, extra_messages: int = 0, extra_bytes: int = 0) -> bool:
+        return bool(
+            (self.max_messages and self.qsize() + extra_messages > self.max_messages)
+            or (self.max_bytes and self.bytes + extra_bytes > self.max_bytes)
+        )
+
+    def count(self, action: str):
+        self.actions.add(action)
+
+    def close(self):
+        """
+        The client is gone, drop everything and wake up whoever is blocked on us
+        """
+        with self.lock:
+            self.closed = True
+            while self.qsize():
+                self.pop()
+            self.not_full.notify_all()
+            self.not_empty.notify_all()
+
+    def put(self, message: OutgoingMessage):
+        overflow = False
+        with self.lock:
+            if self.closed:
+                return
+            if self.policy == BLOCK and self.over_limits(1, message_size(message)):
+                self.blocked += 1
+                self.count(BLOCK)
+                if self.blocked == 1:
+                    log.warn(f"{self.name} is falling behind, holding up the broker")
+                while not self.closed and self.qsize() and self.over_limits(1, message_size(message)):
+                    self.not_full.wait(BLOCK_CHECK)
+                if self.closed:
+                    return
+            self.push(message)
+            self.queued += 1
+            if self.over_limits():
+                overflow = self.relieve()
+            depth = self.qsize()
+            if depth > self.max_depth:
+                self.max_depth = depth
+            self.not_empty.notify()
+        if overflow:
+            log.warn(f"Disconnecting {self.name}, it is too far behind")
+            self.close()
+            if self.on_overflow is not None:
+                self.on_overflow()
+
+    def relieve(self) -> bool:
+        """
+        Get back under the limits, returns True if the client has to be disconnected
+        """
+        if self.policy == DROP:
+            while self.over_limits():
+                if not self.drop_oldest(0):
+                    break
+                self.dropped += 1
+                self.count(DROP)
+                if self.dropped == 1:
+                    log.warn(f"{self.name} is falling behind, dropping qos 0 messages")
+            if not self.over_limits():
+                return False
+        elif self.policy == BLOCK:
+            # the message we just waited for room for is bigger than the limits
+            return False
+        self.disconnected = True
+        self.count(DISCONNECT)
+        return True
+
+    def get_nowait(self) -> OutgoingMessage:
+        with self.lock:
+            if not self.qsize():
+                raise Empty
+            return self.take()
+
+    def get(self, block: bool = True, timeout: float = None) -> OutgoingMessage:
+        if not block:
+            return self.get_nowait()
+        with self.lock:
+            if timeout is None:
+                while not self.qsize():
+                    if self.closed:
+                        raise Empty
+                    self.not_empty.wait()
+            else:
+                end = monotonic() + timeout
+                while not self.qsize():
+                    remaining = end - monotonic()
+                    if self.closed:
+                        raise Empty
+                    if remaining <= 0:
+                        raise Empty
+                    self.not_empty.wait(remaining)
+            return self.take()
+
+    def take(self) -> OutgoingMessage:
+        message = self.pop()
+        self.not_full.notify()
+        return message
+
+
+class FifoQueue(MessageQueue):
+    """
+    Every message is sent, in the order they were queued.
+    Each qos has its own line, tagged with the order the messages were
+    queued in, so dropping the oldest qos 0 message doesn't mean a search
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (order, message) by qos
+        self.messages = (deque(), deque(), deque())
+        self.order = count()
+        self.size = 0
+
+    def qsize(self) -> int:
+        return self.size
+
+    def push(self, message: OutgoingMessage):
+        self.messages[message.qos].append((next(self.order), message))
+        self.size += 1
+        self.bytes += message_size(message)
+
+    def pop(self) -> OutgoingMessage:
+        oldest = None
+        for messages in self.messages:
+            if messages and (oldest is None or messages[0][0] < oldest[0][0]):
+                oldest = messages
+        return self.take_from(oldest)
+
+    def take_from(self, messages: deque) -> OutgoingMessage:
+        _, message = messages.popleft()
+        self.size -= 1
+        self.bytes -= message_size(message)
+        return message
+
+    def drop_oldest(self, qos: int) -> bool:
+        messages = self.messages[qos]
+        if not messages:
+            return False
+        self.take_from(messages)
+        return True
+
+
+class ConflatingQueue(MessageQueue):
+    """
+    Holds at most one unsent message per topic (subscription). A message for a topic
+    that is still waiting to be sent is merged into the waiting one, which keeps
+    its place in line: for a wildcard subscription the trees are merged (the newest
+    leaves win), otherwise the newest message replaces it
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.messages: dict[str, OutgoingMessage] = {}
+        # merged trees of the waiting messages, only stringified once they are sent
+        self.trees: dict[str, dict] = {}
+        # sizes of the conflated messages, whose data doesn't tell the whole story
+        self.sizes: dict[str, int] = {}
+        self.conflated = 0
+
+    @property
+    def stats(self) -> dict:
+        return {**super().stats, "conflated": self.conflated}
+
+    def qsize(self) -> int:
+        return len(self.messages)
+
+    def push(self, message: OutgoingMessage):
+        topic = message.topic
+        waiting = self.messages.get(topic)
+        if waiting is None:
+            self.messages[topic] = message
+            self.bytes += message_size(message)
+            return
+        self.conflated += 1
+        qos = max(waiting.qos, message.qos)
+        if has_wildcards(topic):
+            tree = self.trees.get(topic)
+            if tree is None:
+                tree = parse_tree(waiting.data)
+            update = parse_tree(message.data)
+            if tree is not None and update is not None:
+                merge_trees(tree, update)
+                self.trees[topic] = tree
+                # the merged tree is at least as big as the bigger of the two
+                size = max(message_size(waiting), message_size(message))
+                self.replace(waiting, OutgoingMessage(topic, qos, waiting.data), size)
+                return
+            self.trees.pop(topic, None)
+        if qos != message.qos:
+            message = OutgoingMessage(topic, qos, message.data)
+        self.replace(waiting, message, message_size(message))
+
+    def replace(self, waiting: OutgoingMessage, message: OutgoingMessage, size: int):
+        self.bytes += size - self.sizes.pop(waiting.topic, message_size(waiting))
+        self.sizes[message.topic] = size
+        self.messages[message.topic] = message
+
+    def pop(self) -> OutgoingMessage:
+        topic = next(iter(self.messages))
+        message = self.remove(topic)
+        tree = self.trees.pop(topic, None)
+        if tree is not None:
+            message = OutgoingMessage(topic, message.qos, stringify(tree))
+        return message
+
+    def remove(self, topic: str) -> OutgoingMessage:
+        message = self.messages.pop(topic)
+        self.bytes -= self.sizes.pop(topic, message_size(message))
+        return message
+
+    def close(self):
+        super().close()
+        self.trees.clear()
+
+    def drop_oldest(self, qos: int) -> bool:
+        for topic, message in self.messages.items():
+            if message.qos == qos:
+                self.remove(topic)
+                return True
+        return False
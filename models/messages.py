@@ -4,7 +4,7 @@ from json import loads as treeify
 from models.constants import LEAF_KEY, TOPIC_SEP
 from models.topic import Topic
 from packet.connect import ConnectPacket
-from packet.publish import PublishPacket
+from packet.publish import PublishPacket, PreparedPublish
 from protocols.get_applicable_rows import get_applicable_rows
 from protocols.flatten_message import flatten_message_into_rows
 from protocols.exceptions import DynamicMessageError
@@ -98,6 +98,11 @@ class OutgoingMessage:
     topic: str
     qos: int
     data: bytes
+    publish: PreparedPublish = dataclasses.field(default=None, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.publish is None:
+            self.publish = PreparedPublish(self.topic, self.data)
 
     @classmethod
     def from_tree_item(cls, topic: str, qos: int, tree_item):
@@ -0,0 +1,374 @@
+from threading import Lock
+from typing import Optional
+
+from logger import log
+from models.constants import MANY_CARD, TOPIC_SEP
+from protocols.is_node_static import is_node_static
+
+# the level id of a "+" node, which is kept out of the children
+WILDCARD = -1
+
+# see SubscriptionIndex.match_rows, benchmarks/match_subscriptions.py shows where it comes from
+GROUP_ROWS = 32
+
+
+class SubscriptionNode:
+    """
+    One level of a subscription filter, the children are keyed by level id
+    and the "+" child is kept on its own so matching never has to look it up
+    """
+    __slots__ = (
+        "parent", "level", "depth", "topic", "tree_levels", "children", "wildcard", "clients", "pending",
+        "subscribers", "wildcards", "depths", "max_depth",
+    )
+
+    def __init__(self, parent: Optional["SubscriptionNode"], level: int, topic: str, tree_levels: tuple):
+        self.parent = parent
+        self.level = level
+        self.depth = 0 if parent is None else parent.depth + 1
+        # the filter, as the topic of the messages sent to its subscribers
+        self.topic = topic
+        # the depths the data is nested by, empty unless the filter has a "+"
+        self.tree_levels = tree_levels
+        self.children: Optional[dict[int, SubscriptionNode]] = None
+        self.wildcard: Optional[SubscriptionNode] = None
+        # {client_id: qos} of the clients subscribed to this exact filter
+        self.clients: Optional[dict[str, int]] = None
+        # the rows matched during the current match
+        self.pending: Optional[list] = None
+        # the subscriptions at or below this node, and how many of them have a "+" below it
+        self.subscribers = 0
+        self.wildcards = 0
+        # depths[n] counts the subscriptions n levels below, a topic
+        # with more levels to go than max_depth can't match anything here
+        self.depths: list[int] = []
+        self.max_depth = -1
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.topic})"
+
+    @property
+    def empty(self) -> bool:
+        return not self.subscribers
+
+    def add(self, remaining: int, wildcard: bool):
+        self.subscribers += 1
+        if wildcard:
+            self.wildcards += 1
+        depths = self.depths
+        while len(depths) <= remaining:
+            depths.append(0)
+        depths[remaining] += 1
+        if remaining > self.max_depth:
+            self.max_depth = remaining
+
+    def discard(self, remaining: int, wildcard: bool):
+        self.subscribers -= 1
+        if wildcard:
+            self.wildcards -= 1
+        depths = self.depths
+        depths[remaining] -= 1
+        while depths and not depths[-1]:
+            depths.pop()
+        self.max_depth = len(depths) - 1
+
+
+class SubscriptionIndex:
+    """
+    Every subscription filter, as a tree of levels interned to small integers.
+    Matching a row only follows the branches its topic can reach, so the cost
+    depends on the depth of the topic and the "+" levels on the way, not on
+    how many subscriptions there are.
+    Only the message loop reads and writes the index, without locks; other
+    threads queue their changes with subscribe and unsubscribe, and the loop
+    commits them between passes, so subscription churn never waits for a pass
+    and a pass never sees half a change
+    """
+    # how many rows have to reach a node before they are grouped instead of walked one by one
+    group_rows = GROUP_ROWS
+
+    def __init__(self):
+        self.root = SubscriptionNode(None, WILDCARD, "", ())
+        self.level_ids: dict[str, int] = {}
+        self.levels: list[Optional[str]] = []
+        # how many nodes use each level, a level nobody uses is given up
+        self.level_refs: list[int] = []
+        self.free_ids: list[int] = []
+        self.count = 0
+        # (nodes, client_id, qos) waiting for the next commit, qos None removes
+        self.changes: list[tuple] = []
+        self.changes_lock = Lock()
+
+    def __len__(self):
+        return self.count
+
+    def intern(self, level: str) -> int:
+        level_id = self.level_ids.get(level)
+        if level_id is None:
+            if self.free_ids:
+                level_id = self.free_ids.pop()
+                self.levels[level_id] = level
+                self.level_refs[level_id] = 0
+            else:
+                level_id = len(self.levels)
+                self.levels.append(level)
+                self.level_refs.append(0)
+            self.level_ids[level] = level_id
+        return level_id
+
+    def release(self, level_id: int):
+        self.level_refs[level_id] -= 1
+        if not self.level_refs[level_id]:
+            del self.level_ids[self.levels[level_id]]
+            self.levels[level_id] = None
+            self.free_ids.append(level_id)
+
+    def find(self, nodes: list) -> Optional[SubscriptionNode]:
+        path = self.path(nodes)
+        return None if path is None else path[-1]
+
+    def path(self, nodes: list) -> Optional[list[SubscriptionNode]]:
+        """
+        Return the nodes from the root to the filter, if it is in the index
+        """
+        node = self.root
+        path = [node]
+        for level in nodes:
+            if level == MANY_CARD:
+                node = node.wildcard
+            elif node.children:
+                node = node.children.get(self.level_ids.get(level))
+            else:
+                node = None
+            if node is None:
+                return None
+            path.append(node)
+        return path
+
+    def get(self, nodes: list) -> Optional[dict[str, int]]:
+        """
+        Return the {client_id: qos} of the filter, if anyone is subscribed to it
+        """
+        node = self.find(nodes)
+        return None if node is None else node.clients
+
+    def subscribe(self, nodes, client_id: str, qos: int) -> int:
+        """
+        Queue an insert from any thread, return how many changes are waiting
+        """
+        with self.changes_lock:
+            self.changes.append((nodes, client_id, qos))
+            return len(self.changes)
+
+    def unsubscribe(self, nodes, client_id: str) -> int:
+        """
+        Queue a remove from any thread, return how many changes are waiting
+        """
+        with self.changes_lock:
+            self.changes.append((nodes, client_id, None))
+            return len(self.changes)
+
+    def take_changes(self) -> list[tuple]:
+        """
+        Take the queued changes, to be applied in order
+        """
+        with self.changes_lock:
+            changes, self.changes = self.changes, []
+        return changes
+
+    def apply(self, changes: list[tuple]) -> list[tuple]:
+        """
+        Apply changes in order, return the (nodes, client_id) of the removes that found nothing
+        """
+        missing = []
+        for nodes, client_id, qos in changes:
+            if qos is not None:
+                self.insert(nodes, client_id, qos)
+            elif not self.remove(nodes, client_id):
+                missing.append((nodes, client_id))
+        return missing
+
+    def commit(self) -> int:
+        """
+        Apply the queued changes in order, return how many there were
+        """
+        changes = self.take_changes()
+        log_missing(self.apply(changes))
+        return len(changes)
+
+    def insert(self, nodes: list, client_id: str, qos: int):
+        node = self.root
+        path = [node]
+        for depth, level in enumerate(nodes):
+            if level == MANY_CARD:
+                child = node.wildcard
+                if child is None:
+                    child = node.wildcard = self.create_node(node, WILDCARD, nodes[:depth + 1])
+            else:
+                level_id = self.intern(level)
+                if node.children is None:
+                    node.children = {}
+                child = node.children.get(level_id)
+                if child is None:
+                    child = node.children[level_id] = self.create_node(node, level_id, nodes[:depth + 1])
+                    self.level_refs[level_id] += 1
+            node = child
+            path.append(node)
+        if node.clients is None:
+            node.clients = {}
+        if client_id not in node.clients:
+            self.count += 1
+            self.count_path(path, nodes, SubscriptionNode.add)
+        node.clients[client_id] = qos
+
+    @staticmethod
+    def count_path(path: list[SubscriptionNode], nodes: list, update):
+        """
+        Update the counters of every node on the path of a subscription to nodes
+        """
+        length = len(nodes)
+        last_wildcard = -1
+        for depth, level in enumerate(nodes):
+            if level == MANY_CARD:
+                last_wildcard = depth
+        for depth, node in enumerate(path):
+            update(node, length - depth, last_wildcard >= depth)
+
+    @staticmethod
+    def create_node(parent: SubscriptionNode, level: int, path: list) -> SubscriptionNode:
+        if MANY_CARD in path:
+            tree_levels = tuple(depth for depth, node in enumerate(path) if not is_node_static(node))
+        else:
+            tree_levels = ()
+        return SubscriptionNode(parent, level, TOPIC_SEP.join(path), tree_levels)
+
+    def remove(self, nodes: list, client_id: str) -> bool:
+        """
+        Remove the subscription and any branches it leaves empty,
+        return False if there was no such subscription
+        """
+        path = self.path(nodes)
+        if path is None:
+            return False
+        node = path[-1]
+        if not node.clients or client_id not in node.clients:
+            return False
+        del node.clients[client_id]
+        self.count -= 1
+        self.count_path(path, nodes, SubscriptionNode.discard)
+        if not node.clients:
+            node.clients = None
+        while node is not self.root and node.empty:
+            parent = node.parent
+            if node.level == WILDCARD:
+                parent.wildcard = None
+            else:
+                del parent.children[node.level]
+                if not parent.children:
+                    parent.children = None
+                self.release(node.level)
+            node = parent
+        return True
+
+    def match(self, rows: list) -> list[tuple[SubscriptionNode, list]]:
+        """
+        Return [(node, rows), ...] for every subscribed filter the rows match,
+        the rows in the order they were given
+        """
+        touched = []
+        try:
+            self.match_rows(self.root, rows, 0, touched)
+        finally:
+            matches = [(node, node.pending) for node in touched]
+            for node in touched:
+                node.pending = None
+        return matches
+
+    def match_rows(self, node: SubscriptionNode, rows: list, depth: int, touched: list):
+        """
+        Match rows whose topics reached node, picking whichever loop is cheaper:
+        a few rows, or fewer rows than there are children to spread them over,
+        walk the tree one by one (a dict lookup per level each); otherwise the
+        rows are grouped by their level here, so the rows that share a branch
+        share the lookups, and the groups are matched against the children
+        from whichever side has fewer entries
+        """
+        children = node.children
+        if not self.group(len(rows), children):
+            for row in rows:
+                self.walk(node, row, depth, touched)
+            return
+        max_length = depth + node.max_depth
+        below = []
+        for row in rows:
+            length = len(row[0])
+            if length == depth:
+                if node.clients:
+                    add_pending(node, row, touched)
+            elif length <= max_length:
+                below.append(row)
+        if not below:
+            return
+        if node.wildcard is not None:
+            self.match_rows(node.wildcard, below, depth + 1, touched)
+        if children is None:
+            return
+        groups = {}
+        for row in below:
+            level = row[0][depth]
+            group = groups.get(level)
+            if group is None:
+                groups[level] = [row]
+            else:
+                group.append(row)
+        if len(groups) <= len(children):
+            level_ids = self.level_ids
+            for level, group in groups.items():
+                child = children.get(level_ids.get(level))
+                if child is not None:
+                    self.match_rows(child, group, depth + 1, touched)
+        else:
+            levels = self.levels
+            for level_id, child in children.items():
+                group = groups.get(levels[level_id])
+                if group is not None:
+                    self.match_rows(child, group, depth + 1, touched)
+
+    def group(self, count: int, children: Optional[dict]) -> bool:
+        """
+        Whether count rows at a node with these children are grouped or walked one by one
+        """
+        return count >= self.group_rows and (children is None or count >= len(children))
+
+    def walk(self, node: SubscriptionNode, row: tuple, depth: int, touched: list):
+        topic = row[0]
+        length = len(topic)
+        level_ids = self.level_ids
+        while depth < length:
+            if length - depth > node.max_depth:
+                # every subscription below is shorter than the topic
+                return
+            if node.wildcard is not None:
+                self.walk(node.wildcard, row, depth + 1, touched)
+            children = node.children
+            if children is None:
+                return
+            node = children.get(level_ids.get(topic[depth]))
+            if node is None:
+                return
+            depth += 1
+        if node.clients:
+            add_pending(node, row, touched)
+
+
+def add_pending(node: SubscriptionNode, row: tuple, touched: list):
+    if node.pending is None:
+        node.pending = [row]
+        touched.append(node)
+    else:
+        node.pending.append(row)
+
+
+def log_missing(missing: list[tuple]):
+    for nodes, client_id in missing:
+        log.warn(f"Subscription {TOPIC_SEP.join(nodes)} not found for {client_id}")
@@ -0,0 +1,109 @@
+from json import loads
+from queue import Empty
+from threading import Thread
+
+import pytest
+
+from models.message_queue import ActionCounter, ConflatingQueue, FifoQueue, DROP, DISCONNECT
+from models.messages import OutgoingMessage
+
+
+class TestConflatingQueue:
+    def test_fifo_across_topics(self):
+        queue = ConflatingQueue()
+        for topic in ["a", "b", "c"]:
+            queue.put(OutgoingMessage(topic, 0, b"1"))
+        assert [queue.get_nowait().topic for _ in range(3)] == ["a", "b", "c"]
+        with pytest.raises(Empty):
+            queue.get_nowait()
+
+    def test_latest_wins(self):
+        """
+        The newest message replaces the waiting one, which keeps its place in line
+        """
+        queue = ConflatingQueue()
+        queue.put(OutgoingMessage("light/bedroom/is_on", 0, b"1"))
+        queue.put(OutgoingMessage("light/kitchen/is_on", 0, b"1"))
+        queue.put(OutgoingMessage("light/bedroom/is_on", 1, b"0"))
+        assert queue.qsize() == 2
+        message = queue.get_nowait()
+        assert (message.topic, message.qos, message.data) == ("light/bedroom/is_on", 1, b"0")
+        assert message.publish.data == b"0"
+        assert queue.conflated == 1
+
+    def test_tree_merge(self):
+        queue = ConflatingQueue()
+        queue.put(OutgoingMessage("light/+/+", 0, b'{"bedroom": {"is_on": "1", "level": "3"}}'))
+        queue.put(OutgoingMessage("light/+/+", 0, b'{"bedroom": {"is_on": "0"}, "kitchen": {"is_on": "1"}}'))
+        queue.put(OutgoingMessage("light/+/+", 0, b'{"kitchen": {"level": "9"}}'))
+        message = queue.get(timeout=0)
+        assert loads(message.data) == {
+            "bedroom": {"is_on": "0", "level": "3"},
+            "kitchen": {"is_on": "1", "level": "9"},
+        }
+        assert queue.empty()
+
+    def test_get_timeout(self):
+        with pytest.raises(Empty):
+            ConflatingQueue().get(timeout=0.01)
+
+
+class TestSlowConsumer:
+    def test_drop_oldest_qos_0(self):
+        queue = FifoQueue(max_messages=2, policy=DROP)
+        queue.put(OutgoingMessage("a", 1, b"1"))
+        queue.put(OutgoingMessage("b", 0, b"2"))
+        queue.put(OutgoingMessage("c", 0, b"3"))
+        assert [queue.get_nowait().topic for _ in range(2)] == ["a", "c"]
+        assert queue.stats["dropped"] == 1
+        assert queue.actions == {DROP: 1}
+
+    def test_drop_keeps_order_across_qos(self):
+        queue = FifoQueue(max_messages=4, policy=DROP)
+        for topic, qos in [("a", 0), ("b", 2), ("c", 0), ("d", 1), ("e", 0), ("f", 0)]:
+            queue.put(OutgoingMessage(topic, qos, b"1"))
+        assert queue.bytes == 4
+        assert [queue.get_nowait().topic for _ in range(4)] == ["b", "d", "e", "f"]
+        assert queue.empty() and queue.bytes == 0
+
+    def test_shared_actions(self):
+        """
+        Queues count into the same counter from their own threads
+        """
+        actions = ActionCounter()
+
+        def overflow():
+            queue = FifoQueue(max_messages=1, policy=DROP, actions=actions)
+            for _ in range(1001):
+                queue.put(OutgoingMessage("a", 0, b"1"))
+
+        threads = [Thread(target=overflow) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert actions.snapshot() == {DROP: 8000}
+
+    def test_drop_nothing_to_drop(self):
+        """
+        qos > 0 messages are never dropped, the client is disconnected instead
+        """
+        overflows = []
+        queue = FifoQueue(max_messages=1, policy=DROP, on_overflow=lambda: overflows.append(1))
+        queue.put(OutgoingMessage("a", 1, b"1"))
+        queue.put(OutgoingMessage("b", 1, b"2"))
+        assert overflows == [1]
+        assert queue.empty() and queue.closed
+
+    def test_disconnect_on_bytes(self):
+        overflows = []
+        queue = FifoQueue(max_bytes=5, policy=DISCONNECT, on_overflow=lambda: overflows.append(1))
+        queue.put(OutgoingMessage("a", 0, b"123"))
+        assert not overflows
+        queue.put(OutgoingMessage("a", 0, b"456"))
+        assert overflows == [1]
+        assert queue.stats["disconnected"]
+        queue.put(OutgoingMessage("a", 0, b"7"))
+        assert queue.empty()
+        with pytest.raises(Empty):
+            queue.get()
@@ -0,0 +1,111 @@
+from json import loads
+
+from models.subscription_index import SubscriptionIndex
+from protocols.create_messages_for_subscriptions import create_messages_for_subscriptions
+
+
+def row(topic: str, data: bytes):
+    return topic.split("/"), data, 0
+
+
+class TestSubscriptionIndex:
+    def test_match(self):
+        index = SubscriptionIndex()
+        index.insert(["light", "bedroom", "is_on"], "a", 1)
+        index.insert(["light", "+", "is_on"], "b", 0)
+        index.insert(["light", "kitchen", "is_on"], "c", 0)
+        messages = create_messages_for_subscriptions(index, [
+            row("light/bedroom/is_on", b"1"),
+            row("light/hall/is_on", b"0"),
+            row("light/bedroom/is_on", b"0"),
+            row("light/bedroom", b"x"),
+        ])
+        by_topic = {topic: (clients, data) for clients, topic, data in messages}
+        assert by_topic.keys() == {"light/bedroom/is_on", "light/+/is_on"}
+        assert by_topic["light/bedroom/is_on"] == ({"a": 1}, b"0")
+        clients, data = by_topic["light/+/is_on"]
+        assert clients == {"b": 0}
+        assert loads(data) == {"bedroom": "0", "hall": "0"}
+
+    def test_nested_wildcards(self):
+        index = SubscriptionIndex()
+        index.insert(["+", "temp", "+"], "a", 0)
+        [(_, topic, data)] = create_messages_for_subscriptions(index, [
+            row("attic/temp/c", b"12"),
+            row("attic/temp/f", b"54"),
+            row("cellar/temp/c", b"9"),
+        ])
+        assert topic == "+/temp/+"
+        assert loads(data) == {"attic": {"c": "12", "f": "54"}, "cellar": {"c": "9"}}
+
+    def test_remove_prunes(self):
+        """
+        Removing the last subscription leaves nothing behind, not even the interned levels
+        """
+        index = SubscriptionIndex()
+        index.insert(["a", "b"], "x", 0)
+        index.insert(["a", "+", "c"], "x", 0)
+        index.insert(["a", "b"], "y", 0)
+        assert len(index) == 3
+        assert not index.remove(["a", "c"], "x")
+        assert not index.remove(["a", "b"], "z")
+        assert index.remove(["a", "b"], "x")
+        assert index.get(["a", "b"]) == {"y": 0}
+        assert index.remove(["a", "+", "c"], "x")
+        assert index.remove(["a", "b"], "y")
+        assert len(index) == 0
+        assert index.root.empty
+        assert not index.level_ids
+        assert create_messages_for_subscriptions(index, [row("a/b", b"1")]) == []
+
+    def test_commit(self):
+        """
+        Queued changes are invisible to matching until they are committed, in order
+        """
+        index = SubscriptionIndex()
+        assert index.subscribe(["a", "b"], "x", 1) == 1
+        assert index.subscribe(["a", "+"], "y", 0) == 2
+        assert create_messages_for_subscriptions(index, [row("a/b", b"1")]) == []
+        assert index.commit() == 2
+        assert len(create_messages_for_subscriptions(index, [row("a/b", b"1")])) == 2
+        index.unsubscribe(["a", "b"], "x")
+        index.subscribe(["a", "b"], "x", 2)
+        index.unsubscribe(["a", "+"], "y")
+        index.commit()
+        assert index.get(["a", "b"]) == {"x": 2}
+        assert index.get(["a", "+"]) is None
+
+    def test_counters(self):
+        index = SubscriptionIndex()
+        index.insert(["site", "+", "device", "+", "sensor", "+"], "a", 0)
+        index.insert(["site", "1", "status"], "b", 0)
+        index.insert(["site", "1", "status"], "c", 0)
+        site = index.find(["site"])
+        assert (site.subscribers, site.wildcards, site.max_depth) == (3, 1, 5)
+        device = index.find(["site", "+", "device"])
+        assert (device.subscribers, device.wildcards, device.max_depth) == (1, 1, 3)
+        assert index.find(["site", "1"]).wildcards == 0
+        # too deep for every subscription, and too shallow for the only one that is deep enough
+        assert create_messages_for_subscriptions(index, [
+            row("site/1/device/2/sensor/3/x", b"1"),
+            row("site/1/device/2/sensor", b"1"),
+        ]) == []
+        index.remove(["site", "+", "device", "+", "sensor", "+"], "a")
+        assert (site.subscribers, site.wildcards, site.max_depth) == (2, 0, 2)
+        assert index.find(["site", "+"]) is None
+
+    def test_grouped_matches_walked(self):
+        """
+        Grouping the rows at each level finds the same messages as walking them one by one
+        """
+        index = SubscriptionIndex()
+        index.insert(["site", "+", "device", "+"], "a", 0)
+        index.insert(["site", "1", "device", "+"], "b", 0)
+        index.insert(["site", "2", "device", "3"], "c", 0)
+        rows = [row(f"site/{i % 3}/device/{i % 5}", str(i).encode()) for i in range(100)]
+        walked = create_messages_for_subscriptions(index, rows)
+        index.group_rows = 0
+        grouped = create_messages_for_subscriptions(index, rows)
+        by_topic = {topic: (clients, data) for clients, topic, data in walked}
+        assert by_topic == {topic: (clients, data) for clients, topic, data in grouped}
+        assert len(grouped) == len(by_topic) == 3
@@ -0,0 +1,32 @@
+import pickle
+
+import pytest
+
+from models.topic import Topic
+
+
+class TestTopic:
+    def test_parse(self):
+        topic = Topic.from_str("@light/bedroom/is_on")
+        assert topic.node_list == ("@light", "bedroom", "is_on")
+        assert str(topic) == "@light/bedroom/is_on"
+        assert topic.for_table
+        assert topic.length == 3
+        assert topic.node == "is_on"
+        assert topic.parent == "@light/bedroom"
+        assert topic[1:] == Topic.from_nodes(["bedroom", "is_on"])
+        assert topic / "level" == "@light/bedroom/is_on/level"
+
+    def test_cached(self):
+        """
+        Parsing the same topic again returns the same immutable topic
+        """
+        topic = Topic.from_str("light/bedroom/is_on")
+        assert Topic.from_str("light/bedroom/is_on") is topic
+        with pytest.raises(AttributeError):
+            topic.levels = ("light",)
+
+    def test_pickle(self):
+        topic = Topic.from_str("light/bedroom/is_on")
+        copy = pickle.loads(pickle.dumps(topic))
+        assert copy == topic and copy.node_list == topic.node_list
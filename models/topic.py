@@ -1,32 +1,48 @@
-from functools import cached_property
-from typing import List, Optional, Union
+from functools import lru_cache
+from sys import intern
+from typing import Optional, Union
 
 from models.constants import TOPIC_SEP, TABLE_FLAG
 
+# how many parsed topics are kept around, devices tend to publish the same few over and over
+TOPIC_CACHE_SIZE = 16384
+
 
 class Topic:
-    def __init__(self, node: str, parent: "Topic" = None, full_str: str = None, node_list: list = None):
-        self.node = node
-        self.parent = parent
-        self._nodes = node_list
-        self._str = full_str
+    """
+    An immutable topic, the levels are interned strings held in a tuple;
+    Topic.from_str caches the topics it parses, so a topic that is seen
+    over and over is only split once
+    """
+    __slots__ = ("levels", "full_str", "hash")
+
+    def __init__(self, levels: tuple, full_str: str = None):
+        if full_str is None:
+            full_str = TOPIC_SEP.join(levels)
+        object.__setattr__(self, "levels", levels)
+        object.__setattr__(self, "full_str", full_str)
+        object.__setattr__(self, "hash", hash(full_str))
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __reduce__(self):
+        return self.__class__, (self.levels, self.full_str)
 
     @classmethod
-    def from_nodes(cls, nodes: list, **kwargs) -> Optional["Topic"]:
+    def from_nodes(cls, nodes, **kwargs) -> Optional["Topic"]:
         if len(nodes) == 0:
             return None
-        if len(nodes) == 1:
-            parent = None
-        else:
-            parent = cls.from_nodes(nodes[:-1])
-        return cls(nodes[-1], parent=parent, **kwargs)
+        return cls(tuple(intern(node) for node in nodes), **kwargs)
 
     @classmethod
     def from_str(cls, s: str) -> Optional["Topic"]:
+        if cls is Topic:
+            return parse_topic(s)
         return cls.from_nodes(s.split(TOPIC_SEP), full_str=s)
 
     def __truediv__(self, node: str) -> "Topic":
-        return Topic(node, parent=self)
+        return self.__class__(self.levels + (intern(node),))
 
     def __str__(self):
         return self.full_str
@@ -35,41 +51,39 @@ class Topic:
         return f"{self.__class__.__name__}({self.full_str})"
 
     def __hash__(self):
-        return self.__str__().__hash__()
+        return self.hash
 
     def __eq__(self, other):
         return str(self) == str(other)
 
-    def __getitem__(self, item: int) -> Union[str, "Topic"]:
-        r = self.node_list[item]
+    def __getitem__(self, item: Union[int, slice]) -> Union[str, "Topic"]:
+        r = self.levels[item]
         if isinstance(item, slice):
-            # ignore pycharm, r is a list
-            # noinspection PyTypeChecker
             return self.__class__.from_nodes(r)
         else:
             return r
 
-    @cached_property
-    def for_table(self) -> bool:
-        return self.node_list[0][0] == TABLE_FLAG
+    @property
+    def node(self) -> str:
+        return self.levels[-1]
 
-    @cached_property
-    def length(self):
-        return len(self.node_list)
+    @property
+    def parent(self) -> Optional["Topic"]:
+        return self[:-1]
+
+    @property
+    def for_table(self) -> bool:
+        return self.levels[0][:1] == TABLE_FLAG
 
     @property
-    def full_str(self) -> str:
-        if self._str is None:
-            self._str = TOPIC_SEP.join(self.node_list)
-        return self._str
+    def length(self) -> int:
+        return len(self.levels)
 
     @property
-    def node_list(self) -> List[str]:
-        if self._nodes is None:
-            ancestors = []
-            topic = self
-            while topic is not None:
-                ancestors.append(topic.node)
-                topic = topic.parent
-            self._nodes = list(reversed(ancestors))
-        return self._nodes
+    def node_list(self) -> tuple[str, ...]:
+        return self.levels
+
+
+@lru_cache(maxsize=TOPIC_CACHE_SIZE)
+def parse_topic(s: str) -> Topic:
+    return Topic.from_nodes(s.split(TOPIC_SEP), full_str=s)
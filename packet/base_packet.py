@@ -1,4 +1,4 @@
-from logger import log
+from logger import log, DEBUG
 from packet.payload import Payload
 
 
@@ -9,6 +9,20 @@ class PacketMismatchError(Exception):
         )
 
 
+def encode_fixed_header(first_byte: int, length: int) -> bytearray:
+    header = bytearray()
+    header.append(first_byte)
+    while True:
+        length_byte = length % 0x80
+        length //= 0x80
+        if length > 0:
+            length_byte |= 0x80
+        header.append(length_byte)
+        if length <= 0:
+            break
+    return header
+
+
 class Packet(Payload):
     type_code: int
     length: int
@@ -42,19 +56,9 @@ class Packet(Payload):
         return kwargs, byte_count
 
     def get_header_bytes(self, length) -> bytearray:
-        header = bytearray()
-        header.append((self.type_code << 4) | int(self.flags))
-        while True:
-            length_byte = length % 0x80
-            length //= 0x80
-            if length > 0:
-                length_byte |= 0x80
-            header.append(length_byte)
-            if length <= 0:
-                break
-        return header
+        return encode_fixed_header((self.type_code << 4) | int(self.flags), length)
 
-    def to_bytes(self):
+    def encode_payload(self) -> bytearray:
         cls = self.__class__
         payload = bytearray()
         for name, packet_type in cls.fields.items():
@@ -66,6 +70,14 @@ class Packet(Payload):
                 raise TypeError(f"{cls.__name__}: {name} not found")
             b = packet_type.to_bytes(data)
             payload.extend(b)
+        return payload
+
+    def to_bytes(self):
+        encoder = self.__class__.encoder
+        if encoder is None:
+            payload = self.encode_payload()
+        else:
+            payload = encoder(self.kwargs)
         length = len(payload)
         header_bytes = self.get_header_bytes(length)
         return header_bytes + payload
@@ -73,25 +85,31 @@ class Packet(Payload):
     @classmethod
     def read(cls, handler, flags=None):
         if flags is None:
+            # packet.packets imports every packet, so not until now
+            from packet.packets import infer_packet_class
             msg_type, flags = handler.decode_header()
-            cur_class = handler.infer_packet_class(msg_type)
+            cur_class = infer_packet_class(msg_type)
             if cls != cur_class:
                 raise PacketMismatchError(cls, cur_class)
         length = handler.decode_packet_length()
-        kwargs, bytes_read = cls.read_payload(handler, flags, length)
+        if cls.decoder is None:
+            kwargs, bytes_read = cls.read_payload(handler, flags, length)
+        else:
+            kwargs, bytes_read = cls.decoder(handler.read(length), flags, length)
         # noinspection PyArgumentList
         result = cls(**kwargs)
-        client_id = result.__dict__.get("client_id")
-        if client_id is None:
-            client_id = handler.id
-        log.info("Read", result, "from", client_id)
+        if log.is_enabled_for(DEBUG):
+            client_id = result.__dict__.get("client_id")
+            if client_id is None:
+                client_id = handler.id
+            log.debug("Read", result, "from", client_id)
         handler.flush()
         return result
 
     def write(self, handler):
         data = self.to_bytes()
         handler.write(data)
-        log.info("Wrote", self, "to", handler.id)
+        log.debug("Wrote", self, "to", handler.id)
 
 
 class PacketWithId(Packet):
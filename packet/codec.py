@@ -0,0 +1,91 @@
+from struct import error as struct_error
+from textwrap import indent
+from typing import Callable, Optional
+
+from packet.types.type import enabled_default
+
+# names used by the generated functions themselves,
+# field names only ever show up as string keys
+DECODER_ARGS = "buf, flags_int, length"
+ENCODER_ARGS = "kwargs"
+
+# a field that runs past the end of the packet fails the way FrameReader.read does
+PAST_END_CHECK = 'if pos > length:\n    raise IOError(f"Read past the end of the packet ({pos} > {length})")'
+TRUNCATED = (
+    "except (struct_error, IndexError) as e:\n"
+    '    raise IOError(f"Read past the end of the packet ({length} bytes): {e}") from e'
+)
+
+
+def has_default_enabled(packet_type) -> bool:
+    is_enabled = packet_type.is_enabled
+    return getattr(is_enabled, "__func__", is_enabled) is enabled_default
+
+
+def build_function(name: str, args: str, body: list[str], namespace: dict) -> Callable:
+    source = f"def {name}({args}):\n" + indent("\n".join(body), "    ")
+    exec(source, namespace)
+    return namespace[name]
+
+
+def compile_decoder(cls) -> Optional[Callable]:
+    """
+    Generate a decoder for cls, equivalent to Packet.read_payload, that reads
+    every field straight out of the packet body with precompiled structs;
+    returns None if any field has to go through the generic interpreter.
+    A truncated packet raises IOError, like it does in the generic interpreter
+    """
+    namespace = {"struct_error": struct_error}
+    body = ['kwargs = {"length": length}']
+    flag_class = cls.__annotations__.get("flag_class")
+    if flag_class:
+        namespace["flags_by_int"] = flag_class.by_int
+        body.append('kwargs["flags"] = flags_by_int[flags_int]')
+    body.append("pos = 0")
+    fields = []
+    for i, (name, packet_type) in enumerate(cls.fields.items()):
+        ref = f"field_{i}"
+        source = packet_type.decode_source(ref)
+        if source is None:
+            return None
+        namespace.update(packet_type.codec_namespace(ref))
+        lines = [source, PAST_END_CHECK, f"kwargs[{name!r}] = value"]
+        if has_default_enabled(packet_type):
+            fields.extend(lines)
+        else:
+            namespace[f"{ref}_enabled"] = packet_type.is_enabled
+            fields.append('kwargs["length"] = length - pos')
+            fields.append(f"if {ref}_enabled(None, **kwargs):")
+            fields.append(indent("\n".join(lines), "    "))
+    if fields:
+        body.append("try:")
+        body.append(indent("\n".join(fields), "    "))
+        body.append(TRUNCATED)
+    body.append('kwargs["length"] = length')
+    body.append('kwargs["flags"] = flags_int')
+    body.append("return kwargs, pos")
+    return build_function(f"decode_{cls.__name__}", DECODER_ARGS, body, namespace)
+
+
+def compile_encoder(cls) -> Optional[Callable]:
+    """
+    Generate an encoder for cls that turns the packet's kwargs into
+    its payload bytes, equivalent to the generic loop in Packet.encode_payload
+    """
+    namespace = {}
+    body = ["parts = []"]
+    for i, (name, packet_type) in enumerate(cls.fields.items()):
+        ref = f"field_{i}"
+        source = packet_type.encode_source(ref)
+        if source is None:
+            return None
+        namespace.update(packet_type.codec_namespace(ref))
+        lines = [f"value = kwargs.get({name!r})", source]
+        if has_default_enabled(packet_type):
+            body.extend(lines)
+        else:
+            namespace[f"{ref}_enabled"] = packet_type.is_enabled
+            body.append(f"if {ref}_enabled(None, **kwargs):")
+            body.append(indent("\n".join(lines), "    "))
+    body.append('return b"".join(parts)')
+    return build_function(f"encode_{cls.__name__}", ENCODER_ARGS, body, namespace)
@@ -32,12 +32,24 @@ all_packets = [
 ]
 
 
+# the fixed header has 4 bits for the packet type
+PACKET_TYPES = 16
+
+# packet classes indexed by type code, None for the codes we don't know
+packet_table = [None] * PACKET_TYPES
+for _cls in all_packets:
+    packet_table[_cls.type_code] = _cls
+
+
 class UnknownPacketError(Exception):
     pass
 
 
 def infer_packet_class(packet_type: int):
-    for cls in all_packets:
-        if cls.type_code == packet_type:
-            return cls
-    raise UnknownPacketError(packet_type)
+    try:
+        cls = packet_table[packet_type]
+    except IndexError:
+        cls = None
+    if cls is None:
+        raise UnknownPacketError(packet_type)
+    return cls
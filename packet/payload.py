@@ -2,6 +2,7 @@ import inspect
 from collections import OrderedDict
 from functools import cached_property
 
+from packet.codec import compile_decoder, compile_encoder
 from packet.types.type import PacketType
 
 
@@ -20,6 +21,12 @@ class PayloadMeta(type):
                 fields[name] = packet_type
         super().__init__(name, bases, dct)
         cls.fields = fields
+        # specialized codecs for this class, None when a field
+        # can only be handled by the generic interpreter
+        decoder = compile_decoder(cls)
+        encoder = compile_encoder(cls)
+        cls.decoder = decoder and staticmethod(decoder)
+        cls.encoder = encoder and staticmethod(encoder)
 
 
 class Payload(object, metaclass=PayloadMeta):
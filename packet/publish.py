@@ -1,9 +1,15 @@
-from packet.base_packet import PacketWithId
+from functools import cached_property
+
+from packet.base_packet import PacketWithId, encode_fixed_header
 from packet.types.dynamic_str import dynamic_str
 from packet.types.flag import PacketFlag
 from packet.types.flag_group import PacketFlagGroup
 from packet.types.packet_id import packet_id
 from packet.types.remaining_bytes import remaining_bytes
+from packet.types.static_int import INT_STRUCTS
+
+packet_id_struct = INT_STRUCTS[2]
+DUP_FLAG = 0x08
 
 
 class QOSFlag(PacketFlag):
@@ -21,6 +27,9 @@ class QOSFlag(PacketFlag):
 class PublishFlags(PacketFlagGroup):
     retain: 0x01
     qos: QOSFlag
+    dup: DUP_FLAG
+
+    defaults = {"dup": False}
 
 
 class PublishPacket(PacketWithId):
@@ -33,3 +42,43 @@ class PublishPacket(PacketWithId):
     @id.enabled
     def enable_id(self, flags, **_):
         return flags.qos > 0
+
+
+class PreparedPublish:
+    """
+    A PUBLISH that is serialized once and shared by every client it fans out to,
+    each client only patches in its own fixed header flags and packet id;
+    heads that were already encoded (by a fan-out worker) can be handed in
+    """
+    def __init__(self, topic: str, data: bytes, heads: dict = None):
+        self.topic = topic
+        self.data = data
+        self.heads = {} if heads is None else heads
+
+    @cached_property
+    def topic_bytes(self) -> bytes:
+        return dynamic_str.to_bytes(self.topic)
+
+    def get_head(self, qos: int) -> bytes:
+        """
+        Everything up to the packet id, for qos 0 that is the whole packet
+        """
+        head = self.heads.get(qos)
+        if head is None:
+            data_length = len(self.data) if self.data else 0
+            id_length = 2 if qos > 0 else 0
+            length = len(self.topic_bytes) + id_length + data_length
+            first_byte = (PublishPacket.type_code << 4) | QOSFlag.write(0, qos)
+            head = encode_fixed_header(first_byte, length) + self.topic_bytes
+            if qos == 0 and self.data:
+                head += self.data
+            head = self.heads[qos] = bytes(head)
+        return head
+
+    def to_bytes(self, qos: int, packet_id: int = None, dup: bool = False) -> bytes:
+        head = self.get_head(qos)
+        if qos == 0:
+            return head
+        if dup:
+            head = bytes([head[0] | DUP_FLAG]) + head[1:]
+        return b"".join((head, packet_id_struct.pack(packet_id), self.data or b""))
@@ -1,7 +1,13 @@
 from packet.base_packet import PacketWithId
 from packet.types.packet_id import packet_id
 
+# the spec reserves 0b0010 for the flags of a PUBREL
+PUBREL_FLAGS = 0x02
+
 
 class PublishReleasedPacket(PacketWithId):
     type_code = 0x06
     id = packet_id()
+
+    def __init__(self, flags=PUBREL_FLAGS, **kwargs):
+        super().__init__(flags=flags, **kwargs)
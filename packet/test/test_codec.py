@@ -0,0 +1,79 @@
+import pytest
+
+from packet.connect import ConnectPacket
+from packet.puback import PublishAcknowledgePacket
+from packet.publish import PublishPacket
+from servers.streams import FrameReader
+
+
+def generic_read(packet_class, body: bytes, flags: int):
+    reader = FrameReader()
+    reader.start_frame(memoryview(body))
+    return packet_class.read_payload(reader, flags, len(body))
+
+
+class TestCompiledCodecs:
+    @pytest.mark.parametrize(
+        "packet",
+        [
+            PublishPacket(flags={"qos": 0, "retain": True}, topic="light/bedroom/is_on", data=b"1"),
+            PublishPacket(flags={"qos": 1, "retain": False}, topic="light/+/is_on", data=b"{}", id=7),
+            PublishPacket(flags={"qos": 2, "retain": False}, topic="a", data=None, id=65535),
+            PublishAcknowledgePacket(id=513),
+        ],
+    )
+    def test_matches_generic_interpreter(self, packet):
+        """
+        The generated encoder and decoder give the same results as the generic interpreter
+        """
+        cls = packet.__class__
+        payload = cls.encoder(packet.kwargs)
+        assert payload == packet.encode_payload()
+        flags = int(packet.flags)
+        assert cls.decoder(memoryview(payload), flags, len(payload)) == generic_read(cls, payload, flags)
+
+    @pytest.mark.parametrize(
+        "packet",
+        [
+            PublishPacket(flags={"qos": 1, "retain": False}, topic="light/+/is_on", data=b"{}", id=7),
+            PublishAcknowledgePacket(id=513),
+        ],
+    )
+    def test_truncated(self, packet):
+        """
+        A payload cut short fails with IOError wherever the generic interpreter does
+        """
+        cls = packet.__class__
+        payload = packet.encode_payload()
+        flags = int(packet.flags)
+        for end in range(len(payload)):
+            body = payload[:end]
+            try:
+                expected = generic_read(cls, body, flags)
+            except IOError:
+                with pytest.raises(IOError):
+                    cls.decoder(memoryview(body), flags, end)
+            else:
+                assert cls.decoder(memoryview(body), flags, end) == expected
+
+    def test_connect_truncated(self):
+        body = b"\x00\x04MQTT\x04\xc6\x00\x3c\x00\x02id\x00\x01t\x00\x02wm\x00\x01u\x00"
+        with pytest.raises(IOError):
+            ConnectPacket.decoder(memoryview(body), 0, len(body))
+
+    def test_connect_enabled_fields(self):
+        """
+        Fields switched off by the connect flags are neither read nor written
+        """
+        body = (
+            b"\x00\x04MQTT\x04\xc6\x00\x3c\x00\x02id"
+            b"\x00\x01t\x00\x02wm\x00\x01u\x00\x01p"
+        )
+        kwargs, count = ConnectPacket.decoder(memoryview(body), 0, len(body))
+        assert (kwargs, count) == generic_read(ConnectPacket, body, 0)
+        assert kwargs["last_will_message"] == b"wm"
+        assert kwargs["password"] == "p"
+        body = b"\x00\x04MQTT\x04\x02\x00\x3c\x00\x02id"
+        kwargs, count = ConnectPacket.decoder(memoryview(body), 0, len(body))
+        assert count == len(body)
+        assert "username" not in kwargs
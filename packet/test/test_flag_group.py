@@ -0,0 +1,34 @@
+import pytest
+
+from packet.connect import ConnectFlags
+from packet.publish import PublishFlags
+
+
+class TestPacketFlagGroup:
+    @pytest.mark.parametrize("data", range(256))
+    def test_from_int_is_interned(self, data):
+        flags = PublishFlags.from_int(data)
+        assert flags is PublishFlags.from_int(data)
+        assert int(flags) == data
+
+    @pytest.mark.parametrize("qos", range(3))
+    @pytest.mark.parametrize("retain", [False, True])
+    def test_from_kwargs(self, qos, retain):
+        flags = PublishFlags.from_kwargs({"qos": qos, "retain": retain})
+        assert flags is PublishFlags.from_int((qos << 1) | retain)
+        assert (flags.qos, flags.retain) == (qos, retain)
+
+    def test_from_kwargs_missing_flag(self):
+        with pytest.raises(KeyError):
+            ConnectFlags.from_kwargs({"clean_session": True})
+
+    def test_from_kwargs_default(self):
+        assert PublishFlags.from_kwargs({"qos": 1, "retain": False}).dup is False
+        assert PublishFlags.from_kwargs({"qos": 1, "retain": False, "dup": True}).dup is True
+
+    def test_immutable(self):
+        flags = PublishFlags.from_int(0)
+        with pytest.raises(AttributeError):
+            flags.qos = 1
+        with pytest.raises(TypeError):
+            flags.kwargs["qos"] = 1
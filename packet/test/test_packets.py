@@ -0,0 +1,19 @@
+import pytest
+
+from packet.packets import all_packets, infer_packet_class, packet_table, UnknownPacketError
+
+
+class TestPacketTable:
+    @pytest.mark.parametrize("cls", all_packets)
+    def test_infer_packet_class(self, cls):
+        assert infer_packet_class(cls.type_code) is cls
+
+    def test_unknown_type_code(self):
+        """
+        0 is reserved and DISCONNECT is not one of all_packets
+        """
+        assert packet_table[0] is None
+        with pytest.raises(UnknownPacketError):
+            infer_packet_class(0)
+        with pytest.raises(UnknownPacketError):
+            infer_packet_class(0x0E)
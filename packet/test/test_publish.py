@@ -0,0 +1,31 @@
+import pytest
+
+from packet.publish import PreparedPublish, PublishPacket
+
+
+class TestPreparedPublish:
+    @pytest.mark.parametrize("qos, packet_id", [(0, None), (1, 1), (2, 300)])
+    @pytest.mark.parametrize("data", [b"1", b"x" * 200, None])
+    def test_matches_publish_packet(self, qos, packet_id, data):
+        """
+        A prepared publish is byte for byte the PublishPacket it replaces
+        """
+        prepared = PreparedPublish("light/+/is_on", data)
+        packet = PublishPacket(
+            flags={"qos": qos, "retain": False},
+            topic="light/+/is_on",
+            data=data,
+            id=packet_id,
+        )
+        assert prepared.to_bytes(qos, packet_id) == bytes(packet.to_bytes())
+
+    def test_dup(self):
+        prepared = PreparedPublish("light/+/is_on", b"1")
+        packet = PublishPacket(
+            flags={"qos": 1, "retain": False, "dup": True},
+            topic="light/+/is_on",
+            data=b"1",
+            id=5,
+        )
+        assert prepared.to_bytes(1, 5, dup=True) == bytes(packet.to_bytes())
+        assert prepared.to_bytes(1, 5) == prepared.to_bytes(1, 5, dup=False)
@@ -1,10 +1,39 @@
+from packet.types.static_int import INT_STRUCTS
 from packet.types.type import PacketType
 
 
+size_struct = INT_STRUCTS[2]
+
+
 class PacketDynamicBytes(PacketType):
     @classmethod
     def read(cls, handler, kwargs):
         return handler.decode_bytes()
 
+    @classmethod
+    def to_bytes(cls, value) -> bytes:
+        return size_struct.pack(len(value)) + value
+
+    def codec_namespace(self, ref: str) -> dict:
+        return {
+            ref: self,
+            f"{ref}_unpack": size_struct.unpack_from,
+            f"{ref}_pack": size_struct.pack,
+        }
+
+    def decode_source(self, ref: str):
+        return (
+            f"size, = {ref}_unpack(buf, pos)\n"
+            f"pos += 2\n"
+            f"value = bytes(buf[pos:pos + size])\n"
+            f"pos += size"
+        )
+
+    def encode_source(self, ref: str):
+        return (
+            f"parts.append({ref}_pack(len(value)))\n"
+            f"parts.append(value)"
+        )
+
 
 dynamic_bytes = PacketDynamicBytes
@@ -1,10 +1,18 @@
 import dataclasses
 
-from packet.types.static_int import static_int
+from packet.types.static_int import static_int, INT_STRUCTS
 from packet.types.type import PacketType
 
 
 str_size = static_int(2)
+size_struct = INT_STRUCTS[2]
+
+
+def decode_utf8(data) -> str:
+    try:
+        return str(data, encoding="utf-8")
+    except UnicodeDecodeError:
+        return str(bytes(data))
 
 
 @dataclasses.dataclass
@@ -24,5 +32,28 @@ class PacketDynamicStr(PacketType):
         data_length = len(data)
         return str_size.to_bytes(data_length) + data
 
+    def codec_namespace(self, ref: str) -> dict:
+        return {
+            ref: self,
+            f"{ref}_unpack": size_struct.unpack_from,
+            f"{ref}_pack": size_struct.pack,
+            f"{ref}_decode": decode_utf8,
+        }
+
+    def decode_source(self, ref: str):
+        return (
+            f"size, = {ref}_unpack(buf, pos)\n"
+            f"pos += 2\n"
+            f"value = {ref}_decode(buf[pos:pos + size])\n"
+            f"pos += size"
+        )
+
+    def encode_source(self, ref: str):
+        return (
+            f"raw = value.encode('utf-8')\n"
+            f"parts.append({ref}_pack(len(raw)))\n"
+            f"parts.append(raw)"
+        )
+
 
 dynamic_str = PacketDynamicStr
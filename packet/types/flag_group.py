@@ -1,15 +1,50 @@
-from packet.types.static_int import PacketStaticInt
+from types import MappingProxyType
+
+from packet.types.static_int import PacketStaticInt, INT_STRUCTS
 
 
 class PacketFlagGroup(PacketStaticInt):
+    """
+    Every flag byte value has exactly one immutable instance per group, built
+    when the group is declared; from_int and from_kwargs only look them up
+    """
     size = 1
+    # not annotated, annotations on a group declare its flags
+    flag_names = ()
+    # the flags that may be left out of from_kwargs, and their values when they are
+    defaults = {}
+    by_int = ()
+    by_kwargs = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.flag_names = tuple(vars(cls).get("__annotations__", {}))
+        cls.by_int = tuple(cls(data, cls.decode(data)) for data in range(256))
+        # the lowest byte wins, that is the one without any undefined bits set
+        cls.by_kwargs = {}
+        for flags in cls.by_int:
+            cls.by_kwargs.setdefault(tuple(flags.kwargs.values()), flags)
 
     def __init__(self, data: int, kwargs: dict):
-        super().__init__(self.size)
-        self.data = data
-        self.kwargs = kwargs
+        set_attribute = super().__setattr__
+        set_attribute("data", data)
+        set_attribute("kwargs", MappingProxyType(kwargs))
         for keyword, arg in kwargs.items():
-            setattr(self, keyword, arg)
+            set_attribute(keyword, arg)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, key):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.data == other.data
+
+    def __hash__(self):
+        return hash((self.__class__, self.data))
 
     def __int__(self):
         return self.data
@@ -20,9 +55,21 @@ class PacketFlagGroup(PacketStaticInt):
         return f"{self.__class__.__name__}({data})"
 
     @classmethod
-    def from_kwargs(cls, kwargs):
+    def decode(cls, data: int) -> dict:
+        kwargs = {}
+        for name in cls.flag_names:
+            typ = cls.__annotations__[name]
+            if isinstance(typ, int):
+                kwargs[name] = bool(data & typ)
+            else:
+                kwargs[name] = typ.read(data)
+        return kwargs
+
+    @classmethod
+    def encode(cls, kwargs) -> int:
         data = 0
-        for name, typ in cls.__annotations__.items():
+        for name in cls.flag_names:
+            typ = cls.__annotations__[name]
             if isinstance(typ, int):
                 if kwargs[name]:
                     data |= typ
@@ -30,19 +77,39 @@ class PacketFlagGroup(PacketStaticInt):
                     data &= ~typ
             else:
                 data = typ.write(data, kwargs[name])
-        return cls(data, kwargs)
+        return data
+
+    @classmethod
+    def from_kwargs(cls, kwargs):
+        if cls.defaults:
+            kwargs = {**cls.defaults, **kwargs}
+        flags = cls.by_kwargs.get(tuple([kwargs[name] for name in cls.flag_names]))
+        if flags is None:
+            # values that don't decode back to themselves, e.g. retain=2
+            flags = cls.by_int[cls.encode(kwargs) & 0xFF]
+        return flags
 
     @classmethod
     def from_int(cls, data: int):
-        kwargs = {}
-        for name, typ in cls.__annotations__.items():
-            if isinstance(typ, int):
-                kwargs[name] = bool(data & typ)
-            else:
-                kwargs[name] = typ.read(data)
-        return cls(data, kwargs)
+        return cls.by_int[data]
 
     @classmethod
     def read(cls, handler, kwargs):
         f = handler.read_int(cls.size)
-        return cls.from_int(f), cls.size
+        return cls.by_int[f], cls.size
+
+    @classmethod
+    def codec_namespace(cls, ref: str) -> dict:
+        return {
+            ref: cls,
+            f"{ref}_by_int": cls.by_int,
+            f"{ref}_pack": INT_STRUCTS[cls.size].pack,
+        }
+
+    @classmethod
+    def decode_source(cls, ref: str):
+        return f"value = {ref}_by_int[buf[pos]]\npos += 1"
+
+    @classmethod
+    def encode_source(cls, ref: str):
+        return f"parts.append({ref}_pack(int(value)))"
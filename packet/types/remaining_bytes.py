@@ -6,7 +6,7 @@ class PacketRemainingBytes(PacketType):
         length = kwargs["length"]
         if length < 1:
             return None, 0
-        return handler.read(length), length
+        return bytes(handler.read(length)), length
 
     @classmethod
     def to_bytes(cls, value) -> bytes:
@@ -14,5 +14,14 @@ class PacketRemainingBytes(PacketType):
             return b""
         return value
 
+    def decode_source(self, ref: str):
+        return (
+            "value = bytes(buf[pos:length]) if pos < length else None\n"
+            "pos = max(pos, length)"
+        )
+
+    def encode_source(self, ref: str):
+        return "if value is not None:\n    parts.append(value)"
+
 
 remaining_bytes = PacketRemainingBytes
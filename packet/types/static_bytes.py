@@ -8,7 +8,13 @@ class PacketStaticBytes(PacketType):
     size: int
 
     def read(self, handler, kwargs):
-        return handler.read(self.size)
+        return bytes(handler.read(self.size))
+
+    def decode_source(self, ref: str):
+        return f"value = bytes(buf[pos:pos + {self.size}])\npos += {self.size}"
+
+    def encode_source(self, ref: str):
+        return "parts.append(value)"
 
 
 static_bytes = PacketStaticBytes
@@ -1,9 +1,15 @@
 import dataclasses
-from struct import pack
+from struct import Struct
 
 from packet.types.type import PacketType
 
 
+INT_STRUCTS = {
+    1: Struct("!B"),
+    2: Struct("!H"),
+}
+
+
 @dataclasses.dataclass
 class PacketStaticInt(PacketType):
     size: int
@@ -12,14 +18,29 @@ class PacketStaticInt(PacketType):
         return handler.read_int(self.size), self.size
 
     def to_bytes(self, value: int):
-        if self.size == 1:
-            fmt = "!B"
-        elif self.size == 2:
-            fmt = "!H"
-        else:
+        try:
+            int_struct = INT_STRUCTS[self.size]
+        except KeyError:
             raise TypeError("Int too big")
-        data = pack(fmt, value)
-        return data
+        return int_struct.pack(value)
+
+    def codec_namespace(self, ref: str) -> dict:
+        namespace = super().codec_namespace(ref)
+        int_struct = INT_STRUCTS.get(self.size)
+        if int_struct:
+            namespace[f"{ref}_unpack"] = int_struct.unpack_from
+            namespace[f"{ref}_pack"] = int_struct.pack
+        return namespace
+
+    def decode_source(self, ref: str):
+        if self.size not in INT_STRUCTS:
+            return None
+        return f"value, = {ref}_unpack(buf, pos)\npos += {self.size}"
+
+    def encode_source(self, ref: str):
+        if self.size not in INT_STRUCTS:
+            return None
+        return f"parts.append({ref}_pack(value))"
 
 
 static_int = PacketStaticInt
@@ -1,3 +1,6 @@
+from typing import Optional
+
+
 def enabled_default(*_, **__):
     return True
 
@@ -16,3 +19,25 @@ class PacketType:
     def enabled(self, func):
         self.is_enabled = func
         return func
+
+    def codec_namespace(self, ref: str) -> dict:
+        """
+        Names the generated codecs need for this field, all prefixed with ref
+        """
+        return {ref: self}
+
+    def decode_source(self, ref: str) -> Optional[str]:
+        """
+        Source for the decoder generated by PayloadMeta; it reads this field
+        out of `buf` at `pos` into `value` and moves `pos` past it.
+        None means only the generic interpreter can read this field
+        """
+        return None
+
+    def encode_source(self, ref: str) -> Optional[str]:
+        """
+        Source for the encoder generated by PayloadMeta; it appends
+        the encoded `value` to `parts`.
+        None means only the generic interpreter can write this field
+        """
+        return None
@@ -1,83 +1,32 @@
-from collections import defaultdict
-
-from models.constants import LEAF_KEY, MANY_CARD
-from protocols.is_node_static import is_node_static
+from models.subscription_index import SubscriptionIndex
 from protocols.stringify import stringify
-from utils.recursive_default_dict import RecursiveDefaultDict
 
 
-def build_message_data(leaf_rows: list, base: list, wildcards: bool):
-    if wildcards:
-        tree = RecursiveDefaultDict()
+def build_message_data(leaf_rows: list, tree_levels: tuple):
+    if tree_levels:
+        tree = {}
+        *climb, last = tree_levels
         for topic, data, _ in leaf_rows:
-            ref = [tree]
-            ref_key = 0
-            # we climb to the second to last node in the path;
-            # the last node to climb is set to ref_key;
-            for current_filter_node, node in zip(base, topic):
-                if not is_node_static(current_filter_node):
-                    ref = ref[ref_key]
-                    ref_key = node
-            # set the leaf
-            ref[ref_key] = data
+            ref = tree
+            # the nodes of the topic under the filter's wildcards are the path to the leaf
+            for depth in climb:
+                node = topic[depth]
+                branch = ref.get(node)
+                if branch is None:
+                    branch = ref[node] = {}
+                ref = branch
+            ref[topic[last]] = data
         return stringify(tree)
     else:
         # this is not a tree subscription, we just want whatever the last row says
         return leaf_rows[-1][1]
 
 
-def _create_messages_for_subscriptions(
-    subscriptions: dict, rows: list, base: list, depth=0, wildcards=False
-):
+def create_messages_for_subscriptions(subscriptions: SubscriptionIndex, rows: list):
     """
-    Return a list of tuples of ([(client, qos), ...], topic, data)
+    Return a list of tuples of ({client_id: qos, ...}, topic, data)
     """
-    leaf_rows = []
-    rows_by_current_node = defaultdict(list)
-    # organize rows into a dict by literal node at given depth
-    for row in rows:
-        topic = row[0]
-        lt = len(topic)
-        if depth < lt:
-            node = topic[depth]
-            rows_by_current_node[node].append(row)
-        elif depth == lt:
-            leaf_rows.append(row)
-    messages = []
-    has_leaves = bool(leaf_rows)
-    for filter_node, branch in subscriptions.items():
-        if has_leaves and filter_node == LEAF_KEY:
-            response_data = build_message_data(
-                leaf_rows,
-                base,
-                wildcards,
-            )
-            messages.append(
-                (
-                    branch,
-                    base,
-                    response_data,
-                )
-            )
-        else:
-            new_wildcards = wildcards
-            if filter_node == MANY_CARD:
-                new_rows = rows
-                new_wildcards = True
-            else:
-                new_rows = rows_by_current_node[filter_node]
-            if new_rows:
-                messages.extend(
-                    _create_messages_for_subscriptions(
-                        subscriptions=branch,
-                        rows=new_rows,
-                        base=base + [filter_node],
-                        depth=depth + 1,
-                        wildcards=new_wildcards,
-                    )
-                )
-    return messages
-
-
-def create_messages_for_subscriptions(subscriptions, rows):
-    return _create_messages_for_subscriptions(subscriptions, rows, [])
+    return [
+        (node.clients, node.topic, build_message_data(leaf_rows, node.tree_levels))
+        for node, leaf_rows in subscriptions.match(rows)
+    ]
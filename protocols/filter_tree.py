@@ -5,23 +5,24 @@ from utils.tree_item import empty, TreeItem
 
 
 def filter_tree_with_topic(
-    topic: list,
+    topic,
     tree: TreeItem,
     found_wildcard=False,
+    depth=0,
 ) -> TreeItem:
     """
     Cherry-pick a retained tree to create a
-    new tree based on a topic structure
+    new tree based on a topic structure, starting at topic[depth]
     """
-    node = topic[0]
-    next_topic = topic[1:]
+    node = topic[depth]
+    last = depth + 1 == len(topic)
     if node == EVERYTHING_CARD:
-        if not next_topic:
+        if last:
             return tree
-        raise InvalidEverythingCard(next_topic)
+        raise InvalidEverythingCard(topic[depth + 1:])
     elif node == MANY_CARD:
         result = {}
-        if not next_topic:
+        if last:
             for key, val in tree.items():
                 if key == LEAF_KEY:
                     continue
@@ -33,9 +34,10 @@ def filter_tree_with_topic(
                 if key == LEAF_KEY:
                     continue
                 branch = filter_tree_with_topic(
-                    topic=next_topic,
+                    topic=topic,
                     tree=val,
                     found_wildcard=True,
+                    depth=depth + 1,
                 )
                 if branch not in ["", {}]:
                     result[key] = branch
@@ -43,16 +45,17 @@ def filter_tree_with_topic(
     else:
         branch = tree.get(node)
         if branch is None:
-            if next_topic:
-                found_wildcard = not is_node_static(next_topic[-1])
-            else:
+            if last:
                 found_wildcard = False
+            else:
+                found_wildcard = not is_node_static(topic[-1])
             return {} if found_wildcard else ""
-        elif not next_topic:
+        elif last:
             return branch.get(LEAF_KEY, empty)
         else:
             return filter_tree_with_topic(
-                topic=next_topic,
+                topic=topic,
                 tree=branch,
                 found_wildcard=found_wildcard,
+                depth=depth + 1,
             )
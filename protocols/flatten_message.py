@@ -4,13 +4,15 @@ from utils.recursive_default_dict import RecursiveDefaultDict
 from utils.tree_item import TreeItem, empty
 
 missing = object()
+# stands in for the branches of the retained tree that don't exist, never written to
+no_branch = {}
 
 
 def flatten_message_into_rows(
-    topic: list,
+    topic,
     data: TreeItem,
     qos: int,
-    base: list,
+    base,
     tree: RecursiveDefaultDict,
     flags: str,
 ) -> list:
@@ -18,13 +20,26 @@ def flatten_message_into_rows(
     Parse a topic with wildcards into multiple messages
     with payloads cherry-picked from the incoming data tree
     """
-    node = topic[0]
-    next_topic = topic[1:]
+    rows = []
+    _flatten_message_into_rows(topic, 0, data, qos, list(base), tree, flags, rows)
+    return rows
+
+
+def _flatten_message_into_rows(
+    topic, depth: int, data: TreeItem, qos: int, path: list, tree: dict, flags: str, rows: list
+):
+    """
+    Walk topic from depth on, path holds the nodes walked so far;
+    it is shared by the whole walk and only copied into the rows
+    """
+    node = topic[depth]
+    last = depth + 1 == len(topic)
     if node == EVERYTHING_CARD:
         raise InvalidEverythingCard
     elif node == MANY_CARD:
-        if not next_topic:
-            results = [(base + [key], val.encode(), qos) for key, val in data.items()]
+        if last:
+            for key, val in data.items():
+                rows.append(((*path, key), val.encode(), qos))
             if flags == MANY_CARD:
                 # using this flag means the keys in our retained tree should
                 # match the keys in the input tree once we are done
@@ -36,30 +51,19 @@ def flatten_message_into_rows(
                     if leaf is missing:
                         continue
                     if data.get(key, missing) is missing:
-                        results.append((base + [key], empty, qos))
-            return results
+                        rows.append(((*path, key), empty, qos))
         else:
-            result = []
             for key, val in data.items():
-                result.extend(
-                    flatten_message_into_rows(
-                        topic=next_topic,
-                        data=val,
-                        qos=qos,
-                        base=base + [key],
-                        tree=tree.get(key, {}),
-                        flags=flags,
-                    )
+                path.append(key)
+                _flatten_message_into_rows(
+                    topic, depth + 1, val, qos, path, tree.get(key, no_branch), flags, rows
                 )
-            return result
-    elif not next_topic:
-        return [(base + topic, data.encode(), qos)]
+                path.pop()
+    elif last:
+        rows.append(((*path, node), data.encode(), qos))
     else:
-        return flatten_message_into_rows(
-            topic=next_topic,
-            data=data,
-            qos=qos,
-            base=base + [node],
-            tree=tree.get(node, {}),
-            flags=flags,
+        path.append(node)
+        _flatten_message_into_rows(
+            topic, depth + 1, data, qos, path, tree.get(node, no_branch), flags, rows
         )
+        path.pop()
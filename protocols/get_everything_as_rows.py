@@ -3,27 +3,30 @@ from models.constants import LEAF_KEY
 from utils.tree_item import TreeItem
 
 
-def get_everything_as_rows(
-    topic: list, data: bytes, qos: int, tree: TreeItem, start=True
-):
+def get_everything_as_rows(topic, data: bytes, qos: int, tree: TreeItem) -> list:
     """
     Obtain a list of rows to be updated with data that
     covers an entire retained tree (or branch)
     """
-    result = []
+    rows = []
+    _get_everything_as_rows(list(topic), data, qos, tree, rows)
+    return rows
+
+
+def _get_everything_as_rows(
+    path: list, data: bytes, qos: int, tree: TreeItem, rows: list, start=True
+):
+    """
+    Append the rows under tree to rows, path is the topic of tree;
+    it is shared by the whole walk and only copied into the rows
+    """
     for key, val in tree.items():
         if key == LEAF_KEY:
             if not start:
-                result.append((topic, data, qos))
+                rows.append((tuple(path), data, qos))
         elif val is None:
-            log.error("branch is null", topic, data)
+            log.error("branch is null", path, data)
         else:
-            branch_rows = get_everything_as_rows(
-                topic=topic + [key],
-                data=data,
-                qos=qos,
-                tree=val,
-                start=False,
-            )
-            result.extend(branch_rows)
-    return result
+            path.append(key)
+            _get_everything_as_rows(path, data, qos, val, rows, start=False)
+            path.pop()
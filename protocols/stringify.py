@@ -1,5 +1,22 @@
+import re
+from functools import lru_cache
 from json import JSONEncoder, dumps as json_encode
 
+# how many encoded leaves and keys are remembered, retained leaves are sent over and over
+LEAF_CACHE_SIZE = 16384
+# only leaves and keys up to this long are remembered, so the caches stay small whatever is published
+MAX_CACHED_LEAF = 64
+
+# printable ascii without quotes or backslashes goes out exactly as it came in
+SAFE_BYTES = re.compile(rb'[\x20\x21\x23-\x5b\x5d-\x7e]*')
+SAFE_STR = re.compile(r'[\x20\x21\x23-\x5b\x5d-\x7e]*')
+
+CONSTANTS = {
+    None: b"null",
+    True: b"true",
+    False: b"false",
+}
+
 
 class OutgoingMessageJSONEncoder(JSONEncoder):
     def default(self, o):
@@ -8,6 +25,119 @@ class OutgoingMessageJSONEncoder(JSONEncoder):
         return super().default(o)
 
 
+class CannotWrite(Exception):
+    """
+    Something in the tree is left to json to deal with
+    """
+
+
+def quote_bytes(leaf: bytes) -> bytes:
+    if SAFE_BYTES.fullmatch(leaf):
+        return b'"' + leaf + b'"'
+    return json_encode(leaf.decode()).encode()
+
+
+def quote_str(s: str) -> bytes:
+    if SAFE_STR.fullmatch(s):
+        return b'"' + s.encode() + b'"'
+    return json_encode(s).encode()
+
+
+cached_quote_bytes = lru_cache(maxsize=LEAF_CACHE_SIZE)(quote_bytes)
+cached_quote_str = lru_cache(maxsize=LEAF_CACHE_SIZE)(quote_str)
+
+
+def encode_bytes(leaf: bytes) -> bytes:
+    if len(leaf) > MAX_CACHED_LEAF:
+        return quote_bytes(leaf)
+    return cached_quote_bytes(leaf)
+
+
+def encode_str(s: str) -> bytes:
+    if len(s) > MAX_CACHED_LEAF:
+        return quote_str(s)
+    return cached_quote_str(s)
+
+
+def quote_key(key: str) -> tuple[bytes, bytes]:
+    """
+    The key as the first entry of an object and as any other entry
+    """
+    encoded = quote_str(key) + b": "
+    return encoded, b", " + encoded
+
+
+cached_quote_key = lru_cache(maxsize=LEAF_CACHE_SIZE)(quote_key)
+
+
+def encode_key(key: str) -> tuple[bytes, bytes]:
+    if len(key) > MAX_CACHED_LEAF:
+        return quote_key(key)
+    return cached_quote_key(key)
+
+
+def write_item(item, out: list):
+    """
+    Append the json of item to out, exactly as json.dumps would write it
+    """
+    item_type = type(item)
+    if item_type is bytes:
+        out.append(encode_bytes(item))
+    elif item_type is str:
+        out.append(encode_str(item))
+    elif isinstance(item, dict):
+        write_dict(item, out)
+    elif isinstance(item, (list, tuple)):
+        if not item:
+            out.append(b"[]")
+            return
+        separator = b"["
+        for value in item:
+            out.append(separator)
+            write_item(value, out)
+            separator = b", "
+        out.append(b"]")
+    elif item is None or item is True or item is False:
+        out.append(CONSTANTS[item])
+    elif item_type is int or item_type is float:
+        out.append(json_encode(item).encode())
+    else:
+        raise CannotWrite
+
+
+def write_dict(item: dict, out: list):
+    if not item:
+        out.append(b"{}")
+        return
+    append = out.append
+    append(b"{")
+    # the leaves are written right here, only branches recurse
+    entry = 0
+    for key, value in item.items():
+        if type(key) is not str:
+            raise CannotWrite
+        append(encode_key(key)[entry])
+        entry = 1
+        value_type = type(value)
+        if value_type is bytes:
+            append(encode_bytes(value))
+        elif value_type is str:
+            append(encode_str(value))
+        elif isinstance(value, dict):
+            write_dict(value, out)
+        else:
+            write_item(value, out)
+    append(b"}")
+
+
 def stringify(tree_item) -> bytes:
-    s = json_encode(tree_item, cls=OutgoingMessageJSONEncoder)
-    return s.encode()
+    """
+    Write the json of a tree straight from its (usually retained) leaf bytes,
+    only leaves that need escaping are decoded; anything unusual is left to json
+    """
+    out = []
+    try:
+        write_item(tree_item, out)
+    except CannotWrite:
+        return json_encode(tree_item, cls=OutgoingMessageJSONEncoder).encode()
+    return b"".join(out)
@@ -0,0 +1,41 @@
+from json import dumps
+
+from protocols.stringify import (
+    MAX_CACHED_LEAF,
+    OutgoingMessageJSONEncoder,
+    cached_quote_bytes,
+    cached_quote_key,
+    cached_quote_str,
+    stringify,
+)
+
+
+def json_stringify(tree) -> bytes:
+    return dumps(tree, cls=OutgoingMessageJSONEncoder).encode()
+
+
+class TestStringify:
+    def test_matches_json(self):
+        """
+        The bytes are exactly what json.dumps writes, escaping included
+        """
+        tree = {
+            "bedroom": {"is_on": b"1", "name": b'the "big" one', "note": "café\n"},
+            "kitchen": {},
+            "hall": [b"1", 2, 3.5, None, True, False],
+            "attic": b"\xf0\x9f\x98\x80",
+        }
+        assert stringify(tree) == json_stringify(tree)
+
+    def test_falls_back_to_json(self):
+        tree = {1: b"a", "b": {None: b"c"}}
+        assert stringify(tree) == json_stringify(tree)
+        assert stringify(b"leaf") == b'"leaf"'
+
+    def test_long_leaves_are_not_cached(self):
+        caches = (cached_quote_bytes, cached_quote_str, cached_quote_key)
+        sizes = [cache.cache_info().currsize for cache in caches]
+        long = "x" * (MAX_CACHED_LEAF + 1)
+        tree = {long: [long.encode(), long + "\n"]}
+        assert stringify(tree) == json_stringify(tree)
+        assert [cache.cache_info().currsize for cache in caches] == sizes
@@ -0,0 +1,112 @@
+import pytest
+
+from protocols.exceptions import InvalidEverythingCard
+from protocols.filter_tree import filter_tree_with_topic
+from protocols.flatten_message import flatten_message_into_rows
+from protocols.get_applicable_rows import get_applicable_rows
+from protocols.get_everything_as_rows import get_everything_as_rows
+
+# a leaf at the root, an empty branch (attic), and leaves at different depths
+TREE = {
+    "/": b"root",
+    "light": {
+        "bedroom": {"is_on": {"/": b"1"}, "name": {"/": b"big"}},
+        "hall": {"is_on": {"/": b"0"}},
+        "attic": {},
+    },
+    "door": {"/": b"closed"},
+}
+
+
+def topics(rows: list) -> list[str]:
+    return ["/".join(topic) for topic, _, _ in rows]
+
+
+class TestGetApplicableRows:
+    @pytest.mark.parametrize(
+        "topic,expected",
+        [
+            ("light/+/is_on", ["light/bedroom/is_on", "light/hall/is_on", "light/attic/is_on"]),
+            ("light/+/+", ["light/bedroom/is_on", "light/bedroom/name", "light/hall/is_on"]),
+            ("+", ["light", "door"]),
+            ("+/+", ["light/bedroom", "light/hall", "light/attic"]),
+            ("light/#", ["light/bedroom/is_on", "light/bedroom/name", "light/hall/is_on"]),
+            ("#", ["light/bedroom/is_on", "light/bedroom/name", "light/hall/is_on", "door"]),
+            ("light/attic/is_on", ["light/attic/is_on"]),
+            ("garage/door", ["garage/door"]),
+            ("garage/+/x", []),
+        ],
+    )
+    def test_rows(self, topic, expected):
+        rows = get_applicable_rows(topic.split("/"), b"d", 1, [], TREE)
+        assert topics(rows) == expected
+        assert all(data == b"d" and qos == 1 for _, data, qos in rows)
+
+    def test_everything_card_not_last(self):
+        with pytest.raises(InvalidEverythingCard):
+            get_applicable_rows(["#", "x"], b"d", 0, [], TREE)
+
+
+class TestGetEverythingAsRows:
+    @pytest.mark.parametrize(
+        "base,tree,expected",
+        [
+            (["x"], TREE, ["x/light/bedroom/is_on", "x/light/bedroom/name", "x/light/hall/is_on", "x/door"]),
+            (["light"], TREE["light"], ["light/bedroom/is_on", "light/bedroom/name", "light/hall/is_on"]),
+            (["door"], {"/": b"x"}, []),
+            ([], {}, []),
+        ],
+    )
+    def test_rows(self, base, tree, expected):
+        assert topics(get_everything_as_rows(base, b"d", 0, tree)) == expected
+
+    def test_base_is_not_changed(self):
+        base = ["light"]
+        get_everything_as_rows(base, b"d", 0, TREE["light"])
+        assert base == ["light"]
+
+
+class TestFilterTree:
+    @pytest.mark.parametrize(
+        "topic,expected",
+        [
+            ("light/+/is_on", {"bedroom": b"1", "hall": b"0"}),
+            ("+", {"door": b"closed"}),
+            ("light/+", {}),
+            ("light/attic/+", {}),
+            ("garage/+", {}),
+            ("#", TREE),
+            ("light/#", TREE["light"]),
+            ("light/bedroom/is_on", b"1"),
+            ("door", b"closed"),
+            ("garage", ""),
+            ("light/attic/is_on/x", ""),
+        ],
+    )
+    def test_filter(self, topic, expected):
+        assert filter_tree_with_topic(topic.split("/"), TREE) == expected
+
+    def test_everything_card_not_last(self):
+        with pytest.raises(InvalidEverythingCard):
+            filter_tree_with_topic(["light", "#", "x"], TREE)
+
+
+class TestFlattenMessage:
+    @pytest.mark.parametrize(
+        "topic,data,flags,expected",
+        [
+            ("light/+/is_on", {"bedroom": "1", "hall": "0"}, None, [("light/bedroom/is_on", b"1"), ("light/hall/is_on", b"0")]),
+            ("+/+", {"a": {"b": "1", "c": "2"}, "d": {}}, None, [("a/b", b"1"), ("a/c", b"2")]),
+            ("door", "open", None, [("door", b"open")]),
+            # the + flag clears the retained leaves that are missing from the data
+            ("+", {"light": "on"}, "+", [("light", b"on"), ("door", None)]),
+            ("light/+", {"bedroom": "1"}, "+", [("light/bedroom", b"1")]),
+        ],
+    )
+    def test_rows(self, topic, data, flags, expected):
+        rows = flatten_message_into_rows(topic.split("/"), data, 0, [], TREE, flags)
+        assert [("/".join(topic), data) for topic, data, _ in rows] == expected
+
+    def test_everything_card(self):
+        with pytest.raises(InvalidEverythingCard):
+            flatten_message_into_rows(["light", "#"], {"a": "1"}, 0, [], TREE, None)
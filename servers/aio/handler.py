@@ -0,0 +1,74 @@
+from asyncio import BufferedProtocol, AbstractEventLoop, Transport
+from threading import get_ident
+from time import monotonic
+
+from logger import log
+from servers.evented import EventedHandler, MIN_RECV
+
+
+class AsyncHandler(EventedHandler, BufferedProtocol):
+    """
+    A client connection driven by an asyncio event loop, the loop receives
+    straight into the reusable receive buffer and frames packets out of it
+    """
+    transport: Transport = None
+
+    def __init__(self, server):
+        self.server = server
+        self.last_activity = monotonic()
+
+    @property
+    def event_loop(self) -> AbstractEventLoop:
+        return self.server.event_loop
+
+    def in_loop(self, func, *args):
+        """
+        Run func on the event loop, right away if we are already on it
+        """
+        if get_ident() == self.server.thread_id:
+            func(*args)
+        else:
+            self.event_loop.call_soon_threadsafe(func, *args)
+
+    def connection_made(self, transport: Transport):
+        self.transport = transport
+        self.server.clients.add(self)
+
+    def connection_lost(self, exc):
+        self.server.clients.discard(self)
+        self.connection_closed()
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.incoming.reserve(MIN_RECV)
+
+    def buffer_updated(self, nbytes: int):
+        self.incoming.commit(nbytes)
+        self.data_received()
+
+    def send_raw(self, data: bytes):
+        self.in_loop(self.transport.write, data)
+
+    def send_raw_many(self, chunks: list[bytes]):
+        self.in_loop(self.transport.writelines, chunks)
+
+    def get_host_port_tuple(self):
+        return self.transport.get_extra_info("sockname")
+
+    def set_keep_alive(self, seconds: int):
+        self.keep_alive = seconds
+        self.in_loop(self.event_loop.call_later, seconds, self.check_keep_alive)
+
+    def check_keep_alive(self):
+        if not self.alive:
+            return
+        idle = monotonic() - self.last_activity
+        if idle >= self.keep_alive:
+            log.debug("Keep alive expired", self.id)
+            self.close()
+        else:
+            self.event_loop.call_later(self.keep_alive - idle, self.check_keep_alive)
+
+    def close(self):
+        self.alive = False
+        if self.transport is not None:
+            self.in_loop(self.transport.close)
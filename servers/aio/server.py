@@ -0,0 +1,78 @@
+import asyncio
+import dataclasses
+from functools import cached_property
+from threading import get_ident
+from time import monotonic
+from typing import Type
+
+from logger import log
+from servers.aio.handler import AsyncHandler
+from servers.handler import RETRY_CHECK
+from servers.server import Server
+
+
+@dataclasses.dataclass
+class AsyncServer(Server):
+    """
+    Serves every connection from a single asyncio event loop running on the server thread
+    """
+    handler_class: Type[AsyncHandler] = AsyncHandler
+    thread_id: int = None
+
+    @cached_property
+    def event_loop(self) -> asyncio.AbstractEventLoop:
+        return asyncio.new_event_loop()
+
+    @cached_property
+    def stopping(self) -> asyncio.Future:
+        return self.event_loop.create_future()
+
+    @cached_property
+    def clients(self) -> set:
+        return set()
+
+    def resend_overdue(self):
+        now = monotonic()
+        for client in list(self.clients):
+            if client.inflight:
+                client.resend_overdue(now)
+        self.event_loop.call_later(RETRY_CHECK, self.resend_overdue)
+
+    def new_connection(self) -> AsyncHandler:
+        return self.handler_class.new_connection(self)
+
+    async def serve(self):
+        try:
+            server = await self.event_loop.create_server(
+                self.new_connection,
+                host=self.host,
+                port=self.port,
+                reuse_address=True,
+            )
+        except OSError:
+            log.traceback("Unable to bind", self.host, self.port)
+            return
+        self.event_loop.call_later(RETRY_CHECK, self.resend_overdue)
+        async with server:
+            await self.stopping
+        # give the connections we closed a chance to finish
+        await asyncio.sleep(0)
+
+    def loop(self):
+        self.thread_id = get_ident()
+        self.alive = True
+        asyncio.set_event_loop(self.event_loop)
+        try:
+            self.event_loop.run_until_complete(self.serve())
+        finally:
+            self.event_loop.close()
+
+    def shutdown(self):
+        if not self.stopping.done():
+            self.stopping.set_result(None)
+
+    def stop(self):
+        self.alive = False
+        for client in list(self.clients):
+            client.disconnect()
+        self.event_loop.call_soon_threadsafe(self.shutdown)
@@ -0,0 +1,8 @@
+from servers.aio.handler import AsyncHandler
+from servers.websocket.evented import EventedWebsocket
+
+
+class AsyncWebsocketHandler(EventedWebsocket, AsyncHandler):
+    """
+    A websocket client connection driven by an asyncio event loop
+    """
@@ -0,0 +1,137 @@
+import dataclasses
+from collections import deque
+from functools import cached_property
+from queue import Empty, SimpleQueue
+from threading import Lock, Thread
+from time import monotonic
+
+from logger import log
+from utils.field import default_factory
+
+# how many tasks a worker runs from one lane before giving other lanes a turn
+LANE_BATCH = 16
+# how long to wait for a busy worker when stopping
+STOP_TIMEOUT = 5
+
+
+@dataclasses.dataclass
+class Lane:
+    """
+    A serial queue of tasks, tasks in the same lane never run at
+    the same time and always run in the order they were submitted
+    """
+    tasks: deque = default_factory(deque)
+    lock: Lock = default_factory(Lock)
+    scheduled: bool = False
+
+
+@dataclasses.dataclass
+class Dispatcher:
+    """
+    A fixed pool of worker threads that runs packet handlers.
+    Every client submits to its own lane, so its packets are handled in
+    the order they arrived, while no more than `workers` handlers
+    run at once no matter how many clients are connected
+    """
+    name: str = "Dispatcher"
+    workers: int = 16
+    ready: SimpleQueue = default_factory(SimpleQueue)
+    stats_lock: Lock = default_factory(Lock)
+    depth: int = 0
+    max_depth: int = 0
+    dispatched: int = 0
+    wait_time: float = 0
+    max_wait_time: float = 0
+
+    @cached_property
+    def threads(self) -> list[Thread]:
+        return [
+            Thread(target=self.loop, name=f"{self.name}-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+
+    @property
+    def stats(self) -> dict:
+        with self.stats_lock:
+            return {
+                "depth": self.depth,
+                "max_depth": self.max_depth,
+                "dispatched": self.dispatched,
+                "average_wait": self.wait_time / self.dispatched if self.dispatched else 0,
+                "max_wait": self.max_wait_time,
+            }
+
+    def submit(self, lane: Lane, func, *args):
+        with self.stats_lock:
+            self.depth += 1
+            if self.depth > self.max_depth:
+                self.max_depth = self.depth
+        with lane.lock:
+            lane.tasks.append((func, args, monotonic()))
+            if lane.scheduled:
+                return
+            lane.scheduled = True
+        self.ready.put(lane)
+
+    def run_task(self, func, args, queued_at: float):
+        waited = monotonic() - queued_at
+        with self.stats_lock:
+            self.depth -= 1
+            self.dispatched += 1
+            self.wait_time += waited
+            if waited > self.max_wait_time:
+                self.max_wait_time = waited
+        try:
+            func(*args)
+        except ConnectionError:
+            pass
+        except:
+            log.traceback("Dispatcher", func)
+
+    def run_lane(self, lane: Lane):
+        for _ in range(LANE_BATCH):
+            with lane.lock:
+                if not lane.tasks:
+                    lane.scheduled = False
+                    return
+                task = lane.tasks.popleft()
+            self.run_task(*task)
+        # the lane still has work, send it to the back of the line
+        self.ready.put(lane)
+
+    def loop(self):
+        while True:
+            lane = self.ready.get()
+            if lane is None:
+                break
+            self.run_lane(lane)
+
+    def drain(self):
+        """
+        Run whatever is still queued once the workers are gone, the lanes
+        a worker sent to the back of the line ended up behind the stop signals
+        """
+        while True:
+            try:
+                lane = self.ready.get_nowait()
+            except Empty:
+                return
+            if lane is not None:
+                self.run_lane(lane)
+
+    def __enter__(self):
+        log.info(f"Starting {self.name}...", end="")
+        for thread in self.threads:
+            thread.start()
+        log.info("Done")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        log.info(f"Stopping {self.name}...", end="")
+        for _ in self.threads:
+            self.ready.put(None)
+        for thread in self.threads:
+            thread.join(STOP_TIMEOUT)
+        self.drain()
+        log.info("Done")
+        log.info(self.name, **self.stats)
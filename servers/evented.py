@@ -0,0 +1,150 @@
+from abc import abstractmethod
+from functools import cached_property
+from queue import Empty
+from time import monotonic
+
+from broker.context import BrokerContext as Broker
+from exceptions.unexpected_packet import UnexpectedPacketType
+from logger import log
+from models.messages import OutgoingMessage
+from packet.connect import ConnectPacket
+from packet.packets import infer_packet_class
+from servers.dispatcher import Lane
+from servers.handler import Handler
+from servers.streams import BufferedReaderWriter, ReceiveBuffer
+
+# the least amount of free space handed to the event loop for each read
+MIN_RECV = 4096
+
+
+class EventedHandler(Handler, BufferedReaderWriter):
+    """
+    A client connection driven by an event loop instead of a read and a write
+    thread; the loop receives into `incoming` and calls data_received, the packet
+    handlers and outgoing messages run on the broker's dispatcher
+    """
+    keep_alive: int = None
+    last_activity: float = 0
+    # the message waiting for a spot in the window
+    held: OutgoingMessage = None
+    window_blocked: bool = False
+
+    @cached_property
+    def write_lane(self):
+        """
+        Outgoing messages get their own lane, so a qos > 0 message waiting
+        for its acknowledgement does not hold up our incoming packets
+        """
+        return Lane()
+
+    @property
+    def incoming(self) -> ReceiveBuffer:
+        """
+        Where the event loop puts the bytes it receives
+        """
+        return self.recv
+
+    @abstractmethod
+    def send_raw(self, data: bytes):
+        """
+        Queue data on the connection as is, from any thread
+        """
+
+    def send_raw_many(self, chunks: list[bytes]):
+        self.send_raw(b"".join(chunks))
+
+    def start_threads(self):
+        pass
+
+    def write_loop(self):
+        pass
+
+    def read_loop(self):
+        pass
+
+    def data_received(self):
+        self.received()
+
+    def received(self):
+        self.last_activity = monotonic()
+        try:
+            while self.alive:
+                header = self.next_frame()
+                if header is None:
+                    break
+                try:
+                    self.handle_frame(*header)
+                finally:
+                    self.flush()
+        except:
+            log.traceback(f"{self.__class__.__name__}.received", self.id)
+            self.close()
+
+    def handle_frame(self, msg_type: int, flags: int):
+        if self.linked:
+            self.read_and_dispatch(msg_type, flags)
+        elif msg_type == ConnectPacket.type_code:
+            self.handle_connect(ConnectPacket.read(self, flags))
+        else:
+            raise UnexpectedPacketType(infer_packet_class(msg_type).read(self, flags))
+
+    def write(self, data: bytes):
+        if not self.alive:
+            raise ConnectionError
+        self.send_raw(data)
+
+    def write_many(self, chunks: list[bytes]):
+        if not self.alive:
+            raise ConnectionError
+        self.send_raw_many(chunks)
+
+    def queue_message(self, message: OutgoingMessage):
+        super().queue_message(message)
+        Broker.instance.dispatcher.submit(self.write_lane, self.send_next)
+
+    def send_next(self):
+        """
+        Send batches until the queue is empty or the window is full, a queue_message
+        that finds the window full has its send_next used up without sending anything
+        """
+        while self.alive:
+            message = self.held
+            if message is None:
+                try:
+                    message = self.message_queue.get_nowait()
+                except Empty:
+                    return
+            self.held = self.send_batch(message)
+            if self.held is not None:
+                return
+
+    def open_window(self) -> bool:
+        """
+        The write lane can't wait for the window, if it is full
+        send_next is run again once a delivery completes
+        """
+        with self.window:
+            if not self.alive:
+                raise ConnectionError
+            if len(self.inflight) < self.max_inflight:
+                return True
+            self.window_blocked = True
+            return False
+
+    def delivery_completed(self):
+        if self.window_blocked:
+            self.window_blocked = False
+            Broker.instance.dispatcher.submit(self.write_lane, self.send_next)
+
+    def keep_alive_expired(self, now: float) -> bool:
+        return self.keep_alive is not None and now - self.last_activity >= self.keep_alive
+
+    def connection_closed(self):
+        """
+        The event loop is done with the connection
+        """
+        self.alive = False
+        # whatever waits for an acknowledgement may be holding up our lane
+        self.cancel_packet_futures()
+        if self.linked:
+            Broker.instance.dispatcher.submit(self.lane, self.handle_disconnected)
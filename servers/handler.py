@@ -1,8 +1,10 @@
 import dataclasses
 from abc import abstractmethod
-from functools import cached_property
-from threading import Condition, Thread
-from typing import Type, Union
+from functools import cached_property, partial
+from queue import Empty
+from threading import Condition, Event
+from time import monotonic
+from typing import Callable, Optional, Type, Union
 
 from broker.context import BrokerContext as Broker
 from exceptions.connected_closed import ConnectionClosed
@@ -11,9 +13,11 @@ from models.client import Client
 from models.constants import TOPIC_SEP
 from models.messages import IncomingMessage, OutgoingMessage
 from exceptions.unexpected_packet import UnexpectedPacketType
+from servers.dispatcher import Lane
+from servers.packet_ids import PacketIdAllocator
 from servers.streams import ReaderWriter
 from packet.base_packet import PacketWithId
-from packet.packets import infer_packet_class
+from packet.packets import packet_table, PACKET_TYPES, UnknownPacketError
 from packet.connack import ConnectAcknowledgePacket
 from packet.connect import ConnectPacket
 from packet.pingreq import PingRequestPacket
@@ -27,38 +31,36 @@ from packet.suback import SubscribeAcknowledgePacket
 from packet.subscribe import SubscribePacket
 from packet.unsub import UnsubscribePacket
 from packet.unsuback import UnsubscribeAcknowledgePacket
-from utils.field import default_factory
 
 
-class TooManyPacketIds(Exception):
-    pass
+# the most the writer takes off the message queue before writing it out
+MAX_BATCH_MESSAGES = 64
+MAX_BATCH_BYTES = 65536
+# how often a writer waiting on a full window looks for deliveries to resend
+RETRY_CHECK = 1
 
 
 @dataclasses.dataclass
-class PacketCondition:
-    type_code: int
-    id: int
-    result: PacketWithId = None
-    condition: Condition = default_factory(Condition)
+class PacketFuture:
+    """
+    Where an expected acknowledgement ends up, the callback gets it on the reading thread
+    """
+    callback: Callable[[PacketWithId], None]
 
-    @cached_property
-    def hash(self):
-        return hash((self.type_code, self.id))
-
-    def __hash__(self):
-        return self.hash
+    def set_result(self, packet: PacketWithId):
+        self.callback(packet)
 
-    def meet(self, packet: PacketWithId):
-        with self.condition:
-            self.result = packet
-            self.condition.notifyAll()
 
-    def wait(self, **kwargs) -> PacketWithId:
-        with self.condition:
-            while self.result is None:
-                self.condition.wait(**kwargs)
-            # noinspection PyTypeChecker
-            return self.result
+@dataclasses.dataclass
+class Delivery:
+    """
+    A qos > 0 message on its way to the client, waiting for `expected`
+    (PUBACK or PUBREC, then PUBCOMP for qos 2)
+    """
+    message: OutgoingMessage
+    packet_id: int
+    expected: Type[PacketWithId]
+    sent_at: float
 
 
 class Handler(Client, ReaderWriter):
@@ -68,12 +70,67 @@ class Handler(Client, ReaderWriter):
     connection_override: bool = False
 
     @cached_property
-    def packet_conditions(self):
-        return set()
+    def packet_futures(self) -> dict[tuple[int, int], PacketFuture]:
+        """
+        The acknowledgements we are waiting for, by (type code, packet id)
+        """
+        return {}
+
+    @cached_property
+    def packet_ids(self) -> PacketIdAllocator:
+        return PacketIdAllocator(self.max_inflight)
+
+    @cached_property
+    def message_queue(self):
+        """
+        Created once the client is connected, the queue is named after its id
+        """
+        return Broker.instance.create_message_queue(self)
+
+    @cached_property
+    def connected(self) -> Event:
+        """
+        Set once CONNECT has been handled, or once the connection is gone before that
+        """
+        return Event()
+
+    @cached_property
+    def inflight(self) -> dict[int, Delivery]:
+        """
+        Deliveries waiting to be acknowledged by packet id, oldest first
+        """
+        return {}
+
+    @cached_property
+    def window(self) -> Condition:
+        """
+        Guards inflight, and is notified whenever a delivery completes
+        """
+        return Condition()
+
+    @cached_property
+    def received_qos_2(self) -> dict[int, PublishPacket]:
+        """
+        Qos 2 publishes we answered with PUBREC, waiting for their PUBREL.
+        Only touched from our lane
+        """
+        return {}
+
+    @cached_property
+    def max_received_qos_2(self) -> int:
+        return max(1, int(Broker.instance.max_received_qos_2))
+
+    @cached_property
+    def max_inflight(self) -> int:
+        return max(1, int(Broker.instance.max_inflight))
+
+    @cached_property
+    def retry_interval(self) -> float:
+        return float(Broker.instance.retry_interval)
 
     @cached_property
-    def used_ids(self):
-        return set()
+    def lane(self):
+        return Lane()
 
     @cached_property
     def host(self):
@@ -94,8 +151,30 @@ class Handler(Client, ReaderWriter):
             SubscribePacket: self.handle_subscribe,
             UnsubscribePacket: self.handle_unsubscribe,
             PublishPacket: self.handle_publish,
+            PublishReleasedPacket: self.handle_publish_release,
         }
 
+    @cached_property
+    def dispatch_table(self) -> list:
+        """
+        (packet class, action) for every packet type we accept, indexed by type code.
+        Acknowledgements of our deliveries are routed to whoever is waiting
+        for them right away, on the reading thread
+        """
+        table = [None] * PACKET_TYPES
+        for packet_class in packet_table:
+            if packet_class is not None:
+                table[packet_class.type_code] = (packet_class, self.unexpected_packet)
+        for packet_class, handler in self.packet_map.items():
+            table[packet_class.type_code] = (packet_class, partial(self.submit_packet, handler))
+        for packet_class in (
+            PublishAcknowledgePacket,
+            PublishReceivedPacket,
+            PublishCompletePacket,
+        ):
+            table[packet_class.type_code] = (packet_class, self.handle_acknowledge)
+        return table
+
     @cached_property
     def publish_map(self):
         return [
@@ -104,18 +183,6 @@ class Handler(Client, ReaderWriter):
             self.handle_publish_qos_2,
         ]
 
-    @property
-    def next_packet_id(self):
-        i = 0
-        while i in self.used_ids:
-            i += 1
-            if i == 65535:
-                raise TooManyPacketIds
-        return i
-
-    def flush(self):
-        pass
-
     @abstractmethod
     def get_host_port_tuple(self) -> (str, int):
         pass
@@ -133,79 +200,172 @@ class Handler(Client, ReaderWriter):
         handler.start_threads()
         return handler
 
-    @staticmethod
-    def infer_packet_class(msg_type):
+    def send_message(self, message: OutgoingMessage) -> bool:
         """
-        To avoid a circular import from class Packet
+        Mote has no reason to downgrade qos.
+        A qos > 0 message only takes up a spot in the window, the rest of its
+        delivery happens as the acknowledgements come in.
+        Returns False if the window is full and the message was not sent
         """
-        return infer_packet_class(msg_type)
-
-    def send_message(self, message: OutgoingMessage):
+        if message.qos == 0:
+            self.write_message(message)
+            return True
+        if not self.open_window():
+            return False
+        self.write_message(message, self.start_delivery(message))
+        return True
+
+    def start_delivery(self, message: OutgoingMessage) -> int:
         """
-        Mote has no reason to downgrade qos
+        Take a packet id and a spot in the window for a qos > 0 message,
+        the window must have room. Returns the packet id to send it with
         """
-        if message.qos == 0:
-            PublishPacket(
-                flags={"qos": message.qos, "retain": False},
-                topic=message.topic,
-                data=message.data,
-            ).write(self)
+        packet_id = self.packet_ids.acquire()
+        if message.qos == 1:
+            expected = PublishAcknowledgePacket
         else:
-            packet_id = self.next_packet_id
-            self.used_ids.add(packet_id)
+            expected = PublishReceivedPacket
+        delivery = Delivery(message, packet_id, expected, monotonic())
+        with self.window:
+            self.inflight[packet_id] = delivery
+        self.expect_packet(expected, packet_id, self.handle_delivery_acknowledge)
+        return packet_id
+
+    def window_full(self) -> bool:
+        with self.window:
+            return len(self.inflight) >= self.max_inflight
+
+    def open_window(self) -> bool:
+        """
+        Wait for a spot in the window, resending whatever is overdue in the meantime
+        """
+        while True:
+            with self.window:
+                if not self.alive:
+                    raise ConnectionError
+                if len(self.inflight) < self.max_inflight:
+                    return True
+                self.window.wait(RETRY_CHECK)
+            self.resend_overdue(monotonic())
+
+    def handle_delivery_acknowledge(self, packet: PacketWithId):
+        """
+        Move a delivery along, PUBACK and PUBCOMP complete it, PUBREC is answered with PUBREL
+        """
+        with self.window:
+            delivery = self.inflight.get(packet.id)
+            if delivery is None:
+                return
+            if not isinstance(packet, PublishReceivedPacket):
+                del self.inflight[packet.id]
+                self.packet_ids.release(packet.id)
+                self.window.notify()
+                self.delivery_completed()
+                return
+            delivery.expected = PublishCompletePacket
+            delivery.sent_at = monotonic()
+        self.expect_packet(PublishCompletePacket, packet.id, self.handle_delivery_acknowledge)
+        PublishReleasedPacket(id=packet.id).write(self)
+
+    def delivery_completed(self):
+        """
+        A spot in the window just opened up, called with the window held
+        """
+
+    def resend_overdue(self, now: float):
+        """
+        Send every delivery that has waited longer than retry_interval
+        for its acknowledgement again, a PUBLISH goes out as a duplicate
+        """
+        with self.window:
+            overdue = [
+                delivery for delivery in self.inflight.values()
+                if now - delivery.sent_at >= self.retry_interval
+            ]
+            for delivery in overdue:
+                delivery.sent_at = now
+        for delivery in overdue:
+            if delivery.expected is PublishCompletePacket:
+                PublishReleasedPacket(id=delivery.packet_id).write(self)
+            else:
+                message = delivery.message
+                self.write(message.publish.to_bytes(message.qos, delivery.packet_id, dup=True))
+                log.debug("Resent", message, "to", self.id)
+
+    def send_batch(self, message: OutgoingMessage) -> Optional[OutgoingMessage]:
+        """
+        Send message along with whatever is queued up behind it, the packets
+        are gathered up and written together. What is gathered goes out before
+        waiting on a full window, the client can't acknowledge what it never got.
+        Returns the message that could not be sent because the window is full
+        """
+        queue = self.message_queue
+        chunks = []
+        size = 0
+        count = 1
+        while True:
+            if message.qos == 0:
+                data = message.publish.to_bytes(0)
+            else:
+                if chunks and self.window_full():
+                    self.write_many(chunks)
+                    chunks = []
+                    size = 0
+                if not self.open_window():
+                    return message
+                data = message.publish.to_bytes(message.qos, self.start_delivery(message))
+            chunks.append(data)
+            size += len(data)
+            log.debug("Wrote", message, "to", self.id)
+            if count >= MAX_BATCH_MESSAGES or size >= MAX_BATCH_BYTES:
+                break
             try:
-                if message.qos == 0:
-                    condition = False
-                elif message.qos == 1:
-                    condition = self.create_packet_condition(PublishAcknowledgePacket, packet_id)
-                else:
-                    condition = self.create_packet_condition(PublishReceivedPacket, packet_id)
-                publish = PublishPacket(
-                    flags={"qos": message.qos, "retain": False},
-                    topic=message.topic,
-                    data=message.data,
-                    id=packet_id,
-                )
-                publish.write(self)
-                if not condition:
-                    return
-                self.wait_for_packet(condition)
-                if message.qos == 2:
-                    release = PublishReleasedPacket(id=packet_id)
-                    condition = self.create_packet_condition(PublishCompletePacket, packet_id)
-                    release.write(self)
-                    self.wait_for_packet(condition)
-            finally:
-                self.used_ids.remove(packet_id)
-
-    def create_packet_condition(self, packet_class: Type[PacketWithId], packet_id: int):
-        packet_condition = PacketCondition(
-            type_code=packet_class.type_code,
-            id=packet_id,
-        )
-        if packet_condition in self.packet_conditions:
+                message = queue.get_nowait()
+            except Empty:
+                break
+            count += 1
+        if chunks:
+            self.write_many(chunks)
+        return None
+
+    def write_many(self, chunks: list[bytes]):
+        """
+        Write several packets, in as few writes as the connection allows
+        """
+        self.write(b"".join(chunks))
+
+    def write_message(self, message: OutgoingMessage, packet_id: int = None):
+        self.write(message.publish.to_bytes(message.qos, packet_id))
+        log.debug("Wrote", message, "to", self.id)
+
+    def expect_packet(
+        self,
+        packet_class: Type[PacketWithId],
+        packet_id: int,
+        callback: Callable[[PacketWithId], None],
+    ) -> PacketFuture:
+        key = (packet_class.type_code, packet_id)
+        if key in self.packet_futures:
             raise KeyError(
                 f"Already waiting for this packet {packet_class} {packet_id}"
             )
-        self.packet_conditions.add(packet_condition)
-        return packet_condition
-
-    def wait_for_packet(self, packet_condition: PacketCondition) -> PacketWithId:
-        try:
-            result = packet_condition.wait()
-        finally:
-            self.packet_conditions.remove(packet_condition)
-        return result
+        future = self.packet_futures[key] = PacketFuture(callback)
+        return future
 
     def packet_notify(self, packet: PacketWithId) -> bool:
-        for packet_condition in self.packet_conditions:
-            if (
-                packet_condition.type_code == packet.type_code
-                and packet_condition.id == packet.id
-            ):
-                packet_condition.meet(packet)
-                return True
-        return False
+        future = self.packet_futures.pop((packet.type_code, packet.id), None)
+        if future is None:
+            return False
+        future.set_result(packet)
+        return True
+
+    def cancel_packet_futures(self):
+        """
+        Nothing is coming anymore, wake up a writer waiting on the window
+        """
+        self.packet_futures.clear()
+        with self.window:
+            self.window.notify_all()
 
     def disconnect(self):
         self.linked = False
@@ -237,24 +397,31 @@ class Handler(Client, ReaderWriter):
         acknowledge.write(self)
 
     def handle_publish_qos_2(self, packet: PublishPacket):
-        received = PublishReceivedPacket(id=packet.id)
-        condition = self.create_packet_condition(PublishReleasedPacket, packet.id)
-        received.write(self)
-        self.wait_for_packet(condition)
-        self.publish(packet)
-        complete = PublishCompletePacket(id=packet.id)
-        complete.write(self)
+        """
+        Hold on to the publish until the client releases it, a resent
+        publish with the same id just replaces the one we hold
+        """
+        received = self.received_qos_2
+        if packet.id not in received and len(received) >= self.max_received_qos_2:
+            log.warn(f"{self} has too many unreleased qos 2 publishes")
+            self.close()
+            return
+        received[packet.id] = packet
+        PublishReceivedPacket(id=packet.id).write(self)
+
+    def handle_publish_release(self, packet: PublishReleasedPacket):
+        """
+        Always answered with PUBCOMP, the publish was already released
+        if we don't know the id (our PUBCOMP got lost)
+        """
+        publish = self.received_qos_2.pop(packet.id, None)
+        if publish is not None:
+            self.publish(publish)
+        PublishCompletePacket(id=packet.id).write(self)
 
     def handle_publish(self, packet: PublishPacket):
         return self.publish_map[packet.flags.qos](packet)
 
-    def using_packet_id(self, func, packet: PacketWithId):
-        self.used_ids.add(packet.id)
-        try:
-            return func(packet)
-        finally:
-            self.used_ids.remove(packet.id)
-
     def handle_subscribe(self, packet: SubscribePacket):
         response_codes = []
         for request in packet.requests:
@@ -291,6 +458,11 @@ class Handler(Client, ReaderWriter):
                 response.write(self)
 
     def handle_disconnected(self):
+        # the reader and the writer can both notice the connection is gone
+        self.linked = False
+        # first, so the broker can't be stuck putting messages in our queue
+        self.message_queue.close()
+        self.cancel_packet_futures()
         Broker.instance.unsubscribe(self, *self.subscriptions)
         if self.connection_override:
             return
@@ -298,45 +470,76 @@ class Handler(Client, ReaderWriter):
         if self.last_will is not None:
             Broker.instance.publish(self.last_will)
 
+    def submit_packet(self, handler, packet):
+        Broker.instance.dispatcher.submit(self.lane, handler, packet)
+
+    def handle_acknowledge(self, packet: PacketWithId):
+        if not self.packet_notify(packet):
+            # most likely the answer to a delivery we resent
+            log.debug("Ignored", packet, "from", self.id)
+
+    @staticmethod
+    def unexpected_packet(packet):
+        raise UnexpectedPacketType(packet)
+
     def handle_packet(self, packet):
-        handler = self.packet_map.get(packet.__class__)
-        if handler:
-            Thread(target=handler, args=[packet], daemon=True).start()
-        elif isinstance(packet, PacketWithId) and self.packet_notify(packet):
-            return
-        else:
-            raise UnexpectedPacketType(packet)
+        self.dispatch_table[packet.type_code][1](packet)
+
+    def read_and_dispatch(self, msg_type: int, flags: int):
+        """
+        Decode the packet that was just framed and hand it
+        straight to whatever handles its type
+        """
+        entry = self.dispatch_table[msg_type]
+        if entry is None:
+            raise UnknownPacketError(msg_type)
+        packet_class, action = entry
+        action(packet_class.read(self, flags))
 
     def start_connection(self):
         pass
 
     def write_loop(self):
+        self.connected.wait()
+        if not self.linked:
+            return
+        next_check = 0
         try:
             while self.alive:
-                message = self.message_queue.get(block=True)
-                self.send_message(message)
+                try:
+                    timeout = RETRY_CHECK if self.inflight else None
+                    self.send_batch(self.message_queue.get(timeout=timeout))
+                except Empty:
+                    pass
+                if self.inflight:
+                    now = monotonic()
+                    if now >= next_check:
+                        self.resend_overdue(now)
+                        next_check = now + RETRY_CHECK
         except ConnectionError:
             self.close()
             if self.linked:
                 self.handle_disconnected()
 
+    def handle_connect(self, connect_packet: ConnectPacket):
+        self.id = connect_packet.client_id
+        acknowledge_packet = ConnectAcknowledgePacket(
+            session_parent=0,
+            return_code=ConnectAcknowledgePacket.ReturnCode.ACCEPTED,
+        )
+        self.last_will = self.get_last_will(connect_packet)
+        acknowledge_packet.write(self)
+        Broker.instance.add_client(self)
+        self.linked = True
+        self.connected.set()
+        self.set_keep_alive(connect_packet.keep_alive + 1)
+
     def read_loop(self):
         try:
             self.start_connection()
-            connect_packet = ConnectPacket.read(self)
-            self.id = connect_packet.client_id
-            acknowledge_packet = ConnectAcknowledgePacket(
-                session_parent=0,
-                return_code=ConnectAcknowledgePacket.ReturnCode.ACCEPTED,
-            )
-            self.last_will = self.get_last_will(connect_packet)
-            acknowledge_packet.write(self)
-            Broker.instance.add_client(self)
-            self.linked = True
-            self.set_keep_alive(connect_packet.keep_alive + 1)
+            self.handle_connect(ConnectPacket.read(self))
             while self.alive:
-                packet = self.read_next_packet()
-                self.handle_packet(packet)
+                self.read_and_dispatch(*self.decode_header())
         except ConnectionClosed:
             pass
         except: #(ConnectionError, UnexpectedPacketType) as x:
@@ -344,15 +547,10 @@ class Handler(Client, ReaderWriter):
             log.traceback("Handler.read_loop", self.id)
         finally:
             self.close()
+            self.connected.set()
             if self.linked:
                 self.handle_disconnected()
 
     @abstractmethod
     def set_keep_alive(self, keep_alive: int):
         pass
-
-    def read_next_packet(self):
-        msg_type, flags = self.decode_header()
-        clazz = self.infer_packet_class(msg_type)
-        packet = clazz.read(self, flags)
-        return packet
@@ -0,0 +1,42 @@
+from threading import Lock
+
+MAX_PACKET_ID = 65535
+
+
+class TooManyPacketIds(Exception):
+    pass
+
+
+class PacketIdAllocator:
+    """
+    Hands out the packet ids (1 to 65535) for one client's outgoing messages,
+    at most limit of them at a time. A cursor rotates through the ids, so a
+    released id is not handed out again right away; only the ids in use are
+    kept, so the cursor never has to skip more than limit of them
+    """
+    def __init__(self, limit: int = MAX_PACKET_ID):
+        self.limit = min(limit, MAX_PACKET_ID)
+        self.used: set[int] = set()
+        self.cursor = 1
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.used)
+
+    def __contains__(self, packet_id: int) -> bool:
+        return packet_id in self.used
+
+    def acquire(self) -> int:
+        with self.lock:
+            if len(self.used) >= self.limit:
+                raise TooManyPacketIds
+            while True:
+                packet_id = self.cursor
+                self.cursor = packet_id + 1 if packet_id < MAX_PACKET_ID else 1
+                if packet_id not in self.used:
+                    self.used.add(packet_id)
+                    return packet_id
+
+    def release(self, packet_id: int):
+        with self.lock:
+            self.used.discard(packet_id)
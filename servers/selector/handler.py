@@ -0,0 +1,112 @@
+from collections import deque
+from itertools import islice
+from selectors import EVENT_READ, EVENT_WRITE
+from socket import socket, SHUT_RDWR
+from time import monotonic
+
+from servers.evented import EventedHandler, MIN_RECV
+from servers.selector.loop import SelectorLoop
+from servers.socket import HAS_SENDMSG, drop_sent
+
+# most systems won't take more than 1024 buffers in one sendmsg
+MAX_BUFFERS = 1024
+
+
+class SelectorHandler(EventedHandler):
+    """
+    A nonblocking client socket served by one of the server's selector loops.
+    Everything that touches the socket happens on the loop thread, bytes written
+    from other threads are handed over to it and sent once the socket takes them
+    """
+    events: int = EVENT_READ
+    closed: bool = False
+
+    def __init__(self, server, sock: socket, io_loop: SelectorLoop):
+        self.server = server
+        self.sock = sock
+        self.io_loop = io_loop
+        self.outgoing = deque()
+        self.last_activity = monotonic()
+
+    def handle_events(self, mask: int):
+        if mask & EVENT_READ:
+            self.readable()
+        if mask & EVENT_WRITE and not self.closed:
+            self.send_outgoing()
+
+    def readable(self):
+        try:
+            with self.incoming.reserve(MIN_RECV) as view:
+                count = self.sock.recv_into(view)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            count = 0
+        if not count:
+            self.shutdown()
+            return
+        self.incoming.commit(count)
+        self.data_received()
+
+    def send_raw(self, data: bytes):
+        self.io_loop.in_loop(self.queue_outgoing, (data,))
+
+    def send_raw_many(self, chunks: list[bytes]):
+        self.io_loop.in_loop(self.queue_outgoing, chunks)
+
+    def queue_outgoing(self, chunks):
+        if self.closed:
+            return
+        waiting = bool(self.outgoing)
+        self.outgoing.extend(chunks)
+        if not waiting:
+            self.send_outgoing()
+
+    def send_outgoing(self):
+        """
+        Send as much as the socket takes, and only wait for it
+        to be writable while there is something left
+        """
+        outgoing = self.outgoing
+        try:
+            while outgoing:
+                if HAS_SENDMSG:
+                    sent = self.sock.sendmsg(islice(outgoing, MAX_BUFFERS))
+                else:
+                    sent = self.sock.send(outgoing[0])
+                drop_sent(outgoing, sent)
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self.shutdown()
+            return
+        events = EVENT_READ | EVENT_WRITE if outgoing else EVENT_READ
+        if events != self.events:
+            self.events = events
+            self.io_loop.selector.modify(self.sock, events, self)
+
+    def get_host_port_tuple(self):
+        return self.sock.getsockname()
+
+    def set_keep_alive(self, seconds: int):
+        self.keep_alive = seconds
+
+    def shutdown(self):
+        """
+        Close the socket, on the loop thread
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.io_loop.remove_client(self)
+        try:
+            self.sock.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.outgoing.clear()
+        self.connection_closed()
+
+    def close(self):
+        self.alive = False
+        self.io_loop.in_loop(self.shutdown)
@@ -0,0 +1,141 @@
+import dataclasses
+from functools import cached_property
+from queue import SimpleQueue, Empty
+from selectors import DefaultSelector, EVENT_READ
+from socket import socketpair
+from threading import Thread, get_ident
+from time import monotonic
+
+from logger import log
+from utils.field import default_factory
+
+# how often the loop looks for connections whose keep alive ran
+# out, or that have deliveries to resend
+CHECK_INTERVAL = 1
+
+
+@dataclasses.dataclass
+class SelectorLoop:
+    """
+    One selector and the thread that waits on it. Every registered object is
+    the data of its selector key and has a handle_events(mask) method.
+    Other threads hand work to the loop with call_soon, which wakes it
+    up through a socket pair instead of a connection to ourselves
+    """
+    name: str
+    alive: bool = True
+    thread_id: int = None
+    calls: SimpleQueue = default_factory(SimpleQueue)
+
+    @cached_property
+    def selector(self) -> DefaultSelector:
+        return DefaultSelector()
+
+    @cached_property
+    def wakeup(self):
+        reader, writer = socketpair()
+        reader.setblocking(False)
+        writer.setblocking(False)
+        return reader, writer
+
+    @cached_property
+    def clients(self) -> set:
+        return set()
+
+    @cached_property
+    def thread(self) -> Thread:
+        return Thread(target=self.run, name=self.name, daemon=True)
+
+    def call_soon(self, func, *args):
+        """
+        Run func on the loop thread, from any thread
+        """
+        self.calls.put((func, args))
+        try:
+            self.wakeup[1].send(b"\0")
+        except BlockingIOError:
+            # the loop has plenty of wake up calls to get to already
+            pass
+
+    def in_loop(self, func, *args):
+        """
+        Run func on the loop thread, right away if we are already on it
+        """
+        if get_ident() == self.thread_id:
+            func(*args)
+        else:
+            self.call_soon(func, *args)
+
+    def handle_events(self, mask: int):
+        try:
+            while self.wakeup[0].recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def run_calls(self):
+        while True:
+            try:
+                func, args = self.calls.get_nowait()
+            except Empty:
+                return
+            try:
+                func(*args)
+            except:
+                log.traceback(self.name, func)
+
+    def add_client(self, client):
+        self.clients.add(client)
+        self.selector.register(client.sock, EVENT_READ, client)
+
+    def remove_client(self, client):
+        self.clients.discard(client)
+        try:
+            self.selector.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+
+    def check_clients(self):
+        now = monotonic()
+        for client in list(self.clients):
+            if client.keep_alive_expired(now):
+                log.debug("Keep alive expired", client.id)
+                client.shutdown()
+            elif client.inflight:
+                client.resend_overdue(now)
+
+    def run(self):
+        self.thread_id = get_ident()
+        self.selector.register(self.wakeup[0], EVENT_READ, self)
+        next_check = monotonic() + CHECK_INTERVAL
+        try:
+            while self.alive:
+                for key, mask in self.selector.select(CHECK_INTERVAL):
+                    try:
+                        key.data.handle_events(mask)
+                    except:
+                        log.traceback(self.name, key.data)
+                self.run_calls()
+                if monotonic() >= next_check:
+                    self.check_clients()
+                    next_check = monotonic() + CHECK_INTERVAL
+        finally:
+            for client in list(self.clients):
+                client.shutdown()
+            self.selector.close()
+            for sock in self.wakeup:
+                sock.close()
+
+    def disconnect_clients(self):
+        for client in list(self.clients):
+            client.disconnect()
+
+    def halt(self):
+        self.alive = False
+
+    def stop(self):
+        """
+        Disconnect our clients and stop, on the loop thread, the clients are only ever touched there
+        """
+        self.call_soon(self.disconnect_clients)
+        self.call_soon(self.halt)
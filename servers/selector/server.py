@@ -0,0 +1,76 @@
+import dataclasses
+from functools import cached_property
+from itertools import cycle
+from selectors import EVENT_READ
+from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
+from typing import Type
+
+from broker.context import BrokerContext as Broker
+from logger import log
+from servers.selector.handler import SelectorHandler
+from servers.selector.loop import SelectorLoop
+from servers.server import Server
+
+
+@dataclasses.dataclass
+class SelectorServer(Server):
+    """
+    Serves every connection from a small, fixed number of selector loops.
+    The server thread runs the first loop, which also accepts the new
+    connections and deals them out to all the loops in turn
+    """
+    handler_class: Type[SelectorHandler] = SelectorHandler
+
+    @cached_property
+    def server(self) -> socket:
+        return socket(AF_INET, SOCK_STREAM)
+
+    @cached_property
+    def io_loops(self) -> list[SelectorLoop]:
+        count = max(1, int(Broker.instance.io_threads))
+        return [SelectorLoop(name=f"{self.name}-{i}") for i in range(count)]
+
+    @cached_property
+    def next_loop(self):
+        return cycle(self.io_loops)
+
+    def handle_events(self, mask: int):
+        while True:
+            try:
+                client_socket, address = self.server.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            try:
+                client_socket.setblocking(False)
+                io_loop = next(self.next_loop)
+                client = self.handler_class.new_connection(self, client_socket, io_loop)
+                io_loop.in_loop(io_loop.add_client, client)
+            except:
+                log.traceback("Could not initialize new client")
+                client_socket.close()
+
+    def loop(self):
+        self.alive = True
+        self.server.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        try:
+            self.server.bind((self.host, self.port))
+        except OSError:
+            log.traceback("Unable to bind", self.host, self.port)
+            return
+        self.server.listen()
+        self.server.setblocking(False)
+        accept_loop, *other_loops = self.io_loops
+        accept_loop.selector.register(self.server, EVENT_READ, self)
+        for io_loop in other_loops:
+            io_loop.thread.start()
+        try:
+            accept_loop.run()
+        finally:
+            self.server.close()
+            for io_loop in other_loops:
+                io_loop.thread.join()
+
+    def stop(self):
+        self.alive = False
+        for io_loop in self.io_loops:
+            io_loop.stop()
@@ -0,0 +1,8 @@
+from servers.selector.handler import SelectorHandler
+from servers.websocket.evented import EventedWebsocket
+
+
+class SelectorWebsocketHandler(EventedWebsocket, SelectorHandler):
+    """
+    A websocket client connection served by a selector loop
+    """
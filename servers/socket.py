@@ -1,5 +1,6 @@
 import dataclasses
 from functools import cached_property
+from collections import deque
 from socket import socket, AF_INET, SOCK_STREAM, SHUT_RDWR, SOL_SOCKET, SO_REUSEADDR
 from threading import Lock
 from typing import Type
@@ -7,11 +8,25 @@ from typing import Type
 from logger import log
 from servers.handler import Handler
 from servers.server import Server
+from servers.streams import BufferedReaderWriter
 from utils.stop_socket import stop_socket
 
+# sendmsg is not available everywhere (windows)
+HAS_SENDMSG = hasattr(socket, "sendmsg")
+
+
+def drop_sent(pending: deque, sent: int):
+    """
+    Drop the first `sent` bytes off the chunks in pending
+    """
+    while pending and sent >= len(pending[0]):
+        sent -= len(pending.popleft())
+    if sent:
+        pending[0] = memoryview(pending[0])[sent:]
+
 
 @dataclasses.dataclass
-class SocketHandler(Handler):
+class SocketHandler(Handler, BufferedReaderWriter):
 
     sock: socket
 
@@ -26,20 +41,31 @@ class SocketHandler(Handler):
         except (OSError, BrokenPipeError, ConnectionResetError):
             raise ConnectionError
 
+    def write_many(self, chunks: list[bytes]):
+        try:
+            with self.outgoing_lock:
+                self.send_chunks(chunks)
+        except (OSError, BrokenPipeError, ConnectionResetError):
+            raise ConnectionError
+
     def send_bytes(self, data: bytes):
-        self.sock.send(data)
+        self.sock.sendall(data)
+
+    def send_chunks(self, chunks: list[bytes]):
+        """
+        Hand all the chunks to the kernel in one sendmsg, only
+        going around again for whatever did not fit
+        """
+        if not HAS_SENDMSG:
+            self.sock.sendall(b"".join(chunks))
+            return
+        pending = deque(chunks)
+        while pending:
+            drop_sent(pending, self.sock.sendmsg(pending))
 
-    def read(self, size):
+    def recv_into(self, view: memoryview) -> int:
         try:
-            cached_bytes = bytearray()
-            byte_count = 0
-            while byte_count < size:
-                buf = self.sock.recv(size)
-                if not buf:
-                    raise ConnectionError
-                cached_bytes.extend(buf)
-                byte_count += len(buf)
-            return bytes(cached_bytes)
+            return self.sock.recv_into(view)
         except OSError as x:
             raise ConnectionError from x
 
@@ -1,5 +1,10 @@
 from abc import abstractmethod
+from functools import cached_property
 from struct import unpack
+from typing import Optional
+
+RECV_SIZE = 65536
+MAX_LENGTH_BYTES = 4
 
 
 class ReaderWriter:
@@ -11,6 +16,9 @@ class ReaderWriter:
     def write(self, data: bytes):
         pass
 
+    def flush(self):
+        pass
+
     def decode_str(self) -> (str, int):
         length_bytes = self.read(2)
         length = unpack("!H", length_bytes)
@@ -19,9 +27,9 @@ class ReaderWriter:
             total_length = length + 2
             byte_str = self.read(length)
             try:
-                return byte_str.decode(encoding="utf-8"), total_length
+                return str(byte_str, encoding="utf-8"), total_length
             except UnicodeDecodeError:
-                return str(byte_str), total_length
+                return str(bytes(byte_str)), total_length
         else:
             return "", 2
 
@@ -32,7 +40,7 @@ class ReaderWriter:
     def decode_bytes(self):
         length_bytes = self.read(2)
         length = unpack("!H", length_bytes)
-        data = self.read(length[0])
+        data = bytes(self.read(length[0]))
         byte_count = 2 + length[0]
         return data, byte_count
 
@@ -60,3 +68,170 @@ class ReaderWriter:
         msg_type = (int1[0] & 0xF0) >> 4
         flags = int1[0] & 0x0F
         return msg_type, flags
+
+
+def parse_fixed_header(buf, start: int, end: int) -> Optional[tuple[int, int, int, int]]:
+    """
+    Decode the fixed header of the packet starting at buf[start], without consuming anything.
+    Returns (msg_type, flags, header_length, remaining_length), or None
+    if buf[start:end] does not hold the whole fixed header yet
+    """
+    if end - start < 2:
+        return None
+    multiplier = 1
+    value = 0
+    i = start + 1
+    while True:
+        if i >= end:
+            return None
+        encoded_byte = buf[i]
+        value += (encoded_byte & 0x7F) * multiplier
+        i += 1
+        if (encoded_byte & 0x80) == 0:
+            break
+        multiplier *= 128
+        if i - start > MAX_LENGTH_BYTES:
+            buf_str = "0x" + bytes(buf[start + 1:i]).hex()
+            raise IOError(f"Invalid remaining length bytes: {buf_str}")
+    byte1 = buf[start]
+    return (byte1 & 0xF0) >> 4, byte1 & 0x0F, i - start, value
+
+
+class FrameReader(ReaderWriter):
+    """
+    Serves field reads out of a single, already framed packet.
+    Reads return memoryview slices of the frame, so anything that
+    needs to outlive the packet must be copied by the field decoder
+    """
+    frame: memoryview = memoryview(b"")
+    frame_pos: int = 0
+
+    def start_frame(self, frame: memoryview):
+        self.frame = frame
+        self.frame_pos = 0
+
+    def read(self, n: int) -> memoryview:
+        start = self.frame_pos
+        end = start + n
+        if end > len(self.frame):
+            raise IOError(f"Read past the end of the packet ({end} > {len(self.frame)})")
+        self.frame_pos = end
+        return self.frame[start:end]
+
+    def decode_packet_length(self):
+        return len(self.frame)
+
+    def flush(self):
+        self.frame = FrameReader.frame
+        self.frame_pos = 0
+
+
+class ReceiveBuffer:
+    """
+    A reusable receive buffer, bytes are received into the free space after
+    `end` and consumed from `start`; the pending bytes are moved back to the
+    front (or into a bigger buffer) only when the free space runs out
+    """
+    def __init__(self, size: int = RECV_SIZE):
+        self.data = bytearray(size)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def reserve(self, size: int) -> memoryview:
+        """
+        Return the free space after the pending bytes, at least size bytes of it
+        """
+        data = self.data
+        if self.end + size > len(data):
+            pending = self.end - self.start
+            if pending + size > len(data):
+                # never resize in place, a frame may still be looking at the old buffer
+                new_data = bytearray(max(pending + size, len(data) * 2))
+                new_data[:pending] = data[self.start:self.end]
+                self.data = data = new_data
+            elif pending:
+                data[:pending] = data[self.start:self.end]
+            self.start = 0
+            self.end = pending
+        return memoryview(data)[self.end:]
+
+    def commit(self, count: int):
+        """
+        Mark count bytes of the reserved space as received
+        """
+        self.end += count
+
+    def extend(self, payload: bytes):
+        count = len(payload)
+        self.reserve(count)[:count] = payload
+        self.end += count
+
+    def consume(self, count: int) -> memoryview:
+        """
+        Return the next count pending bytes as a view, and move past them
+        """
+        start = self.start
+        self.start += count
+        if self.start == self.end:
+            self.start = self.end = 0
+        return memoryview(self.data)[start:start + count]
+
+
+class BufferedReaderWriter(FrameReader):
+    """
+    Pulls large chunks off the connection into a reusable receive buffer
+    and frames whole packets out of it, so a packet costs one recv at most
+    (usually less) instead of one per field
+    """
+    @abstractmethod
+    def recv_into(self, view: memoryview) -> int:
+        """
+        Receive as many bytes as are available (up to len(view)) into view,
+        and return the number of bytes received; 0 means the peer is gone
+        """
+
+    @cached_property
+    def recv(self) -> ReceiveBuffer:
+        return ReceiveBuffer()
+
+    def fill(self, size: int):
+        """
+        Block until at least size unconsumed bytes are buffered
+        """
+        recv = self.recv
+        while len(recv) < size:
+            with recv.reserve(size - len(recv)) as view:
+                count = self.recv_into(view)
+            if not count:
+                raise ConnectionError
+            recv.commit(count)
+
+    def next_frame(self) -> Optional[tuple[int, int]]:
+        """
+        If the next packet has been received completely, make it
+        the current frame and return its (msg_type, flags)
+        """
+        recv = self.recv
+        header = parse_fixed_header(recv.data, recv.start, recv.end)
+        if header is None:
+            return None
+        msg_type, flags, header_length, length = header
+        if len(recv) < header_length + length:
+            return None
+        recv.consume(header_length)
+        self.start_frame(recv.consume(length))
+        return msg_type, flags
+
+    def decode_header(self):
+        """
+        Frame the next whole packet and make it the current frame
+        """
+        self.fill(2)
+        while True:
+            header = self.next_frame()
+            if header is not None:
+                return header
+            self.fill(len(self.recv) + 1)
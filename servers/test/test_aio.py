@@ -0,0 +1,175 @@
+from threading import get_ident
+from types import SimpleNamespace
+
+import pytest
+
+from broker.context import BrokerContext
+from models.message_queue import FifoQueue
+from models.messages import OutgoingMessage
+from packet.connack import ConnectAcknowledgePacket
+from packet.puback import PublishAcknowledgePacket
+from packet.publish import PublishPacket
+from servers.aio.handler import AsyncHandler
+from servers.streams import parse_fixed_header
+
+# CONNECT for client id "id", clean session, 60 second keep alive
+CONNECT = b"\x10\x0e\x00\x04MQTT\x04\x02\x00\x3c\x00\x02id"
+CONNACK = b"\x20\x02\x00\x00"
+
+
+class FakeTransport:
+    """
+    Keeps whatever the handler writes, instead of a socket
+    """
+    closed = False
+
+    def __init__(self):
+        self.sent = bytearray()
+
+    def write(self, data: bytes):
+        self.sent.extend(data)
+
+    def writelines(self, chunks: list[bytes]):
+        for chunk in chunks:
+            self.sent.extend(chunk)
+
+    def close(self):
+        self.closed = True
+
+    def get_extra_info(self, name: str):
+        return "127.0.0.1", 1883
+
+    def packets(self) -> list[tuple[int, int, bytes]]:
+        """
+        (type code, flags, payload) of every packet written so far
+        """
+        result = []
+        start = 0
+        while start < len(self.sent):
+            msg_type, flags, header_length, length = parse_fixed_header(self.sent, start, len(self.sent))
+            payload_start = start + header_length
+            result.append((msg_type, flags, bytes(self.sent[payload_start:payload_start + length])))
+            start = payload_start + length
+        return result
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = SimpleNamespace(
+        max_inflight=4,
+        retry_interval=20,
+        max_received_qos_2=2,
+        # run the packet handlers and the writer right away
+        dispatcher=SimpleNamespace(submit=lambda lane, func, *args: func(*args)),
+        create_message_queue=lambda client: FifoQueue(name=client),
+        clients=[],
+        published=[],
+        unsubscribed=[],
+    )
+    broker.add_client = broker.clients.append
+    broker.remove_client = broker.clients.remove
+    broker.publish = broker.published.append
+    broker.unsubscribe = lambda client, *topics: broker.unsubscribed.append(client)
+    monkeypatch.setattr(BrokerContext, "instance", broker, raising=False)
+    return broker
+
+
+@pytest.fixture
+def server():
+    """
+    The handler is on the event loop thread, the loop itself only collects timers
+    """
+    timers = []
+    return SimpleNamespace(
+        thread_id=get_ident(),
+        clients=set(),
+        event_loop=SimpleNamespace(call_later=lambda *args: timers.append(args)),
+        timers=timers,
+    )
+
+
+@pytest.fixture
+def transport():
+    return FakeTransport()
+
+
+@pytest.fixture
+def handler(broker, server, transport):
+    handler = AsyncHandler.new_connection(server)
+    handler.connection_made(transport)
+    return handler
+
+
+def feed(handler: AsyncHandler, data: bytes, step: int = None):
+    """
+    Hand data to the handler the way the event loop does, step bytes per buffer_updated
+    """
+    step = step or len(data)
+    for start in range(0, len(data), step):
+        piece = data[start:start + step]
+        handler.get_buffer(-1)[:len(piece)] = piece
+        handler.buffer_updated(len(piece))
+
+
+def publish(qos: int, packet_id: int = None, data: bytes = b"1") -> bytes:
+    return bytes(PublishPacket(
+        flags={"qos": qos, "retain": False, "dup": False},
+        topic="light/bedroom/is_on",
+        data=data,
+        id=packet_id,
+    ).to_bytes())
+
+
+class TestAsyncHandler:
+    def test_connect(self, broker, server, transport, handler):
+        assert server.clients == {handler}
+        feed(handler, CONNECT)
+        assert transport.sent == CONNACK
+        assert handler.linked
+        assert broker.clients == [handler]
+        assert str(handler.message_queue.name) == "Client id"
+        [(delay, check)] = server.timers
+        assert delay == 61
+        assert check == handler.check_keep_alive
+
+    def test_qos_1_round_trip(self, broker, transport, handler):
+        feed(handler, CONNECT + publish(1, 7))
+        [message] = broker.published
+        assert message.data == b"1"
+        assert transport.packets()[1] == (PublishAcknowledgePacket.type_code, 0, b"\x00\x07")
+        handler.queue_message(OutgoingMessage("light/bedroom/is_on", 1, b"2"))
+        msg_type, flags, payload = transport.packets()[2]
+        assert msg_type == PublishPacket.type_code
+        assert flags >> 1 & 3 == 1
+        [packet_id] = handler.inflight
+        feed(handler, bytes(PublishAcknowledgePacket(id=packet_id).to_bytes()))
+        assert not handler.inflight
+        assert not handler.packet_ids
+
+    def test_disconnect_cleanup(self, broker, server, transport, handler):
+        feed(handler, CONNECT)
+        handler.queue_message(OutgoingMessage("light/bedroom/is_on", 1, b"2"))
+        handler.connection_lost(None)
+        assert not server.clients
+        assert not handler.alive
+        assert not handler.linked
+        assert not handler.packet_futures
+        assert broker.unsubscribed == [handler]
+        assert broker.clients == []
+
+    def test_close_closes_transport(self, transport, handler):
+        feed(handler, CONNECT)
+        handler.close()
+        assert transport.closed
+        assert not handler.alive
+
+    @pytest.mark.parametrize("step", [1, 2, 3, 7])
+    def test_framing_across_reads(self, broker, transport, handler, step):
+        """
+        Packets split at any byte come out whole, several of them in one read as well
+        """
+        data = CONNECT + publish(0, data=b"x" * 200) + publish(1, 3, b"y") + publish(0, data=b"z")
+        feed(handler, data, step)
+        assert transport.packets()[0] == (ConnectAcknowledgePacket.type_code, 0, b"\x00\x00")
+        assert [message.data for message in broker.published] == [b"x" * 200, b"y", b"z"]
+        assert transport.packets()[1:] == [(PublishAcknowledgePacket.type_code, 0, b"\x00\x03")]
@@ -0,0 +1,44 @@
+from threading import Event, Timer
+
+from servers.dispatcher import LANE_BATCH, Dispatcher, Lane
+
+
+class TestDispatcher:
+    def test_lane_runs_in_order(self):
+        lane = Lane()
+        done = []
+        with Dispatcher(workers=4) as dispatcher:
+            for i in range(LANE_BATCH * 10):
+                dispatcher.submit(lane, done.append, i)
+        assert done == list(range(LANE_BATCH * 10))
+
+    def test_lanes_run_at_the_same_time(self):
+        """
+        A task waiting on another lane doesn't hold that lane up
+        """
+        ready = Event()
+        results = []
+        with Dispatcher(workers=2) as dispatcher:
+            dispatcher.submit(Lane(), lambda: results.append(ready.wait(5)))
+            dispatcher.submit(Lane(), ready.set)
+        assert results == [True]
+
+    def test_stop_drains_lanes(self):
+        """
+        Everything submitted before stopping runs, including the rest
+        of a busy lane that was queued up again behind the stop signals
+        """
+        release = Event()
+        busy = Lane()
+        done = []
+        dispatcher = Dispatcher(workers=1)
+        with dispatcher:
+            dispatcher.submit(busy, release.wait, 5)
+            for i in range(LANE_BATCH * 3):
+                dispatcher.submit(busy, done.append, ("busy", i))
+            for i in range(3):
+                dispatcher.submit(Lane(), done.append, ("other", i))
+            Timer(0.1, release.set).start()
+        assert [item for item in done if item[0] == "busy"] == [("busy", i) for i in range(LANE_BATCH * 3)]
+        assert len(done) == LANE_BATCH * 3 + 3
+        assert dispatcher.stats["depth"] == 0
@@ -0,0 +1,238 @@
+from types import SimpleNamespace
+
+import pytest
+
+from broker.context import BrokerContext
+from models.message_queue import FifoQueue
+from models.messages import OutgoingMessage
+from packet.puback import PublishAcknowledgePacket
+from packet.pubcomp import PublishCompletePacket
+from packet.publish import DUP_FLAG, PublishPacket
+from packet.pubrec import PublishReceivedPacket
+from packet.pubrel import PublishReleasedPacket
+from servers.evented import EventedHandler
+from servers.handler import MAX_BATCH_MESSAGES
+from servers.streams import parse_fixed_header
+
+
+class LaneDispatcher:
+    """
+    Holds on to the submitted tasks until run, in the order they were submitted
+    """
+    def __init__(self):
+        self.tasks = []
+
+    def submit(self, lane, func, *args):
+        self.tasks.append((func, args))
+
+    def run(self):
+        while self.tasks:
+            func, args = self.tasks.pop(0)
+            func(*args)
+
+
+@pytest.fixture
+def broker(monkeypatch):
+    broker = SimpleNamespace(
+        max_inflight=1,
+        retry_interval=20,
+        max_received_qos_2=2,
+        dispatcher=LaneDispatcher(),
+        create_message_queue=lambda client: FifoQueue(),
+        published=[],
+    )
+    broker.publish = broker.published.append
+    monkeypatch.setattr(BrokerContext, "instance", broker, raising=False)
+    return broker
+
+
+class FakeEventedHandler(EventedHandler):
+    """
+    Keeps whatever it writes, instead of a connection
+    """
+    def __init__(self):
+        self.id = "test"
+        self.sent = bytearray()
+        self.writes = 0
+
+    def send_raw(self, data: bytes):
+        self.sent.extend(data)
+        self.writes += 1
+
+    def close(self):
+        self.alive = False
+
+    def get_host_port_tuple(self):
+        return "127.0.0.1", 0
+
+    def receive(self, *packets):
+        """
+        Have the packets arrive the way the event loop hands them over, and run what they submit
+        """
+        for packet in packets:
+            self.incoming.extend(bytes(packet.to_bytes()))
+        self.data_received()
+        BrokerContext.instance.dispatcher.run()
+
+    def packets(self) -> list[tuple[int, int, bytes]]:
+        """
+        (type code, flags, payload) of every packet written so far
+        """
+        result = []
+        start = 0
+        while start < len(self.sent):
+            msg_type, flags, header_length, length = parse_fixed_header(self.sent, start, len(self.sent))
+            payload_start = start + header_length
+            result.append((msg_type, flags, bytes(self.sent[payload_start:payload_start + length])))
+            start = payload_start + length
+        return result
+
+
+@pytest.fixture
+def handler(broker):
+    handler = FakeEventedHandler()
+    handler.linked = True
+    return handler
+
+
+def packet_id(payload: bytes) -> int:
+    return int.from_bytes(payload[:2], "big")
+
+
+def publish(qos: int, packet_id: int, dup: bool = False) -> PublishPacket:
+    return PublishPacket(
+        flags={"qos": qos, "retain": False, "dup": dup},
+        topic="light/bedroom/is_on",
+        data=b"1",
+        id=packet_id,
+    )
+
+
+class TestInboundQos2:
+    def test_exchange(self, broker, handler):
+        """
+        The publish is only published once the client releases it
+        """
+        handler.receive(publish(2, 5))
+        assert handler.packets() == [(PublishReceivedPacket.type_code, 0, b"\x00\x05")]
+        assert not broker.published
+        handler.receive(PublishReleasedPacket(id=5))
+        [message] = broker.published
+        assert message.data == b"1"
+        assert handler.packets()[1] == (PublishCompletePacket.type_code, 0, b"\x00\x05")
+        assert not handler.received_qos_2
+
+    def test_duplicate_while_pending(self, broker, handler):
+        handler.receive(publish(2, 5), publish(2, 5, dup=True))
+        assert [packet[0] for packet in handler.packets()] == [PublishReceivedPacket.type_code] * 2
+        handler.receive(PublishReleasedPacket(id=5))
+        assert len(broker.published) == 1
+
+    def test_release_unknown_id(self, broker, handler):
+        """
+        Our PUBCOMP got lost and the client released the publish again
+        """
+        handler.receive(PublishReleasedPacket(id=9))
+        assert handler.packets() == [(PublishCompletePacket.type_code, 0, b"\x00\x09")]
+        assert not broker.published
+
+    def test_too_many_unreleased(self, broker, handler):
+        handler.receive(publish(2, 1), publish(2, 2))
+        assert handler.alive
+        handler.receive(publish(2, 3))
+        assert not handler.alive
+        assert [packet_id(payload) for _, _, payload in handler.packets()] == [1, 2]
+        assert 3 not in handler.received_qos_2
+
+
+class TestEventedWindow:
+    def test_full_window_holds_message(self, broker, handler):
+        handler.queue_message(OutgoingMessage("a", 1, b"first"))
+        handler.queue_message(OutgoingMessage("a", 1, b"second"))
+        broker.dispatcher.run()
+        assert len(handler.packets()) == 1
+        assert handler.held.data == b"second"
+        assert handler.window_blocked
+
+    def test_queue_drains_after_full_window(self, broker, handler):
+        """
+        Everything queued while the window was full is sent once it opens up,
+        even when that takes more than one batch
+        """
+        handler.queue_message(OutgoingMessage("a", 1, b"first"))
+        handler.queue_message(OutgoingMessage("a", 1, b"second"))
+        for i in range(MAX_BATCH_MESSAGES * 2):
+            handler.queue_message(OutgoingMessage("b", 0, str(i).encode()))
+        broker.dispatcher.run()
+        assert len(handler.packets()) == 1
+        assert handler.held is not None
+        [packet_id] = handler.inflight
+        handler.handle_acknowledge(PublishAcknowledgePacket(id=packet_id))
+        broker.dispatcher.run()
+        assert handler.message_queue.empty()
+        assert handler.held is None
+        publishes = [packet for packet in handler.packets() if packet[0] == PublishPacket.type_code]
+        assert len(publishes) == 2 + MAX_BATCH_MESSAGES * 2
+
+    def test_batch_is_one_write(self, broker, handler):
+        """
+        The qos > 0 publishes of a batch are written along with the qos 0 ones
+        """
+        broker.max_inflight = 4
+        for qos in (1, 0, 2, 1):
+            handler.queue_message(OutgoingMessage("a", qos, b"1"))
+        broker.dispatcher.run()
+        assert handler.writes == 1
+        assert [flags >> 1 & 3 for _, flags, _ in handler.packets()] == [1, 0, 2, 1]
+        assert len(handler.inflight) == 3
+
+    def test_batch_written_before_full_window(self, broker, handler):
+        """
+        What was gathered goes out before the writer stops for a full window
+        """
+        for qos in (1, 0, 1):
+            handler.queue_message(OutgoingMessage("a", qos, b"1"))
+        broker.dispatcher.run()
+        assert [flags >> 1 & 3 for _, flags, _ in handler.packets()] == [1, 0]
+        assert handler.held.qos == 1
+
+    def test_resend_publish_as_duplicate(self, broker, handler):
+        handler.queue_message(OutgoingMessage("a", 1, b"first"))
+        broker.dispatcher.run()
+        [delivery] = handler.inflight.values()
+        handler.resend_overdue(delivery.sent_at + 1)
+        assert len(handler.packets()) == 1
+        handler.resend_overdue(delivery.sent_at + broker.retry_interval)
+        (_, flags, payload), (_, resent_flags, resent_payload) = handler.packets()
+        assert not flags & DUP_FLAG
+        assert resent_flags == flags | DUP_FLAG
+        assert resent_payload == payload
+
+    def test_resend_release(self, broker, handler):
+        """
+        Once the client has PUBREC'd a qos 2 delivery, the PUBREL is what gets resent
+        """
+        handler.queue_message(OutgoingMessage("a", 2, b"first"))
+        broker.dispatcher.run()
+        [packet_id] = handler.inflight
+        handler.receive(PublishReceivedPacket(id=packet_id))
+        release = (PublishReleasedPacket.type_code, 0x02, packet_id.to_bytes(2, "big"))
+        assert handler.packets()[1:] == [release]
+        handler.resend_overdue(handler.inflight[packet_id].sent_at + broker.retry_interval)
+        assert handler.packets()[1:] == [release, release]
+        handler.receive(PublishCompletePacket(id=packet_id))
+        assert not handler.inflight
+        assert not handler.packet_ids
+
+    def test_unmatched_acknowledge_is_ignored(self, broker, handler):
+        handler.queue_message(OutgoingMessage("a", 1, b"first"))
+        broker.dispatcher.run()
+        [packet_id] = handler.inflight
+        handler.receive(
+            PublishAcknowledgePacket(id=packet_id + 1),
+            PublishCompletePacket(id=packet_id),
+        )
+        assert handler.alive
+        assert list(handler.inflight) == [packet_id]
+        handler.receive(PublishAcknowledgePacket(id=packet_id))
+        assert not handler.inflight
@@ -0,0 +1,57 @@
+import pytest
+
+from servers.packet_ids import PacketIdAllocator, TooManyPacketIds, MAX_PACKET_ID
+
+
+class TestPacketIdAllocator:
+    def test_never_zero(self):
+        allocator = PacketIdAllocator()
+        ids = [allocator.acquire() for _ in range(MAX_PACKET_ID)]
+        assert sorted(ids) == list(range(1, MAX_PACKET_ID + 1))
+        assert len(allocator) == MAX_PACKET_ID
+
+    def test_exhausted(self):
+        allocator = PacketIdAllocator()
+        for _ in range(MAX_PACKET_ID):
+            allocator.acquire()
+        with pytest.raises(TooManyPacketIds):
+            allocator.acquire()
+        allocator.release(300)
+        assert allocator.acquire() == 300
+
+    def test_rotates(self):
+        """
+        A released id is only reused once the cursor comes back around
+        """
+        allocator = PacketIdAllocator()
+        first = allocator.acquire()
+        allocator.release(first)
+        assert allocator.acquire() == first + 1
+        assert first not in allocator
+        assert len(allocator) == 1
+
+    def test_wraps_around(self):
+        allocator = PacketIdAllocator()
+        allocator.cursor = MAX_PACKET_ID
+        assert allocator.acquire() == MAX_PACKET_ID
+        assert allocator.acquire() == 1
+
+    def test_release_twice(self):
+        allocator = PacketIdAllocator()
+        packet_id = allocator.acquire()
+        allocator.release(packet_id)
+        allocator.release(packet_id)
+        assert len(allocator) == 0
+
+    def test_limit(self):
+        """
+        No more than limit ids at a time, and the cursor keeps rotating past them
+        """
+        allocator = PacketIdAllocator(2)
+        assert allocator.acquire() == 1
+        assert allocator.acquire() == 2
+        with pytest.raises(TooManyPacketIds):
+            allocator.acquire()
+        allocator.release(1)
+        assert allocator.acquire() == 3
+        assert allocator.used == {2, 3}
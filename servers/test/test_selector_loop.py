@@ -0,0 +1,26 @@
+from servers.selector.loop import SelectorLoop
+
+
+class FakeClient:
+    disconnected = False
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+class TestSelectorLoop:
+    def test_stop_disconnects_on_the_loop(self):
+        """
+        Stopping only queues the work, the clients are disconnected by the loop thread
+        """
+        io_loop = SelectorLoop(name="test")
+        clients = [FakeClient(), FakeClient()]
+        io_loop.clients.update(clients)
+        io_loop.stop()
+        assert not any(client.disconnected for client in clients)
+        assert io_loop.alive
+        io_loop.run_calls()
+        assert all(client.disconnected for client in clients)
+        assert not io_loop.alive
+        for sock in io_loop.wakeup:
+            sock.close()
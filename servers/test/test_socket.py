@@ -0,0 +1,73 @@
+from socket import socketpair
+from time import sleep
+from types import SimpleNamespace
+
+import pytest
+
+from broker.context import BrokerContext
+from models.message_queue import FifoQueue
+from servers.socket import SocketHandler
+
+# CONNECT for client id "id", clean session, 60 second keep alive
+CONNECT = b"\x10\x0e\x00\x04MQTT\x04\x02\x00\x3c\x00\x02id"
+
+
+class ShortWriteSocket:
+    """
+    Takes at most `limit` bytes per sendmsg, like a full socket buffer would
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.sent = bytearray()
+        self.calls = 0
+
+    def sendmsg(self, buffers):
+        self.calls += 1
+        data = b"".join(bytes(buffer) for buffer in buffers)[:self.limit]
+        self.sent.extend(data)
+        return len(data)
+
+
+class TestSendChunks:
+    @pytest.mark.parametrize("limit", [1, 5, 7, 1000])
+    def test_partial_writes(self, limit):
+        chunks = [b"abc", b"defghijkl", b"", b"mnopqrstuvwxyz" * 3]
+        sock = ShortWriteSocket(limit)
+        SocketHandler(sock=sock).send_chunks(chunks)
+        assert sock.sent == b"".join(chunks)
+
+    def test_one_call(self):
+        chunks = [bytes([i]) * 10 for i in range(64)]
+        sock = ShortWriteSocket(65536)
+        SocketHandler(sock=sock).send_chunks(chunks)
+        assert sock.calls == 1
+
+
+class TestConnect:
+    def test_queue_named_after_connect(self, monkeypatch):
+        """
+        The write thread waits for CONNECT, so the queue and the name
+        are only settled once the client id is known
+        """
+        added = []
+        broker = SimpleNamespace(
+            create_message_queue=lambda client: FifoQueue(name=client),
+            add_client=added.append,
+            remove_client=lambda client: None,
+            unsubscribe=lambda client, *topics: True,
+        )
+        monkeypatch.setattr(BrokerContext, "instance", broker, raising=False)
+        server, client = socketpair()
+        handler = SocketHandler.new_connection(server)
+        sleep(0.1)
+        assert str(handler) == "Client None"
+        assert "message_queue" not in vars(handler)
+        client.sendall(CONNECT)
+        assert client.recv(4) == b"\x20\x02\x00\x00"
+        assert handler.connected.wait(1)
+        assert added == [handler]
+        assert str(handler) == str(handler.message_queue.name) == "Client id"
+        client.close()
+        handler.read_thread.join(1)
+        handler.write_thread.join(1)
+        assert not handler.write_thread.is_alive()
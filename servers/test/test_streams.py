@@ -0,0 +1,91 @@
+import pytest
+
+from servers.streams import BufferedReaderWriter, parse_fixed_header
+
+
+class ChunkedReader(BufferedReaderWriter):
+    """
+    Hands out the bytes in the chunks it was given, one recv at a time
+    """
+    def __init__(self, *chunks: bytes):
+        self.chunks = list(chunks)
+        self.recvs = 0
+
+    def recv_into(self, view: memoryview) -> int:
+        if not self.chunks:
+            return 0
+        self.recvs += 1
+        chunk = self.chunks.pop(0)
+        count = min(len(chunk), len(view))
+        view[:count] = chunk[:count]
+        if count < len(chunk):
+            self.chunks.insert(0, chunk[count:])
+        return count
+
+    def write(self, data: bytes):
+        pass
+
+
+def packet(msg_type: int, flags: int, payload: bytes) -> bytes:
+    length = len(payload)
+    header = bytearray([(msg_type << 4) | flags])
+    while True:
+        byte = length & 0x7F
+        length >>= 7
+        header.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(header) + payload
+
+
+# a two byte remaining length
+LONG = packet(3, 2, bytes(range(256)) * 2)
+
+
+class TestFraming:
+    @pytest.mark.parametrize("split", range(1, 5))
+    def test_split_header(self, split):
+        """
+        The fixed header and its remaining length arrive across several recvs
+        """
+        reader = ChunkedReader(LONG[:split], LONG[split:])
+        assert reader.decode_header() == (3, 2)
+        assert bytes(reader.read(512)) == LONG[3:]
+        with pytest.raises(IOError):
+            reader.read(1)
+
+    def test_byte_at_a_time(self):
+        reader = ChunkedReader(*[LONG[i:i + 1] for i in range(len(LONG))])
+        assert reader.decode_header() == (3, 2)
+        assert bytes(reader.frame) == LONG[3:]
+
+    def test_several_frames_in_one_recv(self):
+        first = packet(3, 0, b"first")
+        empty = packet(12, 0, b"")
+        last = packet(3, 1, b"last")
+        reader = ChunkedReader(first + empty + last + last[:2])
+        frames = []
+        for _ in range(3):
+            frames.append((reader.decode_header(), bytes(reader.frame)))
+        assert frames == [((3, 0), b"first"), ((12, 0), b""), ((3, 1), b"last")]
+        assert reader.recvs == 1
+        assert reader.next_frame() is None
+
+    def test_malformed_length(self):
+        reader = ChunkedReader(b"\x30\xff\xff", b"\xff\xff\x01")
+        with pytest.raises(IOError):
+            reader.decode_header()
+
+
+class TestParseFixedHeader:
+    def test_incomplete(self):
+        assert parse_fixed_header(b"\x30", 0, 1) is None
+        assert parse_fixed_header(b"\x30\x80\x80", 0, 3) is None
+
+    def test_longest_length(self):
+        data = b"\x00\x30\xff\xff\xff\x7f"
+        assert parse_fixed_header(data, 1, len(data)) == (3, 0, 5, 268435455)
+
+    def test_too_long_length(self):
+        data = b"\x30\xff\xff\xff\xff\x01"
+        with pytest.raises(IOError):
+            parse_fixed_header(data, 0, len(data))
@@ -0,0 +1,100 @@
+from functools import cached_property
+
+from exceptions.connected_closed import ConnectionClosed
+from logger import log
+from servers.streams import ReceiveBuffer
+from servers.websocket.frame import (
+    OP_BYTES,
+    OP_CLOSE,
+    OP_CONTINUATION,
+    OP_PING,
+    OP_PONG,
+    Frame,
+)
+from servers.websocket.handshake import WebsocketHandshake
+
+# an upgrade request bigger than this is not a request we want
+MAX_HANDSHAKE = 16384
+HANDSHAKE_END = b"\r\n\r\n"
+
+
+class EventedWebsocket(WebsocketHandshake):
+    """
+    Websocket support for the EventedHandlers, the event loop receives raw websocket
+    bytes into their own buffer, the payload of each data frame is then fed into
+    the MQTT receive buffer
+    """
+    upgraded: bool = False
+
+    @cached_property
+    def ws_recv(self) -> ReceiveBuffer:
+        return ReceiveBuffer()
+
+    @property
+    def incoming(self) -> ReceiveBuffer:
+        return self.ws_recv
+
+    def data_received(self):
+        try:
+            if not self.upgraded:
+                self.upgrade()
+            if self.upgraded:
+                self.read_frames()
+        except ConnectionClosed:
+            pass
+        except:
+            log.traceback(f"{self.__class__.__name__}.data_received", self.id)
+            self.close()
+
+    def upgrade(self):
+        ws_recv = self.ws_recv
+        i = ws_recv.data.find(HANDSHAKE_END, ws_recv.start, ws_recv.end)
+        if i < 0:
+            if len(ws_recv) > MAX_HANDSHAKE:
+                raise ConnectionError("Invalid Handshake")
+            return
+        request = bytes(ws_recv.consume(i + len(HANDSHAKE_END) - ws_recv.start))
+        handshake = self.get_handshake_response(request.decode())
+        if not handshake:
+            raise ConnectionError("Invalid Handshake")
+        self.send_raw(handshake.encode())
+        self.upgraded = True
+
+    def read_frames(self):
+        ws_recv = self.ws_recv
+        while self.alive:
+            parsed = Frame.parse(ws_recv.data, ws_recv.start, ws_recv.end)
+            if parsed is None:
+                return
+            frame, size = parsed
+            ws_recv.consume(size)
+            if frame.opcode in [OP_BYTES, OP_CONTINUATION]:
+                self.recv.extend(frame.payload)
+                self.received()
+            elif frame.opcode == OP_CLOSE:
+                log.debug("Websocket closed", self.id)
+                self.send_frame(opcode=OP_CLOSE)
+                self.close()
+            elif frame.opcode == OP_PING:
+                self.send_frame(opcode=OP_PONG, payload=frame.payload)
+            elif frame.opcode == OP_PONG:
+                pass
+            else:
+                log.warn(f"{self} sent invalid frame: {frame}")
+                self.close()
+
+    def send_frame(self, **kwargs):
+        if self.alive:
+            self.send_raw(Frame(**kwargs).bytes)
+
+    def write(self, data: bytes):
+        if not self.alive:
+            raise ConnectionError
+        self.send_raw(Frame(opcode=OP_BYTES, payload=data).bytes)
+
+    def write_many(self, chunks: list[bytes]):
+        """
+        MQTT packets don't have to line up with websocket messages,
+        the whole batch goes out as one message
+        """
+        self.write(b"".join(chunks))
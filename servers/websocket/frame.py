@@ -2,6 +2,7 @@ import dataclasses
 import errno
 from socket import socket, timeout
 from functools import cached_property
+from typing import Optional
 
 from logger import log
 
@@ -74,8 +75,54 @@ class Frame:
 
     @staticmethod
     def unmask(key: bytes, data: bytes) -> bytes:
-        result = bytearray(data[i] ^ key[i % 4] for i in range(len(data)))
-        return bytes(result)
+        # xor the whole payload at once as one big integer
+        length = len(data)
+        if not length:
+            return b""
+        repeated_key = (bytes(key) * (length // 4 + 1))[:length]
+        result = int.from_bytes(data, "little") ^ int.from_bytes(repeated_key, "little")
+        return result.to_bytes(length, "little")
+
+    @classmethod
+    def parse(cls, buf, start: int, end: int) -> Optional[tuple["Frame", int]]:
+        """
+        Decode the frame at buf[start:end] without blocking, return it with the
+        number of bytes it took up, or None if it has not been received completely
+        """
+        if end - start < 2:
+            return None
+        fin = (buf[start] & 128) == 128
+        opcode = (buf[start] & 15)
+        masked = (buf[start + 1] & 128) == 128
+        payload_len = (buf[start + 1] & 127)
+        pos = start + 2
+        if payload_len == 126:
+            if end - pos < 2:
+                return None
+            payload_len = int.from_bytes(buf[pos:pos + 2], "big")
+            pos += 2
+        elif payload_len == 127:
+            if end - pos < 8:
+                return None
+            payload_len = int.from_bytes(buf[pos:pos + 8], "big")
+            pos += 8
+        if masked:
+            if end - pos < 4:
+                return None
+            key = buf[pos:pos + 4]
+            pos += 4
+        if end - pos < payload_len:
+            return None
+        payload = bytes(buf[pos:pos + payload_len])
+        if masked:
+            payload = cls.unmask(key, payload)
+        result = cls(
+            fin=fin,
+            opcode=opcode,
+            masked=masked,
+            payload=payload,
+        )
+        return result, pos + payload_len - start
 
     @classmethod
     def recv(cls, sock: socket):
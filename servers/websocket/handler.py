@@ -1,10 +1,6 @@
 import dataclasses
-import hashlib
-from base64 import b64encode
-from functools import cached_property
 from io import BytesIO
 from socket import socket
-from typing import Optional
 
 from exceptions.connected_closed import ConnectionClosed
 from logger import log
@@ -17,7 +13,7 @@ from servers.websocket.frame import (
     Frame,
     OP_CONTINUATION,
 )
-from utils.field import default_factory
+from servers.websocket.handshake import WebsocketHandshake
 from utils.recv_until import recv_until
 
 
@@ -25,26 +21,38 @@ OUT_SIZE = 2040
 
 
 @dataclasses.dataclass
-class WebsocketHandler(SocketHandler):
+class WebsocketHandler(SocketHandler, WebsocketHandshake):
     sock: socket
     alive: bool = True
-    buf: BytesIO = default_factory(BytesIO, b"")
+    pending: memoryview = memoryview(b"")
 
     def get_host_port_tuple(self):
         return self.sock.getsockname()
 
     def send(self, *args, **kwargs):
-        self.sock.send(Frame(*args, **kwargs).bytes)
-
-    def read(self, n) -> bytes:
-        buffer = bytearray(self.buf.read())
-        while len(buffer) < n:
-            buffer = self.read_frames(buffer)
-        self.buf = BytesIO(buffer)
-        return self.buf.read(n)
+        self.sock.sendall(Frame(*args, **kwargs).bytes)
+
+    def recv_into(self, view: memoryview) -> int:
+        """
+        Hand over the payload of the websocket frames, whole MQTT
+        packets are then framed out of it by the receive buffer
+        """
+        while not self.pending:
+            payload = self.read_frames(bytearray())
+            if payload is None:
+                return 0
+            self.pending = memoryview(payload)
+        count = min(len(view), len(self.pending))
+        view[:count] = self.pending[:count]
+        self.pending = self.pending[count:]
+        return count
 
     def send_bytes(self, payload: bytes):
+        """
+        Send payload as one binary message, every frame of it in a single write
+        """
         buffer = BytesIO(payload)
+        frames = []
         fin = False
         n = buffer.read(OUT_SIZE)
         opcode = OP_BYTES
@@ -52,13 +60,22 @@ class WebsocketHandler(SocketHandler):
             data = n
             n = buffer.read(OUT_SIZE)
             fin = not n
-            self.send(
+            frame = Frame(
                 opcode=opcode,
                 fin=fin,
                 masked=False,
                 payload=data,
             )
+            frames.append(frame.bytes)
             opcode = OP_CONTINUATION
+        self.sock.sendall(b"".join(frames))
+
+    def send_chunks(self, chunks: list[bytes]):
+        """
+        MQTT packets don't have to line up with websocket messages,
+        the whole batch goes out as one message
+        """
+        self.send_bytes(b"".join(chunks))
 
     def start_connection(self):
         upgrade_request = recv_until(self.sock, delimiter="\r\n\r\n")
@@ -120,32 +137,3 @@ class WebsocketHandler(SocketHandler):
                 pass
         self.alive = False
         self.sock.close()
-
-    def get_handshake_response(self, request: str) -> Optional[str]:
-        tokens = request.split("\r\n")
-
-        upgrade_set = ["Upgrade: WebSocket", "Upgrade: websocket", "upgrade: websocket"]
-        label_set = ["Sec-WebSocket-Key", "sec-websocket-key"]
-        if not bool(set(upgrade_set).intersection(tokens)):
-            return None
-        for token in tokens[1:]:
-            label, value = token.split(": ", 1)
-            if label in label_set:
-                return (
-                    "HTTP/1.1 101 Switching Protocols\r\n"
-                    "Upgrade: websocket\r\n"
-                    "Connection: Upgrade\r\n"
-                    f"Sec-WebSocket-Accept: {self.digest(value)}\r\n"
-                    "Sec-WebSocket-Protocol: mqtt\r\n"
-                    "Sec-WebSocket-Version: 13\r\n\r\n"
-                )
-        return None
-
-    def digest(self, client_secret_key):
-        raw = client_secret_key + self.secret_key
-        return b64encode(hashlib.sha1(raw.encode("ascii")).digest()).decode("utf-8")
-
-    @cached_property
-    def secret_key(self):
-        return "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
-        #return str(uuid4())
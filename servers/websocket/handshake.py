@@ -0,0 +1,38 @@
+import hashlib
+from base64 import b64encode
+from functools import cached_property
+from typing import Optional
+
+
+class WebsocketHandshake:
+    """
+    Builds the response to a websocket upgrade request
+    """
+    def get_handshake_response(self, request: str) -> Optional[str]:
+        tokens = request.split("\r\n")
+
+        upgrade_set = ["Upgrade: WebSocket", "Upgrade: websocket", "upgrade: websocket"]
+        label_set = ["Sec-WebSocket-Key", "sec-websocket-key"]
+        if not bool(set(upgrade_set).intersection(tokens)):
+            return None
+        for token in tokens[1:]:
+            label, value = token.split(": ", 1)
+            if label in label_set:
+                return (
+                    "HTTP/1.1 101 Switching Protocols\r\n"
+                    "Upgrade: websocket\r\n"
+                    "Connection: Upgrade\r\n"
+                    f"Sec-WebSocket-Accept: {self.digest(value)}\r\n"
+                    "Sec-WebSocket-Protocol: mqtt\r\n"
+                    "Sec-WebSocket-Version: 13\r\n\r\n"
+                )
+        return None
+
+    def digest(self, client_secret_key):
+        raw = client_secret_key + self.secret_key
+        return b64encode(hashlib.sha1(raw.encode("ascii")).digest()).decode("utf-8")
+
+    @cached_property
+    def secret_key(self):
+        return "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+        #return str(uuid4())
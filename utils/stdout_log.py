@@ -1,7 +1,10 @@
+import atexit
+import os
 import sys
 from dataclasses import dataclass
 from functools import partial
-from threading import Lock
+from queue import Empty, SimpleQueue
+from threading import Event, Lock, Thread
 
 CONTROL_SEQUENCE = "\033["
 DELIMITER = "m"
@@ -33,30 +36,117 @@ FOREGROUND_WHITE = Format(FOREGROUND_SELECTOR, 7)
 
 lock = Lock()
 
+# arguments that can't change between the call and the write, anything else is turned into a string right away
+IMMUTABLE_TYPES = (str, bytes, int, float, bool, type(None))
+
+
+def write_line(fmt: Format, args: tuple, end: str, kwargs: dict):
+    sys.stdout.write(fmt.slug)
+    first = True
+    for arg in args:
+        if first:
+            first = False
+        else:
+            sys.stdout.write(" ")
+        sys.stdout.write(str(arg))
+    first = True
+    for key, arg in kwargs.items():
+        if first:
+            first = False
+        else:
+            sys.stdout.write(" ")
+        sys.stdout.write(str(key))
+        sys.stdout.write("=")
+        sys.stdout.write(str(arg))
+    sys.stdout.write(RESET)
+    if end is not None:
+        sys.stdout.write(end)
+
+
+class BackgroundWriter:
+    """
+    Formats and writes lines on a background thread so that
+    callers never wait on stdout; strings and numbers are only
+    turned into strings once the line is actually written
+    """
+    def __init__(self):
+        self.pid = None
+        self.queue = None
+
+    def ensure_thread(self):
+        # a forked process has our queue, but not our thread
+        with lock:
+            if self.pid != os.getpid():
+                self.queue = SimpleQueue()
+                Thread(target=self.loop, args=[self.queue], daemon=True).start()
+                self.pid = os.getpid()
+
+    def put(self, item):
+        if self.pid != os.getpid():
+            self.ensure_thread()
+        self.queue.put(item)
+
+    @staticmethod
+    def loop(queue: SimpleQueue):
+        while True:
+            item = queue.get()
+            while item is not None:
+                if isinstance(item, Event):
+                    sys.stdout.flush()
+                    item.set()
+                else:
+                    with lock:
+                        try:
+                            write_line(*item)
+                        except Exception as e:
+                            write_fallback(e)
+                try:
+                    item = queue.get_nowait()
+                except Empty:
+                    item = None
+            sys.stdout.flush()
+
+    def flush(self, timeout: float = 5):
+        """
+        Block until everything queued so far has been written
+        """
+        if self.pid != os.getpid():
+            return
+        done = Event()
+        self.queue.put(done)
+        done.wait(timeout)
+
+
+def write_fallback(error: Exception):
+    """
+    A line that could not be written still leaves one behind, instead of taking the writer down
+    """
+    try:
+        sys.stdout.write(f"{RESET}[log line could not be written: {error!r}]\n")
+    except Exception:
+        pass
+
+
+def freeze(arg):
+    """
+    Turn arg into a string now, unless it can't change before the writer gets to it
+    """
+    if isinstance(arg, IMMUTABLE_TYPES):
+        return arg
+    try:
+        return str(arg)
+    except Exception as e:
+        return f"<unprintable {type(arg).__name__}: {e!r}>"
+
+
+writer = BackgroundWriter()
+atexit.register(writer.flush)
+
 
 def printf(fmt: Format, *args, end="\n", **kwargs):
-    with lock:
-        sys.stdout.write(fmt.slug)
-        first = True
-        for arg in args:
-            if first:
-                first = False
-            else:
-                sys.stdout.write(" ")
-            sys.stdout.write(str(arg))
-        first = True
-        for key, arg in kwargs.items():
-            if first:
-                first = False
-            else:
-                sys.stdout.write(" ")
-            sys.stdout.write(str(key))
-            sys.stdout.write("=")
-            sys.stdout.write(str(arg))
-        sys.stdout.write(RESET)
-        if end is not None:
-            sys.stdout.write(end)
-        sys.stdout.flush()
+    args = tuple(freeze(arg) for arg in args)
+    kwargs = {key: freeze(arg) for key, arg in kwargs.items()}
+    writer.put((fmt, args, end, kwargs))
 
 
 print_in_red = partial(printf, FOREGROUND_RED)
@@ -0,0 +1,40 @@
+import pytest
+
+from utils import stdout_log
+from utils.stdout_log import FOREGROUND_GREEN, BackgroundWriter
+
+
+class Unprintable:
+    def __str__(self):
+        raise ValueError("nope")
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    writer = BackgroundWriter()
+    monkeypatch.setattr(stdout_log, "writer", writer)
+    return writer
+
+
+class TestBackgroundWriter:
+    def test_mutable_arguments_are_formatted_at_call_time(self, writer, capsys):
+        data = {"a": 1}
+        stdout_log.printf(FOREGROUND_GREEN, "data", data, seen={1})
+        data["b"] = 2
+        writer.flush()
+        output = capsys.readouterr().out
+        assert "data {'a': 1}" in output
+        assert "seen={1}" in output
+
+    def test_bad_line_does_not_stop_the_writer(self, writer, capsys):
+        writer.put((FOREGROUND_GREEN, (Unprintable(),), "\n", {}))
+        stdout_log.printf(FOREGROUND_GREEN, "after")
+        writer.flush()
+        output = capsys.readouterr().out
+        assert "log line could not be written: ValueError('nope')" in output
+        assert "after" in output
+
+    def test_unprintable_argument_at_call_time(self, writer, capsys):
+        stdout_log.printf(FOREGROUND_GREEN, Unprintable())
+        writer.flush()
+        assert "<unprintable Unprintable: ValueError('nope')>" in capsys.readouterr().out